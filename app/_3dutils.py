@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Sequence, Union
+
+import httpx
+import numpy as np
+
+from . import metrics
+from .batching import MicroBatcher
+from .config import settings
+from .http_clients import encoder
+
+logger = logging.getLogger(__name__)
+
+Points = Union[List[List[float]], np.ndarray]
+
+# Answers meaning "this endpoint does not take batches", as opposed to a
+# transient failure of the encoder.
+BATCH_UNSUPPORTED_STATUSES = (400, 404, 405, 415, 422)
+
+
+class BatchUnsupported(Exception):
+    pass
+
+
+class BatchTooLarge(Exception):
+    # 413: batches are accepted, just not this many clouds at once
+    pass
+
+
+def _request_kwargs(points: Points) -> Dict[str, Any]:
+    if settings.encoder_binary:
+        data = np.ascontiguousarray(points, dtype="<f4").reshape(-1, 3)
+        return {
+            "content": data.tobytes(),
+            "headers": {"Content-Type": "application/octet-stream", "X-Points-Shape": f"{len(data)},3"},
+        }
+    if isinstance(points, np.ndarray):
+        points = points.tolist()
+    return {"json": {"points3d": points}}
+
+
+def _batch_request_kwargs(clouds: Sequence[Points]) -> Dict[str, Any]:
+    """
+    A batch is {"batch": [points3d, ...]} in JSON, or the concatenated
+    float32 clouds with their point counts in X-Points-Counts.
+    """
+    if settings.encoder_binary:
+        arrays = [np.ascontiguousarray(points, dtype="<f4").reshape(-1, 3) for points in clouds]
+        return {
+            "content": b"".join(a.tobytes() for a in arrays),
+            "headers": {
+                "Content-Type": "application/octet-stream",
+                "X-Points-Counts": ",".join(str(len(a)) for a in arrays),
+            },
+        }
+    return {
+        "json": {"batch": [p.tolist() if isinstance(p, np.ndarray) else p for p in clouds]}
+    }
+
+
+async def _encode_single(points: Points) -> List[float]:
+    # Convert 3D-points to embedding-vec with external API.
+    url = settings.encoder_url
+    request_kwargs = _request_kwargs(points)
+
+    for attempt in range(3):
+        try:
+            resp = await encoder.post(url, **request_kwargs)
+            resp.raise_for_status()
+            data = resp.json()
+            if not isinstance(data, dict):
+                raise ValueError("Response JSON is not an object")
+            embedding = data.get("embedding")
+            if embedding is None:
+                raise ValueError("Response JSON does not contain 'embedding'")
+            return embedding
+        except (httpx.HTTPError, ValueError) as e:
+            if attempt < 2:
+                metrics.retries_total.inc(target="encoder")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            raise
+
+
+class BatchingEncoder:
+    """
+    Encoder client that merges concurrent encode() calls into batched
+    requests. Clouds of a batch that could not be encoded together are
+    sent one by one, and batching is switched off for
+    `retry_interval` seconds when the encoder does not accept batches.
+    Until the endpoint has answered a batch once, any error status counts
+    as "does not accept batches" (an encoder that does not know the batch
+    payload may well answer 500). A batch rejected as too large is split
+    in halves, and later batches are kept below its size.
+    """
+
+    def __init__(self, url: str, max_batch: int, max_wait: float, retry_interval: float):
+        self.url = url
+        self.retry_interval = retry_interval
+        self.batcher: MicroBatcher[Points, List[float]] = MicroBatcher(
+            "encoder", self._encode_batch, max_batch, max_wait
+        )
+        self._disabled_until = 0.0
+        # set once a batch was answered: from then on errors are transient
+        self._confirmed = False
+        self.fallbacks = 0
+
+    @property
+    def supported(self) -> bool:
+        return time.monotonic() >= self._disabled_until
+
+    async def encode(self, points: Points) -> List[float]:
+        if not self.supported:
+            return await _encode_single(points)
+        return await self.batcher.submit(points)
+
+    async def _encode_batch(self, clouds: List[Points]) -> List[List[float]]:
+        if len(clouds) > 1 and self.supported:
+            try:
+                return await self._post_batch(clouds)
+            except BatchTooLarge as e:
+                self.batcher.max_batch = min(self.batcher.max_batch, len(clouds) - 1)
+                logger.warning(
+                    f"Encoder rejected a batch of {len(clouds)} clouds as too large ({e}); "
+                    f"splitting it, batches are now limited to {self.batcher.max_batch}"
+                )
+                half = len(clouds) // 2
+                first, second = await asyncio.gather(
+                    self._encode_batch(clouds[:half]), self._encode_batch(clouds[half:])
+                )
+                return [*first, *second]
+            except BatchUnsupported as e:
+                self._disabled_until = time.monotonic() + self.retry_interval
+                logger.warning(
+                    f"Encoder does not accept batches ({e}); "
+                    f"sending single requests for {self.retry_interval:.0f}s"
+                )
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"Batched encoder call for {len(clouds)} clouds failed: {e}")
+            self.fallbacks += 1
+        # failures stay per cloud
+        return await asyncio.gather(
+            *(_encode_single(points) for points in clouds), return_exceptions=True
+        )
+
+    async def _post_batch(self, clouds: List[Points]) -> List[List[float]]:
+        resp = await encoder.post(self.url, **_batch_request_kwargs(clouds))
+        if resp.status_code == 413:
+            raise BatchTooLarge(f"HTTP {resp.status_code}")
+        if resp.status_code in BATCH_UNSUPPORTED_STATUSES or (resp.is_error and not self._confirmed):
+            raise BatchUnsupported(f"HTTP {resp.status_code}")
+        resp.raise_for_status()
+        body = resp.json()
+        if not isinstance(body, dict):
+            raise BatchUnsupported("response is not a JSON object")
+        embeddings = body.get("embeddings")
+        if not isinstance(embeddings, list) or len(embeddings) != len(clouds):
+            raise BatchUnsupported("response has no 'embeddings' list of the batch size")
+        self._confirmed = True
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.batcher.stats()
+        stats["batching_supported"] = self.supported
+        stats["batching_confirmed"] = self._confirmed
+        stats["max_batch"] = self.batcher.max_batch
+        stats["fallbacks"] = self.fallbacks
+        return stats
+
+
+batching_encoder = BatchingEncoder(
+    url=settings.encoder_batch_url or settings.encoder_url,
+    max_batch=settings.encoder_batch_max_size,
+    max_wait=settings.encoder_batch_max_wait,
+    retry_interval=settings.encoder_batch_retry_interval,
+)
+
+
+async def encode_pointcloud(points: Points) -> List[float]:
+    if not settings.encoder_batching:
+        return await _encode_single(points)
+    return await batching_encoder.encode(points)
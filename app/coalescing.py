@@ -0,0 +1,305 @@
+"""
+Single-flight per object id. Concurrent submissions of one id (client
+retries after a proxy timeout, often on several replicas) run once:
+followers in the process wait for the leader and reuse its result; other
+processes on the host wait for the leader's lease in a shared SQLite file.
+Results are kept for a while, so a retry of a finished request (same
+Idempotency-Key, or same body without one) is answered without any work.
+A submission of the same id with a different body waits for the running
+one and then runs itself, so the two do not race on the insert.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from .config import settings
+from .models import ExistingObject, ObjectRequest
+
+logger = logging.getLogger(__name__)
+
+Result = Union[str, ExistingObject]
+
+
+class IdempotencyConflict(ValueError):
+    """
+    An idempotency key was reused for a different request body.
+    """
+
+
+def request_fingerprint(request: ObjectRequest) -> str:
+    """
+    Hash of the fields and the point cloud (as float32) of a request.
+    """
+    digest = hashlib.sha256(request.json(exclude={"pointcloud"}, sort_keys=True).encode())
+    digest.update(np.asarray(request.pointcloud, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def encode_result(result: Result) -> str:
+    if isinstance(result, ExistingObject):
+        return json.dumps({"object": json.loads(result.json())})
+    return json.dumps({"message": result})
+
+
+def decode_result(text: str) -> Result:
+    payload = json.loads(text)
+    if "object" in payload:
+        return ExistingObject(**payload["object"])
+    return payload["message"]
+
+
+class ObjectCoalescer:
+    """
+    Per-id leases and recent results in a SQLite file (may be shared by
+    replicas on one host; ":memory:" or "" keeps both in this process).
+    The holder renews its lease every `lease_ttl / 3` seconds while the
+    work runs; a lease not renewed within `lease_ttl` seconds (crashed
+    holder) is taken over.
+    """
+
+    def __init__(self, path: str, lease_ttl: float = 60.0, result_ttl: float = 300.0, poll_interval: float = 0.05):
+        path = path or ":memory:"
+        self.path = path
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        directory = os.path.dirname(path) if path != ":memory:" else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS object_leases (
+                object_id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS object_results (
+                key TEXT PRIMARY KEY,
+                object_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._puts = 0
+        self._inflight: Dict[str, Tuple[str, str, asyncio.Future]] = {}
+        self._stats: Counter = Counter()
+
+    def recent(self, key: str) -> Optional[Tuple[str, str]]:
+        """
+        (content fingerprint, encoded result) of a finished request.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, result, created_at FROM object_results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[2] < time.time() - self.result_ttl:
+            return None
+        return row[0], row[1]
+
+    def _store(self, key: str, object_id: str, content: str, result: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO object_results (key, object_id, content, result, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, object_id, content, result, now),
+            )
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._conn.execute("DELETE FROM object_results WHERE created_at < ?", (now - self.result_ttl,))
+                self._conn.execute("DELETE FROM object_leases WHERE expires_at < ?", (now,))
+
+    def try_lease(self, object_id: str, holder: str) -> bool:
+        """
+        Take the lease of `object_id` for `holder` (one run of a request)
+        unless someone else holds it.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT owner, expires_at FROM object_leases WHERE object_id = ?", (object_id,)
+                ).fetchone()
+                if row is not None and row[0] != holder and row[1] > now:
+                    self._conn.execute("COMMIT")
+                    return False
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO object_leases (object_id, owner, expires_at) VALUES (?, ?, ?)",
+                    (object_id, holder, now + self.lease_ttl),
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def renew(self, object_id: str, holder: str) -> bool:
+        """
+        Extend a held lease by `lease_ttl`. False if it is no longer ours.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE object_leases SET expires_at = ? WHERE object_id = ? AND owner = ?",
+                (time.time() + self.lease_ttl, object_id, holder),
+            )
+        return cursor.rowcount > 0
+
+    async def _heartbeat(self, object_id: str, holder: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                renewed = await asyncio.to_thread(self.renew, object_id, holder)
+            except Exception as e:
+                logger.error(f"Failed to renew the lease of {object_id}: {e}")
+                continue
+            if not renewed:
+                self._stats["leases_lost"] += 1
+                logger.warning(f"Lease of {object_id} was taken over while it was being processed")
+                return
+
+    def release(self, object_id: str, holder: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM object_leases WHERE object_id = ? AND owner = ?", (object_id, holder)
+            )
+
+    def _replay(self, stored: Tuple[str, str], content: str) -> Result:
+        if stored[0] != content:
+            self._stats["conflicts"] += 1
+            raise IdempotencyConflict("Idempotency key was already used for a different request")
+        self._stats["replayed"] += 1
+        return decode_result(stored[1])
+
+    async def run(self, object_id: str, key: str, content: str, work: Callable[[], Awaitable[Result]]) -> Result:
+        """
+        Result of `work()` for a request, run at most once at a time per
+        object id. `key` identifies the request for followers and replays,
+        `content` is its body fingerprint.
+        """
+        waited = False
+        while True:
+            stored = await asyncio.to_thread(self.recent, key)
+            if stored is not None:
+                return self._replay(stored, content)
+            current = self._inflight.get(object_id)
+            if current is None:
+                break
+            leader_key, leader_content, leader = current
+            if leader_key == key and leader_content != content:
+                self._stats["conflicts"] += 1
+                raise IdempotencyConflict("Idempotency key is in use by a different request")
+            try:
+                result = await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                if not leader.cancelled():
+                    raise
+                # the leading request went away; try again
+                continue
+            except Exception:
+                if leader_key == key:
+                    self._stats["coalesced"] += 1
+                    raise
+                result = None
+            if leader_key == key:
+                self._stats["coalesced"] += 1
+                return result
+            if not waited:
+                waited = True
+                self._stats["serialized"] += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[object_id] = (key, content, future)
+        # per run, so a release finishing after the next run of the id in
+        # this process took the lease does not delete that lease
+        holder = f"{self.owner}:{uuid.uuid4().hex[:8]}"
+        leased = False
+        heartbeat: Optional[asyncio.Task] = None
+        try:
+            while not await asyncio.to_thread(self.try_lease, object_id, holder):
+                if not waited:
+                    waited = True
+                    self._stats["lease_waits"] += 1
+                await asyncio.sleep(self.poll_interval)
+                stored = await asyncio.to_thread(self.recent, key)
+                if stored is not None:
+                    # another replica finished the same request
+                    result = self._replay(stored, content)
+                    future.set_result(result)
+                    return result
+            leased = True
+            heartbeat = asyncio.create_task(self._heartbeat(object_id, holder))
+            self._stats["leaders"] += 1
+            result = await work()
+            try:
+                await asyncio.to_thread(self._store, key, object_id, content, encode_result(result))
+            except Exception as e:
+                self._stats["store_errors"] += 1
+                logger.error(f"Failed to keep the result of {object_id} for retries: {e}")
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark retrieved so a failure nobody waited for is not logged
+            future.exception()
+            raise
+        finally:
+            del self._inflight[object_id]
+            if heartbeat is not None:
+                heartbeat.cancel()
+            if leased:
+                try:
+                    # shielded: a cancelled request still gives the lease back
+                    await asyncio.shield(asyncio.to_thread(self.release, object_id, holder))
+                except Exception as e:
+                    # the lease expires after lease_ttl anyway
+                    logger.error(f"Failed to release the lease of {object_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            results = self._conn.execute("SELECT COUNT(*) FROM object_results").fetchone()[0]
+            leases = self._conn.execute(
+                "SELECT COUNT(*) FROM object_leases WHERE expires_at >= ?", (time.time(),)
+            ).fetchone()[0]
+        return {
+            "inflight": len(self._inflight),
+            "leases": leases,
+            "results": results,
+            **{name: self._stats[name] for name in (
+                "leaders", "coalesced", "replayed", "serialized", "lease_waits", "leases_lost", "conflicts",
+                "store_errors",
+            )},
+        }
+
+
+object_coalescer = ObjectCoalescer(
+    settings.coalesce_path,
+    lease_ttl=settings.coalesce_lease_ttl,
+    result_ttl=settings.coalesce_result_ttl,
+    poll_interval=settings.coalesce_poll_interval,
+)
@@ -9,20 +9,234 @@ class Settings(BaseSettings):
     # OpenAI LLM settings
     openai_api_key: str = Field("", env="OPENAI_API_KEY")
     openai_model: str = Field("gpt-4", env="OPENAI_MODEL")
+    openai_api_base: str = Field("https://api.openai.com/v1", env="OPENAI_API_BASE")
 
     # Milvus configuration
     milvus_host: str = Field("localhost", env="MILVUS_HOST")
     milvus_port: int = Field(19530, env="MILVUS_PORT")
+    milvus_connect_retries: int = Field(10, env="MILVUS_CONNECT_RETRIES")
+    milvus_connect_backoff: float = Field(1.0, env="MILVUS_CONNECT_BACKOFF")
 
-    # 3D point cloud encoder service
+    # ANN index on the embedding field (FLAT, IVF_FLAT, IVF_SQ8, IVF_PQ, HNSW).
+    # Changing these requires `python -m app.index_admin rebuild`.
+    milvus_index_type: str = Field("IVF_FLAT", env="MILVUS_INDEX_TYPE")
+    milvus_ivf_nlist: int = Field(1024, env="MILVUS_IVF_NLIST")
+    milvus_ivf_nprobe: int = Field(16, env="MILVUS_IVF_NPROBE")
+    milvus_pq_m: int = Field(32, env="MILVUS_PQ_M")
+    milvus_pq_nbits: int = Field(8, env="MILVUS_PQ_NBITS")
+    milvus_hnsw_m: int = Field(16, env="MILVUS_HNSW_M")
+    milvus_hnsw_ef_construction: int = Field(200, env="MILVUS_HNSW_EF_CONSTRUCTION")
+    milvus_hnsw_ef: int = Field(64, env="MILVUS_HNSW_EF")
+
+    # 3D point cloud encoder service. With ENCODER_BINARY the points are sent
+    # as raw little-endian float32 N x 3 (application/octet-stream) instead of JSON.
     encoder_url: str = Field("http://inner-test.env:8922/3dpointsencoder", env="ENCODER_URL")
+    encoder_binary: bool = Field(False, env="ENCODER_BINARY")
+
+    # LLM admission per process (requests and tokens per minute, 0 = no
+    # limit; divide the account limits by the number of replicas). Bursts of
+    # up to LLM_BURST_SECONDS worth of budget go through at once. Ingest
+    # calls are admitted before filter generation. When the budget is used
+    # up, LLM_SATURATION_POLICY "wait" queues calls for at most
+    # LLM_QUEUE_MAX_WAIT seconds, "degrade" answers without the LLM where a
+    # deterministic fallback exists, and "reject" answers 429 at once.
+    llm_rpm: float = Field(120, env="LLM_RPM")
+    llm_tpm: float = Field(40000, env="LLM_TPM")
+    llm_burst_seconds: float = Field(10.0, env="LLM_BURST_SECONDS")
+    llm_saturation_policy: str = Field("wait", env="LLM_SATURATION_POLICY")
+    llm_queue_max_wait: float = Field(10.0, env="LLM_QUEUE_MAX_WAIT")
+
+    # Micro-batching of LLM calls: concurrent normalizations (and decisions)
+    # arriving within LLM_BATCH_MAX_WAIT seconds share one prompt
+    llm_batching: bool = Field(True, env="LLM_BATCHING")
+    llm_batch_max_size: int = Field(16, env="LLM_BATCH_MAX_SIZE")
+    llm_batch_max_wait: float = Field(0.02, env="LLM_BATCH_MAX_WAIT")
+
+    # Micro-batching of encoder calls: concurrent clouds are sent together,
+    # up to ENCODER_BATCH_MAX_SIZE per request or after ENCODER_BATCH_MAX_WAIT
+    # seconds. An encoder that rejects batches is called per cloud again and
+    # re-probed after ENCODER_BATCH_RETRY_INTERVAL seconds.
+    encoder_batching: bool = Field(True, env="ENCODER_BATCHING")
+    encoder_batch_url: str = Field("", env="ENCODER_BATCH_URL")  # empty: ENCODER_URL
+    encoder_batch_max_size: int = Field(32, env="ENCODER_BATCH_MAX_SIZE")
+    encoder_batch_max_wait: float = Field(0.01, env="ENCODER_BATCH_MAX_WAIT")
+    encoder_batch_retry_interval: float = Field(300.0, env="ENCODER_BATCH_RETRY_INTERVAL")
+
+    # Point-cloud preprocessing before encoding: bbox crop, voxel
+    # downsampling, statistical outlier removal, centroid normalization.
+    # Changing these changes the embeddings of new objects.
+    preprocess_enabled: bool = Field(True, env="PREPROCESS_ENABLED")
+    preprocess_crop_to_bbox: bool = Field(True, env="PREPROCESS_CROP_TO_BBOX")
+    preprocess_bbox_margin: float = Field(0.1, env="PREPROCESS_BBOX_MARGIN")
+    preprocess_min_crop_fraction: float = Field(0.2, env="PREPROCESS_MIN_CROP_FRACTION")
+    preprocess_voxel_size: float = Field(0.05, env="PREPROCESS_VOXEL_SIZE")
+    preprocess_outlier_neighbors: int = Field(16, env="PREPROCESS_OUTLIER_NEIGHBORS")
+    preprocess_outlier_std_ratio: float = Field(2.0, env="PREPROCESS_OUTLIER_STD_RATIO")
+    preprocess_outlier_max_points: int = Field(20000, env="PREPROCESS_OUTLIER_MAX_POINTS")
+    preprocess_center: bool = Field(True, env="PREPROCESS_CENTER")
+    preprocess_coverage_grid: int = Field(16, env="PREPROCESS_COVERAGE_GRID")
+
+    # Embedding cache keyed by a hash of the preprocessed cloud (coordinates
+    # snapped to EMBEDDING_CACHE_QUANTUM). The disk tier is off unless
+    # EMBEDDING_CACHE_DIR is set; replicas on one host may share it.
+    # Bump EMBEDDING_CACHE_NAMESPACE when the encoder model changes.
+    embedding_cache_entries: int = Field(20000, env="EMBEDDING_CACHE_ENTRIES")
+    embedding_cache_dir: str = Field("", env="EMBEDDING_CACHE_DIR")
+    embedding_cache_disk_max_bytes: int = Field(1 << 30, env="EMBEDDING_CACHE_DISK_MAX_BYTES")
+    embedding_cache_quantum: float = Field(1e-3, env="EMBEDDING_CACHE_QUANTUM")
+    embedding_cache_namespace: str = Field("v1", env="EMBEDDING_CACHE_NAMESPACE")
+
+    # Concurrent submissions of one object id run once: followers in the
+    # process wait for the leader, other replicas on the host wait for its
+    # lease in COALESCE_PATH (SQLite; "" = this process only), checking every
+    # COALESCE_POLL_INTERVAL seconds. The leader renews its lease every
+    # COALESCE_LEASE_TTL / 3 seconds; a lease not renewed for
+    # COALESCE_LEASE_TTL seconds (crashed leader) is taken over. Results are returned again for
+    # COALESCE_RESULT_TTL seconds to a request with the same Idempotency-Key
+    # header (or the same body, without one).
+    coalesce_enabled: bool = Field(True, env="COALESCE_ENABLED")
+    coalesce_path: str = Field("data/coalesce.sqlite3", env="COALESCE_PATH")
+    coalesce_lease_ttl: float = Field(60.0, env="COALESCE_LEASE_TTL")
+    coalesce_poll_interval: float = Field(0.05, env="COALESCE_POLL_INTERVAL")
+    coalesce_result_ttl: float = Field(300.0, env="COALESCE_RESULT_TTL")
+
+    # Catalog of stored types with per-city counts (SQLite file, may be shared
+    # by replicas on one host). The filter prompt lists at most
+    # TYPE_CATALOG_PROMPT_LIMIT of the most frequent types.
+    type_catalog_path: str = Field("data/type_catalog.sqlite3", env="TYPE_CATALOG_PATH")
+    type_catalog_prompt_limit: int = Field(200, env="TYPE_CATALOG_PROMPT_LIMIT")
+
+    # Compiled filter expressions per condition and type vocabulary version
+    # (SQLite file, may be shared by replicas on one host); 0 = no expiry
+    filter_cache_path: str = Field("data/filter_cache.sqlite3", env="FILTER_CACHE_PATH")
+    filter_cache_ttl: float = Field(30 * 24 * 3600.0, env="FILTER_CACHE_TTL")
+
+    # Type normalization: admin overrides and LLM answers (SQLite file, may be
+    # shared by replicas on one host; LLM answers expire after
+    # TYPE_NORMALIZER_TTL seconds, 0 = never) and an optional JSON file of
+    # {"alias": "Canonical"} pairs extending the built-in dictionary
+    type_normalizer_path: str = Field("data/type_normalizer.sqlite3", env="TYPE_NORMALIZER_PATH")
+    type_normalizer_ttl: float = Field(90 * 24 * 3600.0, env="TYPE_NORMALIZER_TTL")
+    type_normalizer_memory_entries: int = Field(10000, env="TYPE_NORMALIZER_MEMORY_ENTRIES")
+    type_dictionary_path: str = Field("", env="TYPE_DICTIONARY_PATH")
+
+    # Largest accepted point cloud of a binary upload
+    max_points: int = Field(2_000_000, env="MAX_POINTS")
 
     # Callback for new or updated 3D objects
     new_object_url: str = Field("http://inner-test.env:8922/new3dobject", env="NEW_OBJ_URL")
 
+    # Notification outbox (SQLite file, may be shared by replicas on one host).
+    # With NOTIFY_BATCH_SIZE > 1 the callback receives {"objects": [...]}.
+    outbox_path: str = Field("data/outbox.sqlite3", env="OUTBOX_PATH")
+    outbox_workers: int = Field(2, env="OUTBOX_WORKERS")
+    outbox_poll_interval: float = Field(1.0, env="OUTBOX_POLL_INTERVAL")
+    outbox_lease_seconds: float = Field(60.0, env="OUTBOX_LEASE_SECONDS")
+    notify_batch_size: int = Field(20, env="NOTIFY_BATCH_SIZE")
+    notify_include_points: bool = Field(True, env="NOTIFY_INCLUDE_POINTS")
+    # "json": points3d as [[x, y, z], ...]; "float32_base64": points3d_b64 as
+    # base64 of little-endian float32 N x 3
+    notify_points_format: str = Field("json", env="NOTIFY_POINTS_FORMAT")
+    notify_retry_base: float = Field(1.0, env="NOTIFY_RETRY_BASE")
+    notify_retry_max: float = Field(300.0, env="NOTIFY_RETRY_MAX")
+    # attempts before a notification is moved to the dead-letter table
+    notify_max_attempts: int = Field(20, env="NOTIFY_MAX_ATTEMPTS")
+
+    # Shared keep-alive HTTP pools: max parallel requests and per-request
+    # timeout (seconds) for each downstream service
+    encoder_max_concurrency: int = Field(32, env="ENCODER_MAX_CONCURRENCY")
+    encoder_timeout: float = Field(5.0, env="ENCODER_TIMEOUT")
+    notifier_max_concurrency: int = Field(16, env="NOTIFIER_MAX_CONCURRENCY")
+    notifier_timeout: float = Field(5.0, env="NOTIFIER_TIMEOUT")
+    llm_max_concurrency: int = Field(16, env="LLM_MAX_CONCURRENCY")
+    llm_timeout: float = Field(20.0, env="LLM_TIMEOUT")
+    http_keepalive_expiry: float = Field(30.0, env="HTTP_KEEPALIVE_EXPIRY")
+
+    # Time budget (seconds) of each ingest stage, including retries and
+    # waiting for a free connection
+    stage_timeout_normalize: float = Field(20.0, env="STAGE_TIMEOUT_NORMALIZE")
+    stage_timeout_encode: float = Field(15.0, env="STAGE_TIMEOUT_ENCODE")
+    stage_timeout_search: float = Field(5.0, env="STAGE_TIMEOUT_SEARCH")
+    stage_timeout_decide: float = Field(20.0, env="STAGE_TIMEOUT_DECIDE")
+    stage_timeout_insert: float = Field(10.0, env="STAGE_TIMEOUT_INSERT")
+
+    # Observability: /metrics is always served; TRACING_ENABLED records
+    # OpenTelemetry spans for stages and Milvus RPCs (needs the opentelemetry
+    # packages and an SDK/exporter set up, e.g. by opentelemetry-instrument);
+    # PROFILER_ENABLED allows starting the sampling profiler at runtime via
+    # /debug/profiler, taking a stack sample every PROFILER_INTERVAL seconds.
+    tracing_enabled: bool = Field(False, env="TRACING_ENABLED")
+    profiler_enabled: bool = Field(False, env="PROFILER_ENABLED")
+    profiler_interval: float = Field(0.005, env="PROFILER_INTERVAL")
+    profiler_max_seconds: float = Field(300.0, env="PROFILER_MAX_SECONDS")
+
     # Dimension of the 3D embeddings
     vector_dim: int = Field(256, env="VECTOR_DIM")
 
+    # Max L2 (squared) distance at which a stored object counts as the same object
+    dedup_distance_threshold: float = Field(0.8, env="DEDUP_DISTANCE_THRESHOLD")
+    # only match existing objects of the same city (filtered inside Milvus)
+    dedup_same_city: bool = Field(True, env="DEDUP_SAME_CITY")
+    # Milvus partitions rows by city ("city"), by geohash tile of lat/lon
+    # ("geohash"), by both ("city_geohash") or not at all ("off"). A dedup
+    # search scans the tile of the object, its 8 neighbors and `_default`
+    # (rows written before partitioning, or without a city/location).
+    # Precision 4 tiles are about 39 x 20 km; keep the number of partitions
+    # below the Milvus limit (rootCoord.maxPartitionNum, 4096 by default).
+    partition_mode: str = Field("city_geohash", env="PARTITION_MODE")
+    partition_geohash_precision: int = Field(4, env="PARTITION_GEOHASH_PRECISION")
+    # Dedup is tried first against the last HOT_SET_SIZE inserted objects in
+    # memory, not older than HOT_SET_MAX_AGE seconds (0 = no limit)
+    hot_set_enabled: bool = Field(True, env="HOT_SET_ENABLED")
+    hot_set_size: int = Field(10000, env="HOT_SET_SIZE")
+    hot_set_max_age: float = Field(900.0, env="HOT_SET_MAX_AGE")
+    # Dedup stores, queried in parallel by RETRIEVER_THREADS threads, with a
+    # deadline per store ("name=seconds,..."; others: STAGE_TIMEOUT_SEARCH).
+    # "first_confident" returns a hit at or below RETRIEVER_CONFIDENT_DISTANCE
+    # without waiting for slower stores; "best" always takes the closest hit.
+    retrievers: str = Field("hot_set,milvus", env="RETRIEVERS")
+    retriever_deadlines: str = Field("hot_set=0.05,milvus=4.0", env="RETRIEVER_DEADLINES")
+    retriever_policy: str = Field("first_confident", env="RETRIEVER_POLICY")
+    retriever_confident_distance: float = Field(0.1, env="RETRIEVER_CONFIDENT_DISTANCE")
+    retriever_threads: int = Field(8, env="RETRIEVER_THREADS")
+
+    # Update decisions for dedup hits: rules decide clear-cut cases, the LLM
+    # the rest. Density and geometry rules need a bbox IoU of at least
+    # DECISION_MIN_IOU; "unchanged" also needs a center shift (share of the
+    # bbox diagonal) and embedding distance at most the DECISION_SAME_* limits.
+    decision_rules_enabled: bool = Field(True, env="DECISION_RULES_ENABLED")
+    decision_min_iou: float = Field(0.5, env="DECISION_MIN_IOU")
+    decision_sparse_ratio: float = Field(0.5, env="DECISION_SPARSE_RATIO")
+    decision_dense_ratio: float = Field(2.0, env="DECISION_DENSE_RATIO")
+    decision_same_iou: float = Field(0.9, env="DECISION_SAME_IOU")
+    decision_same_shift: float = Field(0.05, env="DECISION_SAME_SHIFT")
+    decision_same_distance: float = Field(0.1, env="DECISION_SAME_DISTANCE")
+    # LLM decisions cached in memory per input (seconds, 0 = no expiry), and
+    # the number of recent decisions shown by /stats/decisions
+    decision_cache_size: int = Field(10000, env="DECISION_CACHE_SIZE")
+    decision_cache_ttl: float = Field(3600.0, env="DECISION_CACHE_TTL")
+    decision_log_size: int = Field(200, env="DECISION_LOG_SIZE")
+
+    # ID streams: rows fetched from Milvus per page (at most 16384) and gzip
+    # level used when the client sends Accept-Encoding: gzip
+    stream_page_size: int = Field(10000, env="STREAM_PAGE_SIZE")
+    stream_gzip_level: int = Field(6, env="STREAM_GZIP_LEVEL")
+    # Area queries (/objects/near, /objects/within) read only the partitions
+    # of the geohash tiles under the area, unless it spans more than
+    # SPATIAL_MAX_TILES tiles; then the lat/lon indexes alone select the rows
+    spatial_max_tiles: int = Field(256, env="SPATIAL_MAX_TILES")
+
+    # Upper bound for objects accepted by /objects/batch
+    batch_max_objects: int = Field(1000, env="BATCH_MAX_OBJECTS")
+
+    # Write-behind buffer for Milvus inserts: rows are written when
+    # max_rows are pending or after flush_interval seconds. With max_pending
+    # rows waiting, an insert waits up to put_timeout seconds, then fails
+    write_buffer_max_rows: int = Field(500, env="WRITE_BUFFER_MAX_ROWS")
+    write_buffer_flush_interval: float = Field(1.0, env="WRITE_BUFFER_FLUSH_INTERVAL")
+    write_buffer_max_pending: int = Field(5000, env="WRITE_BUFFER_MAX_PENDING")
+    write_buffer_put_timeout: float = Field(5.0, env="WRITE_BUFFER_PUT_TIMEOUT")
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def cloud_key(points: np.ndarray, quantum: float, namespace: str) -> str:
+    """
+    Content hash of a point cloud that ignores point order and noise below
+    `quantum`: coordinates are snapped to the quantum grid and rows sorted
+    before hashing. `namespace` separates encoders/models.
+    """
+    grid = np.round(np.asarray(points, dtype=np.float64) / quantum).astype(np.int64)
+    if len(grid):
+        grid = grid[np.lexsort((grid[:, 2], grid[:, 1], grid[:, 0]))]
+    digest = hashlib.sha256(namespace.encode())
+    digest.update(np.ascontiguousarray(grid).tobytes())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by cloud_key():
+
+    * an in-process LRU of `memory_entries` embeddings,
+    * an optional directory of .npy files (`disk_dir`) that replicas on
+      the same host can share, trimmed to `disk_max_bytes` by evicting the
+      least recently used files.
+
+    Concurrent misses for the same key share one encoder call.
+    """
+
+    def __init__(
+        self,
+        memory_entries: int,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 0,
+        quantum: float = 1e-3,
+        namespace: str = "",
+    ):
+        self.memory_entries = memory_entries
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self.quantum = quantum
+        self.namespace = namespace
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._disk_bytes: Optional[int] = None
+        self._puts_since_scan = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "disk_errors": 0,
+        }
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def key(self, points: np.ndarray) -> str:
+        return cloud_key(points, self.quantum, self.namespace)
+
+    async def get_or_compute(
+        self,
+        points: np.ndarray,
+        compute: Callable[[], Awaitable[List[float]]],
+        key: Optional[str] = None
+    ) -> List[float]:
+        """
+        Cached embedding of `points`, or the result of `compute()`. Pass
+        `key` if it was already computed off the event loop; otherwise it is
+        computed in a worker thread (hashing a large cloud takes a while).
+        """
+        if key is None:
+            key = await asyncio.to_thread(self.key, points)
+        cached = self._memory_get(key)
+        if cached is not None:
+            return cached.tolist()
+
+        while key in self._inflight:
+            leader = self._inflight[key]
+            self._stats["coalesced"] += 1
+            try:
+                return (await asyncio.shield(leader)).tolist()
+            except asyncio.CancelledError:
+                if not leader.cancelled():
+                    raise
+                # the leading request went away; compute it ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            embedding = await asyncio.to_thread(self._disk_get, key) if self.disk_dir else None
+            if embedding is None:
+                self._stats["misses"] += 1
+                embedding = np.asarray(await compute(), dtype=np.float32)
+                if self.disk_dir:
+                    await asyncio.to_thread(self._disk_put, key, embedding)
+            self._memory_put(key, embedding)
+            future.set_result(embedding)
+            return embedding.tolist()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark retrieved so a failure nobody waited for is not logged
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _memory_get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+            return embedding
+
+    def _memory_put(self, key: str, embedding: np.ndarray) -> None:
+        if self.memory_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+                self._stats["memory_evictions"] += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npy")
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            embedding = np.load(path, allow_pickle=False)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable embedding cache file {path}: {e}")
+            self._stats["disk_errors"] += 1
+            return None
+        self._stats["disk_hits"] += 1
+        return embedding
+
+    def _disk_put(self, key: str, embedding: np.ndarray) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                np.save(f, embedding, allow_pickle=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Failed to write embedding cache file {path}: {e}")
+            self._stats["disk_errors"] += 1
+            return
+        with self._lock:
+            self._puts_since_scan += 1
+            if self._disk_bytes is not None:
+                self._disk_bytes += os.path.getsize(path)
+            # other replicas write too, so rescan the directory now and then
+            needs_scan = (
+                self._disk_bytes is None
+                or self._disk_bytes > self.disk_max_bytes
+                or self._puts_since_scan >= 1000
+            )
+        if self.disk_max_bytes and needs_scan:
+            self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        """
+        Delete least recently used files until the directory is at 90% of
+        disk_max_bytes. Files of other replicas count too.
+        """
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        target = int(self.disk_max_bytes * 0.9)
+        if total > self.disk_max_bytes:
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._stats["disk_evictions"] += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._puts_since_scan = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+embedding_cache = EmbeddingCache(
+    memory_entries=settings.embedding_cache_entries,
+    disk_dir=settings.embedding_cache_dir,
+    disk_max_bytes=settings.embedding_cache_disk_max_bytes,
+    quantum=settings.embedding_cache_quantum,
+    namespace=f"{settings.encoder_url}|{settings.embedding_cache_namespace}",
+)
@@ -0,0 +1,129 @@
+"""
+Local stand-in for the 3D encoder service, for offline runs and for
+exercising encoder micro-batching:
+
+    uvicorn app.fakes.encoder:app --port 8922
+    ENCODER_URL=http://localhost:8922/3dpointsencoder uvicorn app.main:app
+
+It speaks the same protocol as the encoder client: {"points3d": [...]} or
+raw float32 with X-Points-Shape for one cloud, {"batch": [...]} or raw
+float32 with X-Points-Counts for a batch. Embeddings are deterministic,
+ignore point order and change little under small noise, so duplicates
+are still found.
+
+Like a GPU model server it runs one inference at a time, costing
+FAKE_ENCODER_LATENCY seconds per call plus FAKE_ENCODER_LATENCY_PER_CLOUD
+per cloud. FAKE_ENCODER_BATCHING=false makes it reject batches with 422;
+FAKE_ENCODER_ERROR_RATE answers that share of calls with 503.
+"""
+import asyncio
+import os
+import random
+from typing import List
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+
+DIM = int(os.environ.get("FAKE_ENCODER_DIM", "256"))
+LATENCY = float(os.environ.get("FAKE_ENCODER_LATENCY", "0.02"))
+LATENCY_PER_CLOUD = float(os.environ.get("FAKE_ENCODER_LATENCY_PER_CLOUD", "0.002"))
+BATCHING = os.environ.get("FAKE_ENCODER_BATCHING", "true").lower() in ("1", "true", "yes")
+MAX_BATCH = int(os.environ.get("FAKE_ENCODER_MAX_BATCH", "64"))
+SEED = int(os.environ.get("FAKE_ENCODER_SEED", "0"))
+ERROR_RATE = float(os.environ.get("FAKE_ENCODER_ERROR_RATE", "0"))
+
+RADIAL_BINS = 16
+AXIS_BINS = 8
+RANGE = 2.5  # metres around the centroid covered by the histograms
+N_FEATURES = 3 + 3 + RADIAL_BINS + 3 * AXIS_BINS
+
+_projection = np.random.default_rng(SEED).standard_normal((N_FEATURES, DIM)).astype(np.float32)
+_device = asyncio.Lock()
+_random = random.Random(SEED)
+_stats = {"calls": 0, "batch_calls": 0, "clouds": 0, "errors": 0}
+
+app = FastAPI(title="Fake 3D encoder")
+
+
+def embed(points: np.ndarray) -> List[float]:
+    """
+    Shape descriptor (spread along principal axes, extent, radial and
+    per-axis point histograms) projected to DIM and scaled to length 2.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    features = np.zeros(N_FEATURES)
+    if len(points):
+        centered = points - points.mean(axis=0)
+        if len(points) > 1:
+            features[0:3] = np.sqrt(np.maximum(np.linalg.eigvalsh(np.cov(centered.T)), 0))
+        features[3:6] = centered.max(axis=0) - centered.min(axis=0)
+        radial = np.linalg.norm(centered, axis=1)
+        offset = 6
+        features[offset:offset + RADIAL_BINS] = np.histogram(radial, RADIAL_BINS, (0, RANGE))[0] / len(points)
+        offset += RADIAL_BINS
+        for axis in range(3):
+            hist = np.histogram(centered[:, axis], AXIS_BINS, (-RANGE, RANGE))[0] / len(points)
+            features[offset:offset + AXIS_BINS] = hist
+            offset += AXIS_BINS
+        features[0:6] = np.log1p(features[0:6])
+        # histogram shares relative to a uniform spread, so unrelated
+        # shapes end up far apart rather than sharing a common direction
+        features[6:] = features[6:] * np.r_[np.full(RADIAL_BINS, RADIAL_BINS), np.full(3 * AXIS_BINS, AXIS_BINS)] - 1
+    vector = features.astype(np.float32) @ _projection
+    norm = np.linalg.norm(vector)
+    return (vector / norm * 2.0 if norm else vector).tolist()
+
+
+async def _infer(clouds: List[np.ndarray]) -> List[List[float]]:
+    async with _device:
+        await asyncio.sleep(LATENCY + LATENCY_PER_CLOUD * len(clouds))
+        _stats["calls"] += 1
+        _stats["batch_calls"] += len(clouds) > 1
+        _stats["clouds"] += len(clouds)
+        if _random.random() < ERROR_RATE:
+            _stats["errors"] += 1
+            raise HTTPException(503, "injected error")
+        return [embed(cloud) for cloud in clouds]
+
+
+def _split_raw(body: bytes, counts: List[int]) -> List[np.ndarray]:
+    data = np.frombuffer(body, dtype="<f4")
+    if len(data) != 3 * sum(counts):
+        raise HTTPException(400, "Body size does not match the point counts")
+    bounds = np.cumsum([0] + counts) * 3
+    return [data[start:end].reshape(-1, 3) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+@app.post("/3dpointsencoder")
+async def encode(request: Request):
+    body = await request.body()
+    batch = False
+    if request.headers.get("content-type", "").startswith("application/octet-stream"):
+        if "x-points-counts" in request.headers:
+            batch = True
+            counts = [int(n) for n in request.headers["x-points-counts"].split(",")]
+        else:
+            counts = [int(request.headers.get("x-points-shape", f"{len(body) // 12},3").split(",")[0])]
+        clouds = _split_raw(body, counts)
+    else:
+        payload = await request.json()
+        if "batch" in payload:
+            batch = True
+            clouds = [np.asarray(points, dtype=np.float32) for points in payload["batch"]]
+        elif "points3d" in payload:
+            clouds = [np.asarray(payload["points3d"], dtype=np.float32)]
+        else:
+            raise HTTPException(422, "Expected 'points3d' or 'batch'")
+
+    if batch:
+        if not BATCHING:
+            raise HTTPException(422, "Batches are not supported")
+        if len(clouds) > MAX_BATCH:
+            raise HTTPException(413, f"At most {MAX_BATCH} clouds per batch")
+        return {"embeddings": await _infer(clouds)}
+    return {"embedding": (await _infer(clouds))[0]}
+
+
+@app.get("/stats")
+def stats():
+    return dict(_stats, batching=BATCHING)
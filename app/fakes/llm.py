@@ -0,0 +1,150 @@
+"""
+Local stand-in for the OpenAI chat completions API, for offline runs and
+for exercising LLM micro-batching:
+
+    uvicorn app.fakes.llm:app --port 8923
+    OPENAI_API_BASE=http://localhost:8923/v1 uvicorn app.main:app
+
+It recognizes the service's prompts (type normalization, update
+decisions, filter expressions; single and batched) and answers them
+deterministically: a type becomes the last word of the label in title
+case, an update is chosen when the capture time is after the stored
+timestamp, and a filter selects the stored types named in the condition.
+
+Each call takes FAKE_LLM_LATENCY seconds plus FAKE_LLM_LATENCY_PER_ITEM
+per batched item. FAKE_LLM_ERROR_RATE answers that share of calls with
+500, FAKE_LLM_MALFORMED_RATE returns a broken JSON array for that share
+of batched prompts, and FAKE_LLM_RPM > 0 answers calls above that many
+per minute with 429.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.3"))
+LATENCY_PER_ITEM = float(os.environ.get("FAKE_LLM_LATENCY_PER_ITEM", "0.01"))
+ERROR_RATE = float(os.environ.get("FAKE_LLM_ERROR_RATE", "0"))
+MALFORMED_RATE = float(os.environ.get("FAKE_LLM_MALFORMED_RATE", "0"))
+RPM = int(os.environ.get("FAKE_LLM_RPM", "0"))
+
+_random = random.Random(int(os.environ.get("FAKE_LLM_SEED", "0")))
+_recent_calls: deque = deque()
+_stats = {"calls": 0, "batch_calls": 0, "items": 0, "errors": 0, "malformed": 0, "rate_limited": 0}
+
+app = FastAPI(title="Fake LLM")
+
+
+def normalize(raw: str) -> str:
+    words = re.findall(r"[^\W\d_]+", raw)
+    return words[-1].title() if words else "Unknown"
+
+
+def _parse_time(text: str) -> datetime:
+    value = datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def decide(case: str) -> dict:
+    stored = re.search(r"- Timestamp: (\S+)", case)
+    captured = re.search(r"- Capture time: (\S+)", case)
+    try:
+        newer = _parse_time(captured.group(1)) > _parse_time(stored.group(1))
+    except (AttributeError, ValueError):
+        newer = False
+    if newer:
+        return {"decision": "update", "reason": "the new capture is more recent"}
+    return {"decision": "keep", "reason": "the stored capture is as recent"}
+
+
+def filter_expression(prompt: str) -> str:
+    condition = re.search(r'Condition: "(.*)"', prompt)
+    stored = re.search(r"Stored `type` values: (\[.*\])", prompt)
+    types: List[str] = json.loads(stored.group(1)) if stored else []
+    wanted = condition.group(1).lower() if condition else ""
+    chosen = [t for t in types if t.lower() in wanted]
+    return f"type in {json.dumps(chosen)}" if chosen else 'type != ""'
+
+
+def answer(system: str, prompt: str) -> tuple:
+    """
+    (content, number of items) for a prompt of the service.
+    """
+    if "normalize" in system:
+        batch = re.search(r"Inputs \(JSON array\): (\[.*\])", prompt)
+        if batch:
+            raws = json.loads(batch.group(1))
+            return json.dumps([normalize(raw) for raw in raws], ensure_ascii=False), len(raws)
+        single = re.search(r'Input: "(.*)"', prompt)
+        return normalize(single.group(1) if single else ""), 1
+    if "updating" in system:
+        cases = re.split(r"^Case \d+:\n", prompt, flags=re.M)[1:]
+        if cases:
+            return json.dumps([decide(case) for case in cases]), len(cases)
+        return json.dumps(decide(prompt)), 1
+    if "Milvus" in system:
+        return filter_expression(prompt), 1
+    if "included and excluded" in system:
+        labels = json.loads(re.search(r"(\[.*\])", prompt).group(1).replace("'", '"'))
+        return json.dumps({"included": labels, "excluded": []}), 1
+    return "OK", 1
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    messages = {m["role"]: m["content"] for m in payload.get("messages", [])}
+    system, prompt = messages.get("system", ""), messages.get("user", "")
+
+    now = time.monotonic()
+    while _recent_calls and _recent_calls[0] < now - 60:
+        _recent_calls.popleft()
+    if RPM and len(_recent_calls) >= RPM:
+        _stats["rate_limited"] += 1
+        retry_after = max(0.0, _recent_calls[0] + 60 - now)
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests"}},
+            headers={"Retry-After": f"{retry_after:.0f}"},
+        )
+    _recent_calls.append(now)
+
+    content, items = answer(system, prompt)
+    _stats["calls"] += 1
+    _stats["batch_calls"] += items > 1
+    _stats["items"] += items
+    await asyncio.sleep(LATENCY + LATENCY_PER_ITEM * items)
+
+    if _random.random() < ERROR_RATE:
+        _stats["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Injected failure"}})
+    if items > 1 and _random.random() < MALFORMED_RATE:
+        _stats["malformed"] += 1
+        content = content[: len(content) // 2]
+
+    prompt_tokens = (len(system) + len(prompt)) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"fake-{_stats['calls']}",
+        "object": "chat.completion",
+        "model": payload.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@app.get("/stats")
+def stats():
+    return dict(_stats)
@@ -0,0 +1,281 @@
+"""
+In-memory stand-in for the `object_vectors` collection, for offline runs
+and benchmarks:
+
+    from app import milvus_client
+    from app.fakes.milvus import FakeCollection
+    milvus_client.use_collection(FakeCollection())  # before startup
+
+It implements the Collection calls made by app.milvus_client (insert into
+partitions, delete by expression, search, query with a limit, partition
+management) with exact squared-L2 search in NumPy. Filter expressions are
+evaluated vectorized over the scalar columns, for the grammar produced by
+app.filter_expr plus the id cursor and area expressions of milvus_client.
+Every call costs FAKE_MILVUS_LATENCY seconds (default 0) on top.
+"""
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..filter_expr import FIELD_KINDS, _tokenize
+from ..milvus_client import COLLECTION_NAME, SCALAR_FIELDS
+
+LATENCY = float(os.environ.get("FAKE_MILVUS_LATENCY", "0"))
+FIELDS = ["id", "embedding", "metadata", *SCALAR_FIELDS]
+COMPARE = {
+    "==": np.equal, "!=": np.not_equal, "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+}
+FLIPPED = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "==", "!=": "!="}
+
+
+def _compare(op: str, column: np.ndarray, literal: Any) -> np.ndarray:
+    # ufuncs on object (string) columns return object arrays
+    return np.asarray(COMPARE[op](column, literal), dtype=bool)
+
+
+class _Mask:
+    """
+    Recursive-descent evaluation of an expression to a boolean row mask.
+    """
+
+    def __init__(self, expr: str, columns: Dict[str, np.ndarray]):
+        self.tokens = _tokenize(expr)
+        self.position = 0
+        self.columns = columns
+
+    def peek(self) -> Tuple[str, Any]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else ("end", None)
+
+    def take(self) -> Tuple[str, Any]:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def is_op(self, *values: str) -> bool:
+        kind, value = self.peek()
+        return kind == "op" and value in values
+
+    def evaluate(self) -> np.ndarray:
+        mask = self.parse_or()
+        if self.peek()[0] != "end":
+            raise ValueError(f"Unexpected {self.peek()[1]!r}")
+        return mask
+
+    def parse_or(self) -> np.ndarray:
+        mask = self.parse_and()
+        while self.is_op("or", "||"):
+            self.take()
+            mask = mask | self.parse_and()
+        return mask
+
+    def parse_and(self) -> np.ndarray:
+        mask = self.parse_not()
+        while self.is_op("and", "&&"):
+            self.take()
+            mask = mask & self.parse_not()
+        return mask
+
+    def parse_not(self) -> np.ndarray:
+        if self.is_op("not", "!"):
+            self.take()
+            return ~self.parse_not()
+        if self.is_op("("):
+            self.take()
+            mask = self.parse_or()
+            self.take()
+            return mask
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> np.ndarray:
+        kind, value = self.take()
+        if kind in ("string", "number"):
+            # literal op field [op literal]
+            _, op = self.take()
+            _, field = self.take()
+            mask = _compare(FLIPPED[op], self.columns[field], value)
+            if self.is_op(*COMPARE):
+                _, second = self.take()
+                mask = mask & _compare(second, self.columns[field], self.take()[1])
+            return mask
+        column = self.columns[value]
+        negate = False
+        if self.is_op("not"):
+            self.take()
+            negate = True
+        if self.is_op("in"):
+            self.take()
+            self.take()  # [ or (
+            values = []
+            while not self.is_op("]", ")"):
+                token = self.take()
+                if token != ("op", ","):
+                    values.append(token[1])
+            self.take()
+            mask = np.isin(column, values)
+            return ~mask if negate else mask
+        _, op = self.take()
+        literal = self.take()[1]
+        if op == "like":
+            prefix = literal.rstrip("%")
+            return np.array([str(v).startswith(prefix) for v in column], dtype=bool)
+        return _compare(op, column, literal)
+
+
+class FakeCollection:
+    def __init__(self, name: str = COLLECTION_NAME):
+        self.name = name
+        self._lock = threading.Lock()
+        self._rows: Dict[str, List[Any]] = {field: [] for field in FIELDS}
+        self._partition: List[str] = []
+        self._valid: List[bool] = []
+        self._partitions = {"_default"}
+        # arrays rebuilt after writes, on the next read
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+        self.calls: Dict[str, int] = {}
+
+    def _call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if LATENCY:
+            time.sleep(LATENCY)
+
+    # partitions
+
+    @property
+    def partitions(self) -> List[SimpleNamespace]:
+        return [SimpleNamespace(name=name) for name in sorted(self._partitions)]
+
+    def has_partition(self, name: str) -> bool:
+        return name in self._partitions
+
+    def create_partition(self, name: str) -> None:
+        self._call("create_partition")
+        self._partitions.add(name)
+
+    def load(self, partition_names: Optional[List[str]] = None, **kwargs: Any) -> None:
+        pass
+
+    def flush(self, **kwargs: Any) -> None:
+        self._call("flush")
+
+    @property
+    def num_entities(self) -> int:
+        with self._lock:
+            return sum(self._valid)
+
+    # writes
+
+    def insert(self, data: List[List[Any]], partition_name: Optional[str] = None, **kwargs: Any) -> None:
+        self._call("insert")
+        partition = partition_name or "_default"
+        if partition not in self._partitions:
+            raise ValueError(f"partition {partition} does not exist")
+        with self._lock:
+            for row in zip(*data):
+                for field, value in zip(FIELDS, row):
+                    self._rows[field].append(value)
+                self._partition.append(partition)
+                self._valid.append(True)
+            self._arrays = None
+
+    def delete(self, expr: str, **kwargs: Any) -> None:
+        self._call("delete")
+        with self._lock:
+            arrays = self._columns()
+            mask = _Mask(expr, arrays).evaluate() & arrays["_valid"]
+            for index in np.flatnonzero(mask):
+                self._valid[index] = False
+            self._arrays = None
+
+    # reads
+
+    def _columns(self) -> Dict[str, np.ndarray]:
+        if self._arrays is None:
+            arrays: Dict[str, np.ndarray] = {}
+            for field in ("id", "metadata", *SCALAR_FIELDS):
+                kind = FIELD_KINDS.get(field, "string")
+                arrays[field] = np.array(self._rows[field], dtype=object if kind == "string" else None)
+            if self._valid:
+                arrays["embedding"] = np.asarray(self._rows["embedding"], dtype=np.float32)
+            else:
+                arrays["embedding"] = np.zeros((0, 0), dtype=np.float32)
+            arrays["_valid"] = np.array(self._valid, dtype=bool)
+            arrays["_partition"] = np.array(self._partition, dtype=object)
+            self._arrays = arrays
+        return self._arrays
+
+    def _selected(self, arrays: Dict[str, np.ndarray], expr: Optional[str], partition_names: Optional[Sequence[str]]) -> np.ndarray:
+        mask = arrays["_valid"].copy()
+        if partition_names is not None:
+            mask &= np.isin(arrays["_partition"], list(partition_names))
+        if expr and mask.any():
+            mask &= _Mask(expr, arrays).evaluate()
+        return mask
+
+    def _entity(self, arrays: Dict[str, np.ndarray], index: int, output_fields: Sequence[str]) -> Dict[str, Any]:
+        row = {"id": arrays["id"][index]}
+        for field in output_fields:
+            value = arrays[field][index]
+            row[field] = value.item() if hasattr(value, "item") else value
+        return row
+
+    def search(
+        self,
+        data: List[List[float]],
+        anns_field: str,
+        param: Dict[str, Any],
+        limit: int,
+        expr: Optional[str] = None,
+        partition_names: Optional[Sequence[str]] = None,
+        output_fields: Sequence[str] = (),
+        **kwargs: Any
+    ) -> List[List[SimpleNamespace]]:
+        self._call("search")
+        with self._lock:
+            arrays = self._columns()
+            mask = self._selected(arrays, expr, partition_names)
+            candidates = np.flatnonzero(mask)
+            results: List[List[SimpleNamespace]] = []
+            if not len(candidates):
+                return [[] for _ in data]
+            matrix = arrays["embedding"][candidates]
+            queries = np.asarray(data, dtype=np.float32)
+            distances = (
+                (queries ** 2).sum(axis=1)[:, None]
+                - 2.0 * queries @ matrix.T
+                + (matrix ** 2).sum(axis=1)[None, :]
+            )
+            for row in distances:
+                top = np.argsort(row)[:limit]
+                hits = []
+                for n in top:
+                    entity = self._entity(arrays, candidates[n], output_fields)
+                    hits.append(SimpleNamespace(
+                        id=entity["id"],
+                        distance=max(float(row[n]), 0.0),
+                        entity=SimpleNamespace(id=entity["id"], get=entity.get),
+                    ))
+                results.append(hits)
+            return results
+
+    def query(
+        self,
+        expr: str,
+        output_fields: Sequence[str] = (),
+        partition_names: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+        **kwargs: Any
+    ) -> List[Dict[str, Any]]:
+        self._call("query")
+        with self._lock:
+            arrays = self._columns()
+            indices = np.flatnonzero(self._selected(arrays, expr, partition_names))
+            # limited results come back ordered by primary key, like Milvus
+            indices = sorted(indices, key=lambda i: arrays["id"][i])[:limit]
+            return [self._entity(arrays, i, output_fields) for i in indices]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rows": self.num_entities, "partitions": len(self._partitions), "calls": dict(self.calls)}
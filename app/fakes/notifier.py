@@ -0,0 +1,42 @@
+"""
+Local stand-in for the new-object notification API (NEW_OBJ_URL), for
+offline runs:
+
+    uvicorn app.fakes.notifier:app --port 8924
+    NEW_OBJ_URL=http://localhost:8924/new3dobject uvicorn app.main:app
+
+It accepts single notifications and {"objects": [...]} batches. Each call
+takes FAKE_NOTIFIER_LATENCY seconds and FAKE_NOTIFIER_ERROR_RATE answers
+that share of calls with 503, so the outbox retries them.
+"""
+import asyncio
+import os
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY = float(os.environ.get("FAKE_NOTIFIER_LATENCY", "0.01"))
+ERROR_RATE = float(os.environ.get("FAKE_NOTIFIER_ERROR_RATE", "0"))
+
+_random = random.Random(int(os.environ.get("FAKE_NOTIFIER_SEED", "0")))
+_stats = {"calls": 0, "objects": 0, "errors": 0}
+
+app = FastAPI(title="Fake notifier")
+
+
+@app.post("/new3dobject")
+async def new_object(request: Request):
+    payload = await request.json()
+    await asyncio.sleep(LATENCY)
+    _stats["calls"] += 1
+    if _random.random() < ERROR_RATE:
+        _stats["errors"] += 1
+        return JSONResponse(status_code=503, content={"detail": "injected error"})
+    _stats["objects"] += len(payload["objects"]) if "objects" in payload else 1
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+def stats():
+    return dict(_stats)
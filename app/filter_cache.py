@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .config import settings
+from .filter_expr import FilterExpressionError, compile_expression
+from .llm_utils import generate_filter_expression
+from .type_catalog import type_catalog
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_condition(condition: str) -> str:
+    """
+    Runs of whitespace and trailing punctuation do not change the meaning
+    of a condition, so they do not change its cache key. Case does: it can
+    be part of a literal, e.g. a type name.
+    """
+    return re.sub(r"\s+", " ", condition).strip().strip(".!?;").strip()
+
+
+class FilterCache:
+    """
+    Compiled filter expressions in a local SQLite file, keyed by the
+    normalized condition and the type vocabulary version. Entries expire
+    after `ttl` seconds (0: never).
+    """
+
+    def __init__(self, path: str, ttl: float = 0.0):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS filter_cache (
+                key TEXT PRIMARY KEY,
+                condition TEXT NOT NULL,
+                vocabulary_version TEXT NOT NULL,
+                expression TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._puts = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.invalid_answers = 0
+
+    @staticmethod
+    def key(condition: str, vocabulary_version: str) -> str:
+        return hashlib.sha256(f"{vocabulary_version}\n{condition}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expression, created_at FROM filter_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (self.ttl and row[1] < time.time() - self.ttl):
+            return None
+        return row[0]
+
+    def put(self, key: str, condition: str, vocabulary_version: str, expression: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO filter_cache "
+                "(key, condition, vocabulary_version, expression, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, condition, vocabulary_version, expression, now),
+            )
+            self._puts += 1
+            if self.ttl and self._puts % 100 == 0:
+                self._conn.execute("DELETE FROM filter_cache WHERE created_at < ?", (now - self.ttl,))
+
+    async def get_or_compile(
+        self,
+        condition: str,
+        vocabulary_version: str,
+        compile: Callable[[], Awaitable[str]]
+    ) -> str:
+        """
+        Cached expression for a normalized condition, or the result of
+        `compile()`, which is stored. Concurrent misses share one call.
+        """
+        key = self.key(condition, vocabulary_version)
+        cached = await asyncio.to_thread(self.get, key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        while key in self._inflight:
+            leader = self._inflight[key]
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                if not leader.cancelled():
+                    raise
+                # the leading request went away; compile it ourselves
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            expression = await compile()
+            await asyncio.to_thread(self.put, key, condition, vocabulary_version, expression)
+            future.set_result(expression)
+            return expression
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.failures += 1
+            future.set_exception(e)
+            # mark retrieved so a failure nobody waited for is not logged
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM filter_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "invalid_answers": self.invalid_answers,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+filter_cache = FilterCache(settings.filter_cache_path, ttl=settings.filter_cache_ttl)
+
+
+async def compile_filter(condition: str) -> str:
+    """
+    Validated Milvus expression for a natural-language condition: from the
+    cache, or generated by the LLM and checked against the schema (one
+    retry with the validation error). Raises FilterExpressionError.
+    """
+    normalized = normalize_condition(condition)
+    if not normalized:
+        raise FilterExpressionError("Empty condition")
+    # the LLM gets the text the cache key is made of
+    return await filter_cache.get_or_compile(
+        normalized, type_catalog.version(), lambda: _generate(normalized)
+    )
+
+
+async def _generate(condition: str) -> str:
+    types = type_catalog.types()
+    answer = await generate_filter_expression(condition, types)
+    try:
+        return compile_expression(answer)
+    except FilterExpressionError as e:
+        filter_cache.invalid_answers += 1
+        logger.warning(f"LLM filter for {condition!r} rejected ({e}): {answer!r}; retrying")
+        answer = await generate_filter_expression(condition, types, rejected=(answer, str(e)))
+    try:
+        return compile_expression(answer)
+    except FilterExpressionError:
+        filter_cache.invalid_answers += 1
+        raise
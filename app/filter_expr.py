@@ -0,0 +1,225 @@
+"""
+Parser for the subset of the Milvus boolean expression language used by
+the filter endpoints. LLM-generated expressions are parsed against the
+collection schema and re-serialized, so only known fields, operators and
+correctly typed literals reach Milvus.
+
+    expr       := or
+    or         := and (("or" | "||") and)*
+    and        := not (("and" | "&&") not)*
+    not        := ("not" | "!") not | "(" expr ")" | comparison
+    comparison := field op literal
+                | literal op field
+                | literal op field op literal       (range, e.g. 1 < lat < 2)
+                | field ["not"] "in" "[" literal ("," literal)* "]"
+                | field "like" string
+"""
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+from pymilvus import DataType
+
+from .milvus_client import SCALAR_FIELDS
+
+# field -> "string" | "number"
+FIELD_KINDS: Dict[str, str] = {"id": "string"}
+FIELD_KINDS.update({
+    name: "string" if dtype == DataType.VARCHAR else "number"
+    for name, (dtype, _, _) in SCALAR_FIELDS.items()
+})
+
+COMPARISONS = ("==", "!=", "<=", ">=", "<", ">")
+
+_TOKEN = re.compile(
+    r"""
+    \s*(?:
+      (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    | (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+    | (?P<op>==|!=|<=|>=|<|>|&&|\|\||!|\(|\)|\[|\]|,)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+class FilterExpressionError(ValueError):
+    pass
+
+
+def _tokenize(text: str) -> List[Tuple[str, Any]]:
+    tokens: List[Tuple[str, Any]] = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise FilterExpressionError(f"Unexpected input at {position}: {text[position:position + 20]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            body = value[1:-1]
+            # unescape, then re-encode with double quotes on output
+            value = re.sub(r"\\(.)", r"\1", body)
+        elif kind == "number":
+            value = float(value) if re.search(r"[.eE]", value) else int(value)
+        elif kind == "word":
+            lowered = value.lower()
+            if lowered in ("and", "or", "not", "in", "like"):
+                kind, value = "op", lowered
+            elif lowered in ("true", "false"):
+                kind, value = "bool", lowered == "true"
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: List[Tuple[str, Any]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset: int = 0) -> Tuple[str, Any]:
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else ("end", None)
+
+    def take(self) -> Tuple[str, Any]:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, value: str) -> None:
+        kind, actual = self.take()
+        if kind != "op" or actual != value:
+            raise FilterExpressionError(f"Expected {value!r}, got {actual!r}")
+
+    def is_op(self, *values: str) -> bool:
+        kind, value = self.peek()
+        return kind == "op" and value in values
+
+    def parse(self) -> str:
+        result = self.parse_or()
+        if self.peek()[0] != "end":
+            raise FilterExpressionError(f"Unexpected {self.peek()[1]!r} after the expression")
+        return result
+
+    def parse_or(self) -> str:
+        parts = [self.parse_and()]
+        while self.is_op("or", "||"):
+            self.take()
+            parts.append(self.parse_and())
+        return parts[0] if len(parts) == 1 else "(" + " or ".join(parts) + ")"
+
+    def parse_and(self) -> str:
+        parts = [self.parse_not()]
+        while self.is_op("and", "&&"):
+            self.take()
+            parts.append(self.parse_not())
+        return parts[0] if len(parts) == 1 else "(" + " and ".join(parts) + ")"
+
+    def parse_not(self) -> str:
+        if self.is_op("not", "!"):
+            self.take()
+            return f"not {self.parse_not()}"
+        if self.is_op("("):
+            self.take()
+            inner = self.parse_or()
+            self.expect(")")
+            return inner if inner.startswith("(") else f"({inner})"
+        return self.parse_comparison()
+
+    def field(self) -> str:
+        kind, name = self.take()
+        if kind != "word":
+            raise FilterExpressionError(f"Expected a field name, got {name!r}")
+        if name not in FIELD_KINDS:
+            raise FilterExpressionError(f"Unknown field {name!r}, expected one of {sorted(FIELD_KINDS)}")
+        return name
+
+    def literal(self, field: str) -> str:
+        kind, value = self.take()
+        expected = FIELD_KINDS[field]
+        if kind == "string" and expected == "string":
+            return json.dumps(value, ensure_ascii=False)
+        if kind == "number" and expected == "number":
+            return repr(value)
+        raise FilterExpressionError(f"Field {field!r} needs a {expected} value, got {value!r}")
+
+    def comparison_op(self) -> str:
+        kind, value = self.take()
+        if kind != "op" or value not in COMPARISONS:
+            raise FilterExpressionError(f"Expected a comparison operator, got {value!r}")
+        return value
+
+    def parse_comparison(self) -> str:
+        if self.peek()[0] in ("string", "number"):
+            # literal op field [op literal]
+            start = self.position
+            self.take()
+            op = self.comparison_op()
+            name = self.field()
+            self.position = start
+            left = self.literal(name)
+            self.take()
+            self.take()
+            if self.is_op(*COMPARISONS):
+                second = self.comparison_op()
+                if op not in ("<", "<=") or second not in ("<", "<="):
+                    raise FilterExpressionError("Range comparisons must use < or <=")
+                return f"{left} {op} {name} {second} {self.literal(name)}"
+            return f"{left} {op} {name}"
+
+        name = self.field()
+        if self.is_op("not"):
+            self.take()
+            self.expect("in")
+            return f"{name} not in {self.literal_list(name)}"
+        if self.is_op("in"):
+            self.take()
+            return f"{name} in {self.literal_list(name)}"
+        if self.is_op("like"):
+            self.take()
+            if FIELD_KINDS[name] != "string":
+                raise FilterExpressionError(f"'like' needs a string field, {name!r} is numeric")
+            pattern = self.literal(name)
+            if "%" in json.loads(pattern).rstrip("%"):
+                raise FilterExpressionError("Milvus only supports prefix patterns ('abc%') with 'like'")
+            return f"{name} like {pattern}"
+        op = self.comparison_op()
+        return f"{name} {op} {self.literal(name)}"
+
+    def literal_list(self, field: str) -> str:
+        # Milvus takes [..]; LLMs often write (..)
+        if self.is_op("["):
+            closing = "]"
+        elif self.is_op("("):
+            closing = ")"
+        else:
+            raise FilterExpressionError(f"Expected a list after 'in', got {self.peek()[1]!r}")
+        self.take()
+        values = [self.literal(field)]
+        while self.is_op(","):
+            self.take()
+            values.append(self.literal(field))
+        self.expect(closing)
+        return "[" + ", ".join(values) + "]"
+
+
+def compile_expression(text: str) -> str:
+    """
+    Validate an expression against the schema and return it in canonical
+    form. Raises FilterExpressionError.
+    """
+    text = re.sub(r"^```[A-Za-z]*|```$", "", text.strip()).strip().strip("`").strip()
+    if text.lower().startswith("expr:"):
+        text = text[5:]
+    tokens = _tokenize(text)
+    if not tokens:
+        raise FilterExpressionError("Empty filter expression")
+    return _Parser(tokens).parse()
+
+
+def negate(expression: str) -> str:
+    # compiled and/or groups are already fully parenthesized
+    return f"not {expression}" if expression.startswith("(") else f"not ({expression})"
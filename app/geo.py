@@ -0,0 +1,209 @@
+"""
+Geohash tiles and the Milvus partition an object lives in.
+
+Partitions are named after the city, the geohash tile of the object, or
+both (PARTITION_MODE). A dedup search only scans the partition of the
+incoming object, the partitions of the 8 tiles around it (a duplicate
+may sit just across a tile edge) and `_default`, which holds rows
+written before partitioning.
+"""
+import hashlib
+import math
+import re
+from typing import List, Optional, Sequence, Tuple
+
+from .config import settings
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+MODES = ("off", "city", "geohash", "city_geohash")
+DEFAULT_PARTITION = "_default"
+
+
+def encode(lat: float, lon: float, precision: int) -> str:
+    """
+    Geohash of a point with `precision` characters.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars: List[str] = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            rng[0] = middle
+        else:
+            rng[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """
+    (height, width) of a geohash cell in degrees.
+    """
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def neighborhood(lat: float, lon: float, precision: int) -> List[str]:
+    """
+    The tile of a point and the (up to) 8 tiles around it.
+    """
+    height, width = cell_size(precision)
+    tiles: List[str] = []
+    for d_lat in (0, -1, 1):
+        neighbor_lat = lat + d_lat * height
+        if not -90.0 <= neighbor_lat <= 90.0:
+            continue
+        for d_lon in (0, -1, 1):
+            neighbor_lon = (lon + d_lon * width + 180.0) % 360.0 - 180.0
+            tile = encode(neighbor_lat, neighbor_lon, precision)
+            if tile not in tiles:
+                tiles.append(tile)
+    return tiles
+
+
+def _city_key(city: str) -> str:
+    # partition names allow [A-Za-z0-9_] only; the hash keeps non-Latin
+    # city names apart
+    slug = re.sub(r"[^a-z0-9]+", "_", city.casefold()).strip("_")[:40]
+    digest = hashlib.sha1(city.casefold().encode()).hexdigest()[:8]
+    return f"{slug}_{digest}" if slug else digest
+
+
+def partition_name(city: Optional[str], tile: Optional[str], mode: Optional[str] = None) -> str:
+    mode = mode or settings.partition_mode
+    if mode == "city" and city:
+        return f"c_{_city_key(city)}"
+    if mode == "geohash" and tile:
+        return f"g_{tile}"
+    if mode == "city_geohash" and city and tile:
+        return f"c_{_city_key(city)}_g_{tile}"
+    return DEFAULT_PARTITION
+
+
+def object_partition(city: Optional[str], lat: Optional[float], lon: Optional[float]) -> str:
+    """
+    Partition a row is written to.
+    """
+    mode = settings.partition_mode
+    if mode not in MODES:
+        raise ValueError(f"PARTITION_MODE must be one of {MODES}, got {mode!r}")
+    tile = None
+    if mode in ("geohash", "city_geohash") and lat is not None and lon is not None:
+        tile = encode(lat, lon, settings.partition_geohash_precision)
+    return partition_name(city, tile, mode)
+
+
+def search_partitions(city: Optional[str], lat: Optional[float], lon: Optional[float]) -> Optional[List[str]]:
+    """
+    Partitions a duplicate of an object at (lat, lon) in `city` can be
+    in, or None to search the whole collection (partitioning is off or
+    the location is not known).
+    """
+    mode = settings.partition_mode
+    if mode == "off":
+        return None
+    if mode == "city":
+        if not city:
+            return None
+        return [p for p in (partition_name(city, None, mode),) if p in existing] + [DEFAULT_PARTITION]
+    if lat is None or lon is None or (mode == "city_geohash" and not city):
+        return None
+    tiles = neighborhood(lat, lon, settings.partition_geohash_precision)
+    return [partition_name(city, tile, mode) for tile in tiles] + [DEFAULT_PARTITION]
+
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle (haversine) distance in meters.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_box(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """
+    (south, west, north, east) box around a circle; west > east when it
+    crosses the antimeridian.
+    """
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    south, north = max(lat - d_lat, -90.0), min(lat + d_lat, 90.0)
+    cos_lat = min(math.cos(math.radians(south)), math.cos(math.radians(north)))
+    if south <= -90.0 or north >= 90.0 or cos_lat <= 0 or d_lat / cos_lat >= 180.0:
+        return south, -180.0, north, 180.0
+    d_lon = d_lat / cos_lat
+    west = (lon - d_lon + 180.0) % 360.0 - 180.0
+    east = (lon + d_lon + 180.0) % 360.0 - 180.0
+    return south, west, north, east
+
+
+def box_tiles(south: float, west: float, north: float, east: float, precision: int, max_tiles: int) -> Optional[List[str]]:
+    """
+    Geohash tiles covering a box, or None when there are more than
+    `max_tiles` of them.
+    """
+    height, width = cell_size(precision)
+    span = east - west if east >= west else east + 360.0 - west
+    rows = int((north - south) / height) + 2
+    columns = int(span / width) + 2
+    if rows * columns > max_tiles:
+        return None
+    tiles: List[str] = []
+    for row in range(rows):
+        lat = min(south + row * height, north)
+        for column in range(columns):
+            lon = west + min(column * width, span)
+            tile = encode(lat, (lon + 180.0) % 360.0 - 180.0, precision)
+            if tile not in tiles:
+                tiles.append(tile)
+    return tiles
+
+
+def area_partitions(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    existing: Sequence[str],
+    city: Optional[str] = None,
+    max_tiles: int = 256,
+) -> Optional[List[str]]:
+    """
+    Existing partitions that can hold objects inside the box, or None to
+    query the whole collection.
+    """
+    mode = settings.partition_mode
+    if mode == "off":
+        return None
+    if mode == "city":
+        if not city:
+            return None
+        return [p for p in (partition_name(city, None, mode),) if p in existing] + [DEFAULT_PARTITION]
+    tiles = box_tiles(south, west, north, east, settings.partition_geohash_precision, max_tiles)
+    if tiles is None:
+        return None
+    if city:
+        wanted = {partition_name(city, tile, mode) for tile in tiles}
+    else:
+        # any city: match the tile part of the names
+        suffixes = tuple(f"_g_{tile}" for tile in tiles)
+        wanted = {name for name in existing if f"_{name}".endswith(suffixes)}
+    return [name for name in existing if name in wanted] + [DEFAULT_PARTITION]
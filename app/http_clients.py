@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+import httpx
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Downstream:
+    """
+    Shared keep-alive connection pool for one downstream service, with a
+    cap on requests in flight. Callers beyond the cap wait for a slot.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        timeout: float,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+        # replaces the network when set, e.g. httpx.ASGITransport to an
+        # in-process fake (benchmarks/e2e.py)
+        self.transport: Optional[httpx.AsyncBaseTransport] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                headers=self.headers,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=settings.http_keepalive_expiry,
+                ),
+            )
+        return self._client
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            return await self.client.post(url, **kwargs)
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+encoder = Downstream("encoder", settings.encoder_max_concurrency, settings.encoder_timeout)
+notifier = Downstream("notifier", settings.notifier_max_concurrency, settings.notifier_timeout)
+llm = Downstream(
+    "llm",
+    settings.llm_max_concurrency,
+    settings.llm_timeout,
+    headers={"Authorization": f"Bearer {settings.openai_api_key}"},
+)
+
+DOWNSTREAMS = (encoder, notifier, llm)
+
+
+async def close_all() -> None:
+    await asyncio.gather(*(d.close() for d in DOWNSTREAMS))
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {d.name: d.stats() for d in DOWNSTREAMS}
@@ -0,0 +1,58 @@
+"""
+Inspect or rebuild the ANN index of the object collection.
+
+    python -m app.index_admin show
+    python -m app.index_admin rebuild [--yes]
+
+`rebuild` replaces the embedding index with the one described by the
+MILVUS_INDEX_TYPE / MILVUS_IVF_* / MILVUS_PQ_* / MILVUS_HNSW_* settings.
+The collection is not searchable while the index builds.
+"""
+import argparse
+import logging
+import sys
+import time
+
+from .milvus_client import (
+    COLLECTION_NAME,
+    describe_index,
+    index_params,
+    init_collection,
+    rebuild_index,
+    search_params,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["show", "rebuild"])
+    parser.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    collection = init_collection()
+    current = describe_index(collection)
+    wanted = index_params()
+
+    print(f"collection:      {COLLECTION_NAME} ({collection.num_entities} entities)")
+    print(f"current index:   {current}")
+    print(f"settings index:  {wanted}")
+    print(f"settings search: {search_params()}")
+    if args.command == "show":
+        return 0
+
+    if not args.yes:
+        answer = input(f"Rebuild index of {COLLECTION_NAME}? Searches fail until done. [y/N] ")
+        if answer.strip().lower() != "y":
+            print("aborted")
+            return 1
+    start = time.monotonic()
+    rebuild_index(collection, wanted)
+    print(f"index rebuilt in {time.monotonic() - start:.1f}s: {describe_index(collection)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
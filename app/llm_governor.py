@@ -0,0 +1,209 @@
+"""
+Per-process admission control for LLM calls: token buckets for requests
+and tokens per minute, and a priority queue in front of them so ingest
+calls go before filter generation when the budget is short.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# lower goes first
+PRIORITIES = {"ingest": 0, "filter": 1}
+POLICIES = ("wait", "degrade", "reject")
+
+
+class LLMSaturated(Exception):
+    """
+    No LLM budget for a call: the policy is not "wait", or the call waited
+    longer than LLM_QUEUE_MAX_WAIT.
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    `per_minute` units refilled continuously, holding at most
+    `burst_seconds` worth of them. 0 per minute means unlimited.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self, now: float) -> Optional[float]:
+        if not self.rate:
+            return None
+        self._refill(now)
+        return self.level
+
+    def delay(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` can be taken; requests above the capacity
+        only need a full bucket.
+        """
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        # may go negative when a call used more than estimated
+        if self.rate:
+            self._refill(now)
+            self.level -= amount
+
+
+class LLMGovernor:
+    def __init__(
+        self,
+        rpm: float,
+        tpm: float,
+        burst_seconds: float,
+        policy: str = "wait",
+        max_wait: float = 10.0,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"LLM saturation policy must be one of {POLICIES}, got {policy!r}")
+        self.policy = policy
+        self.max_wait = max_wait
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self._queue: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        self._waits: Dict[str, deque] = {name: deque(maxlen=1000) for name in PRIORITIES}
+        self._counters: Dict[str, Dict[str, int]] = {
+            name: {"granted": 0, "queued": 0, "rejected": 0, "timed_out": 0} for name in PRIORITIES
+        }
+        self.upstream_rate_limits = 0
+
+    def _delay(self, tokens: float, now: float) -> float:
+        return max(
+            self._paused_until - now,
+            self.requests.delay(1, now),
+            self.tokens.delay(tokens, now),
+        )
+
+    def _take(self, tokens: float, now: float) -> None:
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+
+    async def acquire(self, priority: str, tokens: float) -> None:
+        """
+        Wait for budget for one call of about `tokens` tokens, or raise
+        LLMSaturated according to the policy.
+        """
+        counters = self._counters[priority]
+        now = time.monotonic()
+        delay = self._delay(tokens, now)
+        if not self._queue and delay <= 0:
+            self._take(tokens, now)
+            counters["granted"] += 1
+            self._waits[priority].append(0.0)
+            return
+        if self.policy != "wait":
+            counters["rejected"] += 1
+            raise LLMSaturated(f"LLM budget exhausted ({priority})", retry_after=max(delay, 1.0))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (PRIORITIES[priority], next(self._sequence), tokens, future))
+        counters["queued"] += 1
+        self._grant()
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            counters["timed_out"] += 1
+            # the waiters behind it may be able to go now
+            self._grant()
+            raise LLMSaturated(
+                f"LLM call ({priority}) waited more than {self.max_wait:.1f}s for budget",
+                retry_after=max(self._delay(tokens, time.monotonic()), 1.0),
+            )
+        counters["granted"] += 1
+        self._waits[priority].append(time.monotonic() - now)
+
+    def _grant(self) -> None:
+        """
+        Admit waiters in priority order while the buckets allow, then wake
+        up again when the next one can go.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._queue:
+            _, _, tokens, future = self._queue[0]
+            if future.done():
+                # timed out or cancelled while waiting
+                heapq.heappop(self._queue)
+                continue
+            delay = self._delay(tokens, now)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._grant)
+                return
+            heapq.heappop(self._queue)
+            self._take(tokens, now)
+            future.set_result(None)
+
+    def settle(self, estimated: float, used: float) -> None:
+        """
+        Correct the token bucket once the actual usage of a call is known.
+        """
+        self.tokens.take(used - estimated, time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold all calls after the provider answered 429.
+        """
+        self.upstream_rate_limits += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"LLM provider rate limit hit; pausing LLM calls for {seconds:.1f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        priorities: Dict[str, Any] = {}
+        for name, counters in self._counters.items():
+            waits = sorted(self._waits[name])
+            priorities[name] = {
+                **counters,
+                "waiting": sum(1 for rank, _, _, f in self._queue if rank == PRIORITIES[name] and not f.done()),
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+            }
+        return {
+            "policy": self.policy,
+            "requests_available": self.requests.available(now),
+            "tokens_available": self.tokens.available(now),
+            "paused_for": max(0.0, self._paused_until - now),
+            "upstream_rate_limits": self.upstream_rate_limits,
+            "priorities": priorities,
+        }
+
+
+llm_governor = LLMGovernor(
+    settings.llm_rpm,
+    settings.llm_tpm,
+    settings.llm_burst_seconds,
+    policy=settings.llm_saturation_policy,
+    max_wait=settings.llm_queue_max_wait,
+)
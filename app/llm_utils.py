@@ -1,37 +1,88 @@
+import asyncio
 import json
-from datetime import datetime
-from typing import Tuple, Dict
+import logging
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
-import openai
 from pydantic import ValidationError
 
+from . import metrics
+from .batching import MicroBatcher
 from .config import settings
-from .models import ObjectRequest, LLMFilterResponse, LLMNormalizeResponse, LLMDecisionResponse
+from .http_clients import llm
+from .llm_governor import LLMSaturated, llm_governor
+from .models import ObjectRequest, LLMFilterResponse, LLMNormalizeResponse, LLMDecisionResponse, PointCloudStats
+from .preprocess import density_ratio
 
-openai.api_key = settings.OPENAI_API_KEY
+logger = logging.getLogger(__name__)
 
+DecisionJob = Tuple[Dict, ObjectRequest, Dict, Optional[PointCloudStats]]
 
-def normalize_type(raw: str) -> str:
+
+async def chat_completion(messages: List[Dict[str, str]], max_tokens: int, priority: str = "ingest") -> str:
+    """
+    OpenAI chat completion over the shared keep-alive pool, admitted by the
+    LLM governor at `priority` ("ingest" or "filter").
+    Returns the stripped content of the first choice.
+    """
+    # rough count: ~4 characters per token
+    estimate = sum(len(m["content"]) for m in messages) // 4 + max_tokens
+    await llm_governor.acquire(priority, estimate)
+    resp = await llm.post(
+        f"{settings.openai_api_base.rstrip('/')}/chat/completions",
+        json={
+            "model": settings.openai_model,
+            "messages": messages,
+            "temperature": 0.0,
+            "max_tokens": max_tokens,
+        },
+    )
+    metrics.llm_requests_total.inc(priority=priority, status=resp.status_code)
+    if resp.status_code == 429:
+        llm_governor.pause(_retry_after(resp.headers.get("retry-after")))
+    resp.raise_for_status()
+    data = resp.json()
+    usage = data.get("usage") or {}
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            metrics.llm_tokens_total.inc(usage[kind], priority=priority, kind=kind.split("_")[0])
+    used = usage.get("total_tokens")
+    if used:
+        llm_governor.settle(estimate, used)
+    return data["choices"][0]["message"]["content"].strip()
+
+
+def _retry_after(header: Optional[str]) -> float:
+    try:
+        return min(max(float(header), 1.0), 60.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+async def normalize_type(raw: str) -> str:
     """
     Normalizes the value of the "type" field via the LLM, returning a canonical English term.
+    Concurrent calls share one request when LLM_BATCHING is on.
     """
+    if not settings.llm_batching:
+        return await _normalize_single(raw)
+    return await normalize_batcher.submit(raw)
+
+
+async def _normalize_single(raw: str) -> str:
     prompt = (
         'Convert the value of the "type" field to a canonical form:\n'
         f'Input: "{raw}"\n\n'
         'Expected output: a single English word (e.g., Car, Tree, Bench).'
     )
 
-    resp = openai.ChatCompletion.create(
-        model=settings.OPENAI_MODEL,
-        messages=[
+    content = await chat_completion(
+        [
             {"role": "system", "content": "You help normalize textual labels of objects."},
             {"role": "user", "content": prompt},
         ],
-        temperature=0.0,
         max_tokens=10,
     )
-
-    content = resp.choices[0].message.content.strip()
     # Attempt to parse into the model for validation
     try:
         parsed = LLMNormalizeResponse(normalized_type=content)
@@ -41,42 +92,73 @@ def normalize_type(raw: str) -> str:
         return content
 
 
-def decide_update(
+async def normalize_types_batch(raws: List[str]) -> List[Union[str, Exception]]:
+    """
+    Normalize several labels with one prompt answered by a JSON array.
+    A malformed answer falls back to one call per label; a failed call
+    (HTTP error, timeout, saturation) fails every label.
+    """
+    if len(raws) == 1:
+        return await asyncio.gather(_normalize_single(raws[0]), return_exceptions=True)
+    prompt = (
+        'Convert each value of the "type" field to a canonical form: '
+        "a single English word (e.g., Car, Tree, Bench).\n"
+        f"Inputs (JSON array): {json.dumps(raws, ensure_ascii=False)}\n\n"
+        f"Return ONLY a JSON array of {len(raws)} strings, one per input, in the same order."
+    )
+    try:
+        content = await chat_completion(
+            [
+                {"role": "system", "content": "You help normalize textual labels of objects."},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=20 + 10 * len(raws),
+        )
+    except Exception as e:
+        # one call per label would only add load to a failing LLM
+        return [e] * len(raws)
+    try:
+        answers = _json_answer(content)
+        if (
+            not isinstance(answers, list)
+            or len(answers) != len(raws)
+            or not all(isinstance(a, str) and a.strip() for a in answers)
+        ):
+            raise ValueError(f"expected a JSON array of {len(raws)} strings, got {content[:200]!r}")
+        return [a.strip() for a in answers]
+    except ValueError as e:
+        batch_fallbacks["normalize"] += 1
+        logger.warning(f"Batched normalization of {len(raws)} labels failed ({e}); asking one by one")
+        return await asyncio.gather(*(_normalize_single(raw) for raw in raws), return_exceptions=True)
+
+
+async def decide_update(
     existing: Dict,
     incoming: ObjectRequest,
-    metadata: Dict
+    metadata: Dict,
+    quality: Optional[PointCloudStats] = None
 ) -> Tuple[str, str]:
     """
     Determines whether to update an existing record or keep the old one.
+    `quality` are the preprocessing stats of the incoming cloud; they are
+    compared with the stats stored with the existing object.
     Returns a tuple: (decision, reason), where decision is "update" or "keep".
+    Concurrent calls share one request when LLM_BATCHING is on.
     """
-    # Prepare description for the prompt
-    existing_ts = existing.get("timestamp")
-    new_ts = incoming.timestamp.isoformat()
-    season = incoming.timestamp.strftime("%B")  # e.g., "July"
-    hour = incoming.timestamp.hour
-    time_of_day = (
-        "night" if hour < 6 or hour >= 22 else
-        "morning" if hour < 12 else
-        "afternoon" if hour < 18 else
-        "evening"
-    )
+    if not settings.llm_batching:
+        return await _decide_single(existing, incoming, metadata, quality)
+    return await decision_batcher.submit((existing, incoming, metadata, quality))
+
+
+async def _decide_single(
+    existing: Dict,
+    incoming: ObjectRequest,
+    metadata: Dict,
+    quality: Optional[PointCloudStats] = None
+) -> Tuple[str, str]:
     prompt = (
         "You have information about a previously recorded object and new data for the same object.\n\n"
-        "Existing data:\n"
-        f"- ID: {existing.get('id')}\n"
-        f"- Type: {existing.get('type')}\n"
-        f"- Timestamp: {existing_ts}\n"
-        f"- BBox: {existing.get('bbox')}\n\n"
-        "New data:\n"
-        f"- ID: {incoming.id}\n"
-        f"- Capture time: {new_ts} (season: {season}, time of day: {time_of_day})\n"
-        f"- Type (normalized): {incoming.type}\n"
-        f"- BBox: {incoming.bbox}\n"
-        f"- Points (count): {len(incoming.pointcloud)}\n\n"
-        "Additional metadata:\n"
-        + "\n".join(f"- {k}: {v}" for k, v in metadata.items())
-        + "\n\n"
+        f"{_decision_case(existing, incoming, metadata, quality)}\n\n"
         "Decide whether to UPDATE the record (update) or keep the existing one (keep). "
         "Return the response in JSON format with the following fields:\n"
         '```\n'
@@ -87,28 +169,140 @@ def decide_update(
         '```'
     )
 
-    resp = openai.ChatCompletion.create(
-        model=settings.OPENAI_MODEL,
-        messages=[
+    content = await chat_completion(
+        [
             {"role": "system", "content": "You assist with making a decision about updating a 3D object in the database."},
             {"role": "user", "content": prompt},
         ],
-        temperature=0.0,
         max_tokens=150,
     )
-
-    content = resp.choices[0].message.content.strip()
     # Try to parse JSON from the model
     try:
         data = json.loads(content)
         parsed = LLMDecisionResponse(**data)
         return parsed.decision, parsed.reason
-    except (json.JSONDecodeError, ValidationError):
+    except (json.JSONDecodeError, ValidationError, TypeError):
         # If parsing fails, return "keep" with the raw model explanation
         return "keep", content
 
 
-def filter_types(available_types: List[str], condition: str) -> LLMFilterResponse:
+async def decide_updates_batch(jobs: List[DecisionJob]) -> List[Union[Tuple[str, str], Exception]]:
+    """
+    Decide several cases with one prompt answered by a JSON array of
+    {"decision", "reason"} objects. Cases whose answer is missing or
+    malformed are decided by one call each; a failed call (HTTP error,
+    timeout, saturation) fails every case.
+    """
+    if len(jobs) == 1:
+        return await asyncio.gather(_decide_single(*jobs[0]), return_exceptions=True)
+    cases = "\n\n".join(
+        f"Case {n}:\n{_decision_case(*job)}" for n, job in enumerate(jobs, start=1)
+    )
+    prompt = (
+        f"For each of the {len(jobs)} cases below you have information about a previously recorded "
+        "object and new data for the same object.\n\n"
+        f"{cases}\n\n"
+        "For every case decide whether to UPDATE the record (update) or keep the existing one (keep). "
+        f"Return ONLY a JSON array of {len(jobs)} objects, one per case, in the same order:\n"
+        '```\n'
+        '[{"decision": "update" or "keep", "reason": "brief justification"}, ...]\n'
+        '```'
+    )
+    try:
+        content = await chat_completion(
+            [
+                {"role": "system", "content": "You assist with making decisions about updating 3D objects in the database."},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=150 * len(jobs),
+        )
+    except Exception as e:
+        # one call per case would only add load to a failing LLM
+        return [e] * len(jobs)
+    answers: Sequence[Any] = []
+    try:
+        answers = _json_answer(content)
+        if not isinstance(answers, list) or len(answers) != len(jobs):
+            raise ValueError(f"expected a JSON array of {len(jobs)} decisions, got {content[:200]!r}")
+    except ValueError as e:
+        logger.warning(f"Batched decision of {len(jobs)} cases failed ({e}); asking one by one")
+        answers = []
+
+    results: List[Any] = []
+    retry: List[int] = []
+    for n in range(len(jobs)):
+        try:
+            parsed = LLMDecisionResponse(**answers[n])
+            results.append((parsed.decision, parsed.reason))
+        except (IndexError, TypeError, ValidationError):
+            results.append(None)
+            retry.append(n)
+    if retry:
+        batch_fallbacks["decide"] += 1
+        retried = await asyncio.gather(*(_decide_single(*jobs[n]) for n in retry), return_exceptions=True)
+        for n, result in zip(retry, retried):
+            results[n] = result
+    return results
+
+
+def _json_answer(content: str) -> Any:
+    # models like to wrap JSON in a code fence
+    return json.loads(re.sub(r"^```[A-Za-z]*|```$", "", content.strip()).strip())
+
+
+def _decision_case(
+    existing: Dict,
+    incoming: ObjectRequest,
+    metadata: Dict,
+    quality: Optional[PointCloudStats] = None
+) -> str:
+    """
+    Description of the existing and the incoming object for a decision prompt.
+    """
+    existing_ts = existing.get("timestamp")
+    new_ts = incoming.timestamp.isoformat()
+    season = incoming.timestamp.strftime("%B")  # e.g., "July"
+    hour = incoming.timestamp.hour
+    time_of_day = (
+        "night" if hour < 6 or hour >= 22 else
+        "morning" if hour < 12 else
+        "afternoon" if hour < 18 else
+        "evening"
+    )
+    incoming_quality = _quality_lines(quality.dict() if quality else None, len(incoming.pointcloud))
+    ratio = density_ratio(quality, existing.get("quality")) if quality else None
+    if ratio is not None:
+        incoming_quality += f"- Density relative to existing: {ratio:.2f}\n"
+    return (
+        "Existing data:\n"
+        f"- ID: {existing.get('id')}\n"
+        f"- Type: {existing.get('type')}\n"
+        f"- Timestamp: {existing_ts}\n"
+        f"- BBox: {existing.get('bbox')}\n"
+        f"{_quality_lines(existing.get('quality'))}\n"
+        "New data:\n"
+        f"- ID: {incoming.id}\n"
+        f"- Capture time: {new_ts} (season: {season}, time of day: {time_of_day})\n"
+        f"- Type (normalized): {incoming.type}\n"
+        f"- BBox: {incoming.bbox}\n"
+        f"{incoming_quality}\n"
+        "Additional metadata:\n"
+        + "\n".join(f"- {k}: {v}" for k, v in metadata.items())
+    )
+
+
+def _quality_lines(quality: Optional[Dict], raw_points: Optional[int] = None) -> str:
+    if not quality:
+        return f"- Points (count): {raw_points}\n" if raw_points is not None else ""
+    return (
+        f"- Points (raw / after cleaning): {quality['raw_points']} / {quality['points']}\n"
+        f"- Point density (per bbox volume): {quality['density']:.1f}\n"
+        f"- BBox coverage: {quality['coverage']:.2f}\n"
+        f"- Extent: {[round(v, 2) for v in quality['extent']]}\n"
+    )
+
+
+async def filter_types(available_types: List[str], condition: str) -> LLMFilterResponse:
     """
     Uses the LLM to split available_types into included/excluded according to the textual condition.
     """
@@ -125,16 +319,14 @@ def filter_types(available_types: List[str], condition: str) -> LLMFilterRespons
         "}\n"
         "```"
     )
-    resp = openai.ChatCompletion.create(
-        model=settings.OPENAI_MODEL,
-        messages=[
+    content = await chat_completion(
+        [
             {"role": "system", "content": "You split a list of labels into included and excluded based on a condition."},
             {"role": "user", "content": prompt},
         ],
-        temperature=0.0,
         max_tokens=2048,
+        priority="filter",
     )
-    content = resp.choices[0].message.content.strip()
     try:
         data = json.loads(content)
         return LLMFilterResponse(**data)
@@ -144,26 +336,60 @@ def filter_types(available_types: List[str], condition: str) -> LLMFilterRespons
             excluded=[t for t in available_types if condition.lower() not in t.lower()]
         )
 
-def generate_filter_expression(condition: str) -> str:
+async def generate_filter_expression(
+    condition: str,
+    types: Optional[List[str]] = None,
+    rejected: Optional[Tuple[str, str]] = None
+) -> str:
     """
     Ask the LLM to produce a Milvus query expression (e.g. `type in ("Car","Bus")`)
-    based on the textual condition. Returns a valid Milvus boolean expression.
+    based on the textual condition. The answer is not validated here; see
+    filter_cache.compile_filter(). `types` is the vocabulary of stored type
+    values, most frequent first; `rejected` is an earlier (expression, error)
+    to correct.
     """
+    vocabulary = ""
+    if types:
+        shown = types[:settings.type_catalog_prompt_limit]
+        vocabulary = f"Stored `type` values: {json.dumps(shown, ensure_ascii=False)}\n"
+        if len(types) > len(shown):
+            vocabulary += f"(the {len(shown)} most frequent of {len(types)})\n"
     prompt = (
-        f"You need to write a Milvus filter expression over the field `type` "
-        f"that captures this condition:\n\n"
+        f"You need to write a Milvus filter expression that captures this condition:\n\n"
         f"Condition: \"{condition}\"\n\n"
+        "Available fields: `type` (string), `city` (string), `timestamp` "
+        "(int64, unix seconds UTC), `lat` and `lon` (double, degrees).\n"
+        f"{vocabulary}"
+        "Use only stored type values when filtering on `type`.\n"
         "Return ONLY the boolean expression, for example:\n"
-        "`type in (\"Car\",\"Truck\") and type != \"Tree\"`"
+        "`type in [\"Car\",\"Truck\"] and type != \"Tree\"`"
     )
-    resp = openai.ChatCompletion.create(
-        model=settings.OPENAI_MODEL,
-        messages=[
+    if rejected:
+        prompt += f"\n\nYour previous answer `{rejected[0]}` was rejected: {rejected[1]}"
+    content = await chat_completion(
+        [
             {"role": "system", "content": "You produce a Milvus query filter."},
             {"role": "user", "content": prompt},
         ],
-        temperature=0.0,
         max_tokens=500,
+        priority="filter",
     )
-    expr = resp.choices[0].message.content.strip().strip("`")
-    return expr
\ No newline at end of file
+    expr = content.strip("`")
+    return expr
+
+
+batch_fallbacks = {"normalize": 0, "decide": 0}
+normalize_batcher: MicroBatcher[str, str] = MicroBatcher(
+    "llm-normalize", normalize_types_batch, settings.llm_batch_max_size, settings.llm_batch_max_wait
+)
+decision_batcher: MicroBatcher[DecisionJob, Tuple[str, str]] = MicroBatcher(
+    "llm-decide", decide_updates_batch, settings.llm_batch_max_size, settings.llm_batch_max_wait
+)
+
+
+def batching_stats() -> Dict[str, Any]:
+    return {
+        "enabled": settings.llm_batching,
+        "normalize": {**normalize_batcher.stats(), "fallbacks": batch_fallbacks["normalize"]},
+        "decide": {**decision_batcher.stats(), "fallbacks": batch_fallbacks["decide"]},
+    }
@@ -1,32 +1,59 @@
+import asyncio
 import logging
-from typing import Union
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import ValidationError
 
+from . import http_clients, metrics
 from .config import settings
 from .models import (
     ObjectRequest,
     ObjectResponse,
     ExistingObject,
     ConditionRequest,
+    BatchObjectRequest,
+    BatchObjectResponse,
+    BatchObjectResult,
+    PointCloudStats,
 )
 from .models import LLMFilterResponse
-from .llm_utils import (
-    normalize_type,
-    decide_update,
-    generate_filter_expression,
-)
-from ._3dutils import encode_pointcloud
+from ._3dutils import batching_encoder, encode_pointcloud
+from .llm_utils import batching_stats as llm_batching_stats
+from .llm_governor import LLMSaturated, llm_governor
+from .embedding_cache import embedding_cache
+from .preprocess import preprocess_pointcloud
+from .pointcloud_io import FIELDS_HEADER, PointCloudFormatError, parse_batch, parse_object
 from .milvus_client import (
+    init_collection,
+    is_ready,
+    close as close_milvus,
     insert_vector,
-    get_all_distinct_types,
+    insert_vectors,
+    write_buffer,
     stream_ids_by_expression,
+    stream_objects_in_area,
+    rebuild_type_catalog,
 )
-from .retriever import find_existing
-from .tasks import notify_new_object
+from .retrievers.hot_set_retriever import HotSetRetriever
+from .retriever import RetrievalIncomplete, find_existing, find_existing_batch, get_registry, hot_set, remember
+from .tasks import notify_new_object, notification_worker
+from .write_buffer import WriteBufferFull
+from .type_catalog import type_catalog
+from .filter_cache import compile_filter, filter_cache
+from .type_normalizer import type_normalizer
+from .coalescing import IdempotencyConflict, object_coalescer, request_fingerprint
+from .profiler import profiler
+from . import update_rules
+from .filter_expr import FilterExpressionError, negate
+from .geo import distance_m, radius_box
+from .streaming import FORMATS, MEDIA_TYPES, accepts_gzip, gzip_chunks, id_chunks, object_chunks, stream_headers
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -46,37 +73,484 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
+
+@app.on_event("startup")
+def startup() -> None:
+    # connect, index and load the collection once, before taking traffic
+    collection = init_collection()
+    if type_catalog.is_empty() and collection.num_entities:
+        # first start with this catalog file: fill it without delaying readiness
+        threading.Thread(target=rebuild_type_catalog, name="type-catalog-rebuild", daemon=True).start()
+    get_registry()
+    write_buffer.start()
+    notification_worker.start()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await notification_worker.stop()
+    await http_clients.close_all()
+    await asyncio.to_thread(write_buffer.stop, drain=True)
+    close_milvus()
+
+
+@app.get("/health/live")
+def health_live() -> Dict[str, str]:
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def health_ready():
+    """
+    503 until the Milvus collection is connected, indexed and loaded.
+    """
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready"}
+
+
+@app.get("/stats/write_buffer")
+def write_buffer_stats() -> Dict[str, Any]:
+    """
+    Throughput and flush counters of the Milvus write-behind buffer.
+    """
+    return write_buffer.stats()
+
+
+@app.get("/stats/outbox")
+def outbox_stats() -> Dict[str, Any]:
+    """
+    Depth of the notification outbox and delivery counters.
+    """
+    return notification_worker.stats()
+
+
+@app.get("/stats/embedding_cache")
+def embedding_cache_stats() -> Dict[str, Any]:
+    """
+    Hit/miss counters and size of the embedding cache tiers.
+    """
+    return embedding_cache.stats()
+
+
+@app.get("/stats/encoder_batching")
+def encoder_batching_stats() -> Dict[str, Any]:
+    """
+    Batch sizes of micro-batched encoder calls and fallbacks to single calls.
+    """
+    return batching_encoder.stats()
+
+
+@app.get("/stats/llm_batching")
+def llm_batching() -> Dict[str, Any]:
+    """
+    Batch sizes of micro-batched LLM normalizations and decisions, and
+    fallbacks to one call per item.
+    """
+    return llm_batching_stats()
+
+
+@app.get("/stats/llm_governor")
+def llm_governor_stats() -> Dict[str, Any]:
+    """
+    LLM rate budget left, and queue waits and rejections per priority.
+    """
+    return llm_governor.stats()
+
+
+@app.get("/stats/filter_cache")
+def filter_cache_stats() -> Dict[str, Any]:
+    """
+    Hits/misses of the compiled filter expression cache.
+    """
+    return filter_cache.stats()
+
+
+@app.get("/stats/type_normalizer")
+def type_normalizer_stats() -> Dict[str, Any]:
+    """
+    Type normalization hits per layer (override, dictionary, cached LLM
+    answer), LLM calls and stored entries.
+    """
+    return type_normalizer.stats()
+
+
+@app.get("/stats/decisions")
+def decision_stats() -> Dict[str, Any]:
+    """
+    Update decisions per path (rule, cache, LLM) and the most recent ones
+    with their features.
+    """
+    return update_rules.stats()
+
+
+@app.get("/stats/coalescing")
+def coalescing_stats() -> Dict[str, Any]:
+    """
+    Leaders, coalesced followers, replayed results and lease waits of the
+    per-id single-flight.
+    """
+    return object_coalescer.stats()
+
+
+@app.get("/stats/hot_set")
+def hot_set_stats() -> Dict[str, Any]:
+    """
+    Size and hit rate of the in-memory set of recently inserted objects.
+    """
+    return hot_set.stats()
+
+
+@app.get("/stats/retrievers")
+def retriever_stats() -> Dict[str, Any]:
+    """
+    Calls, hits, timeouts and latency per dedup retriever.
+    """
+    return get_registry().stats()
+
+
+@app.get("/types")
+def types() -> Dict[str, Any]:
+    """
+    Stored object types with total and per-city counts.
+    """
+    return {"version": type_catalog.version(), "types": type_catalog.counts()}
+
+
+@app.get("/stats/downstreams")
+def downstream_stats() -> Dict[str, Any]:
+    """
+    Requests in flight / waiting for a slot per downstream HTTP pool.
+    """
+    return http_clients.stats()
+
+
+def _collect_caches() -> metrics.Samples:
+    yield from metrics.counter_samples(
+        embedding_cache.stats(), ("memory_hits", "disk_hits", "misses", "coalesced"), "event", cache="embedding"
+    )
+    yield from metrics.counter_samples(filter_cache.stats(), ("hits", "misses", "coalesced"), "event", cache="filter")
+    yield from metrics.counter_samples(
+        type_normalizer.stats(),
+        ("override_hits", "dictionary_hits", "cache_hits", "llm_calls", "coalesced", "fallbacks"),
+        "event",
+        cache="type_normalizer",
+    )
+    yield from metrics.counter_samples(hot_set.stats(), ("hits", "misses", "evictions"), "event", cache="hot_set")
+    yield from metrics.counter_samples(
+        object_coalescer.stats(),
+        ("leaders", "coalesced", "replayed", "serialized", "lease_waits", "leases_lost"),
+        "event",
+        cache="coalescing",
+    )
+
+
+def _collect_decisions() -> metrics.Samples:
+    return [({"path": path}, count) for path, count in update_rules.stats()["paths"].items()]
+
+
+def _collect_downstreams() -> metrics.Samples:
+    for name, stats in http_clients.stats().items():
+        yield from metrics.counter_samples(stats, ("requests", "errors"), "kind", downstream=name)
+
+
+def _collect_queues() -> metrics.Samples:
+    yield from metrics.counter_samples(write_buffer.stats(), ("pending", "inflight"), "queue", component="write_buffer")
+    yield from metrics.counter_samples(notification_worker.stats(), ("depth", "retrying", "dead_letters"), "queue", component="outbox")
+    for name, stats in http_clients.stats().items():
+        yield from metrics.counter_samples(stats, ("in_flight", "waiting"), "queue", component=name)
+
+
+def _collect_write_buffer() -> metrics.Samples:
+    return metrics.counter_samples(
+        write_buffer.stats(), ("rows_written", "rows_coalesced", "write_batches", "write_errors"), "kind"
+    )
+
+
+metrics.registry.collector("urbanrag_cache_events_total", "counter", "Cache lookups by cache and result", _collect_caches)
+metrics.registry.collector("urbanrag_decisions_total", "counter", "Update decisions by path", _collect_decisions)
+metrics.registry.collector(
+    "urbanrag_downstream_requests_total", "counter", "Downstream HTTP requests and errors", _collect_downstreams
+)
+metrics.registry.collector("urbanrag_queue_depth", "gauge", "Items waiting or in flight per queue", _collect_queues)
+metrics.registry.collector("urbanrag_write_buffer_total", "counter", "Milvus write buffer counters", _collect_write_buffer)
+metrics.registry.collector(
+    "urbanrag_llm_upstream_rate_limits_total", "counter", "429 answers of the LLM API",
+    lambda: [({}, llm_governor.stats()["upstream_rate_limits"])],
+)
+
+
+@app.get("/metrics")
+def prometheus_metrics() -> Response:
+    """
+    Stage latencies and counters in the Prometheus text format.
+    """
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _require_profiler() -> None:
+    if not settings.profiler_enabled:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (PROFILER_ENABLED=false)")
+
+
+@app.post("/debug/profiler/start")
+def profiler_start(
+    interval: Optional[float] = Query(None, gt=0, le=1),
+    seconds: Optional[float] = Query(None, gt=0),
+) -> Dict[str, Any]:
+    """
+    Start the sampling profiler; it stops after `seconds` (at most
+    PROFILER_MAX_SECONDS) or on /debug/profiler/stop.
+    """
+    _require_profiler()
+    duration = min(seconds or settings.profiler_max_seconds, settings.profiler_max_seconds)
+    if not profiler.start(interval or settings.profiler_interval, duration):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return profiler.stats()
+
+
+@app.post("/debug/profiler/stop", response_class=PlainTextResponse)
+def profiler_stop() -> str:
+    """
+    Stop the profiler and return the profile as collapsed stacks.
+    """
+    _require_profiler()
+    profiler.stop()
+    return profiler.collapsed()
+
+
+@app.get("/debug/profiler", response_class=PlainTextResponse)
+def profiler_profile() -> str:
+    """
+    Collapsed stacks sampled so far (the profiler keeps running).
+    """
+    _require_profiler()
+    return profiler.collapsed()
+
+
+T = TypeVar("T")
+
+
+class StageTimeout(Exception):
+    def __init__(self, stage: str, budget: float):
+        super().__init__(f"{stage} stage exceeded its {budget:.1f}s budget")
+        self.stage = stage
+
+
+@app.exception_handler(StageTimeout)
+async def stage_timeout_handler(request, exc: StageTimeout) -> JSONResponse:
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(LLMSaturated)
+async def llm_saturated_handler(request, exc: LLMSaturated) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(RetrievalIncomplete)
+async def retrieval_incomplete_handler(request, exc: RetrievalIncomplete) -> JSONResponse:
+    # creating the object now could duplicate one in the store that did not answer
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.exception_handler(WriteBufferFull)
+async def write_buffer_full_handler(request, exc: WriteBufferFull) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+async def _stage(stage: str, budget: float, awaitable: Awaitable[T]) -> T:
+    """
+    Run one pipeline stage within its time budget.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with metrics.span(f"stage.{stage}"):
+            result = await asyncio.wait_for(awaitable, timeout=budget)
+        outcome = "ok"
+        return result
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise StageTimeout(stage, budget)
+    finally:
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage=stage, outcome=outcome)
+
+
+async def _embed(request: ObjectRequest) -> Tuple[List[float], PointCloudStats]:
+    """
+    Preprocess the cloud (in a worker thread) and encode the result,
+    unless the same cleaned cloud is already in the embedding cache.
+    """
+    with metrics.timed_stage("preprocess"):
+        points, quality, key = await asyncio.to_thread(_preprocess, request)
+    vector = await embedding_cache.get_or_compute(
+        points,
+        lambda: _stage("encode", settings.stage_timeout_encode, encode_pointcloud(points)),
+        key=key,
+    )
+    return vector, quality
+
+
+def _preprocess(request: ObjectRequest) -> Tuple[Any, PointCloudStats, str]:
+    # runs in a worker thread: the cache key hashes the whole cleaned cloud
+    points, quality = preprocess_pointcloud(request.pointcloud, request.bbox)
+    return points, quality, embedding_cache.key(points)
+
+
+def _dedup_filters(request: ObjectRequest) -> Optional[Dict[str, Any]]:
+    """
+    Scalar predicates an existing object must match to be a duplicate.
+    """
+    return {"city": request.city} if settings.dedup_same_city else None
+
+
+def _object_metadata(
+    request: ObjectRequest,
+    normalized_type: str,
+    quality: PointCloudStats,
+    base: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Metadata stored in Milvus for a new object, or for an update of `base`.
+    """
+    if base is not None:
+        return {
+            **base,
+            "timestamp": request.timestamp.isoformat(),
+            "lat": request.lat,
+            "lon": request.lon,
+            "type": normalized_type,
+            "bbox": request.bbox,
+            "quality": quality.dict(),
+        }
+    return {
+        "id": request.id,
+        "city": request.city,
+        "timestamp": request.timestamp.isoformat(),
+        "lat": request.lat,
+        "lon": request.lon,
+        "type": normalized_type,
+        "bbox": request.bbox,
+        "quality": quality.dict(),
+    }
+
+
 @app.post("/objects/new", response_model=ObjectResponse)
-def process_object(request: ObjectRequest) -> Union[str, ExistingObject]:
+async def process_object(
+    request: ObjectRequest,
+    idempotency_key: Optional[str] = Header(None),
+) -> Union[str, ExistingObject]:
+    return await _coalesced(request, idempotency_key)
+
+
+@app.post("/objects/new/binary", response_model=ObjectResponse)
+async def process_object_binary(http_request: Request) -> Union[str, ExistingObject]:
     """
-    1. Normalize the textual type via LLM.
-    2. Generate 3D embedding.
+    /objects/new with a binary point cloud (raw float32, .npy or msgpack),
+    see app/pointcloud_io.py for the accepted formats.
+    """
+    try:
+        request = parse_object(
+            await http_request.body(),
+            http_request.headers.get("content-type"),
+            http_request.headers.get(FIELDS_HEADER),
+        )
+    except PointCloudFormatError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return await _coalesced(request, http_request.headers.get("idempotency-key"))
+
+
+async def _coalesced(request: ObjectRequest, idempotency_key: Optional[str]) -> Union[str, ExistingObject]:
+    """
+    _process_object() once per concurrent or recently repeated submission
+    of an object id (see app/coalescing.py).
+    """
+    if not settings.coalesce_enabled:
+        return await _counted(request)
+    content = await asyncio.to_thread(request_fingerprint, request)
+    key = f"{request.id}\nkey:{idempotency_key}" if idempotency_key else f"{request.id}\nbody:{content}"
+    try:
+        return await object_coalescer.run(request.id, key, content, lambda: _counted(request))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+OUTCOMES = {"new object created": "created", "object updated": "updated"}
+
+
+async def _counted(request: ObjectRequest) -> Union[str, ExistingObject]:
+    outcome = "error"
+    try:
+        result = await _process_object(request)
+        outcome = "kept" if isinstance(result, ExistingObject) else OUTCOMES.get(result, "other")
+        return result
+    finally:
+        metrics.objects_total.inc(endpoint="single", outcome=outcome)
+
+
+async def _process_object(request: ObjectRequest) -> Union[str, ExistingObject]:
+    """
+    1. Normalize the textual type (dictionary, cache, LLM).
+    2. Preprocess the point cloud and generate the 3D embedding.
     3. Search for an existing object in Milvus.
-    4. If found, decide via LLM whether to update or keep.
+    4. If found, decide by rules, or via LLM when unclear, whether to update or keep.
     5. Insert/update the record and notify downstream.
     """
     # 1. Normalize type
     try:
-        normalized_type = normalize_type(request.type)
+        normalized_type = await _stage(
+            "normalize", settings.stage_timeout_normalize, type_normalizer.normalize(request.type)
+        )
         logger.info(f"Normalized type '{request.type}' → '{normalized_type}'")
+    except (StageTimeout, LLMSaturated):
+        raise
     except Exception as e:
         logger.error(f"Error normalizing type for {request.id}: {e}")
         raise HTTPException(status_code=500, detail=f"Normalization error: {e}")
 
-    # 2. Generate embedding
+    # 2. Preprocess and generate embedding
     try:
-        vector = encode_pointcloud(request.pointcloud)
+        vector, quality = await _embed(request)
+    except StageTimeout:
+        raise
     except Exception as e:
         logger.error(f"Error encoding pointcloud for {request.id}: {e}")
         raise HTTPException(status_code=500, detail=f"Encoding error: {e}")
 
     # 3. Search for an existing object
-    existing_hit = find_existing(vector)
+    existing_hit = await _stage(
+        "search",
+        settings.stage_timeout_search,
+        asyncio.to_thread(find_existing, vector, _dedup_filters(request), (request.lat, request.lon)),
+    )
     if existing_hit:
         meta = existing_hit["metadata"]
         score = existing_hit.get("score")
-        decision, reason = decide_update(meta, request, {"score": score})
-        logger.info(f"LLM decision for {request.id}: {decision} ({reason})")
+        decision, reason, path = await _stage(
+            "decide", settings.stage_timeout_decide, update_rules.decide(meta, request, score, quality)
+        )
+        logger.info(f"Decision for {request.id} by {path}: {decision} ({reason})")
 
         if decision == "keep":
             try:
@@ -85,59 +559,361 @@ def process_object(request: ObjectRequest) -> Union[str, ExistingObject]:
                 logger.error(f"Validation error returning existing object: {e}")
                 raise HTTPException(status_code=500, detail="Invalid existing object data")
 
-        # update path
-        updated_meta = {
-            **meta,
-            "timestamp": request.timestamp.isoformat(),
-            "lat": request.lat,
-            "lon": request.lon,
-            "type": normalized_type,
-            "bbox": request.bbox,
-        }
-        insert_vector(request.id, vector, updated_meta)
+        # update path: replace the matched row, which a rescan may have
+        # submitted under a new id
+        stored_id = existing_hit["id"]
+        updated_meta = _object_metadata(request, normalized_type, quality, base={**meta, "id": stored_id})
+        await _stage(
+            "insert",
+            settings.stage_timeout_insert,
+            asyncio.to_thread(insert_vector, stored_id, vector, updated_meta, upsert=True),
+        )
+        remember([stored_id], [vector], [updated_meta])
         try:
-            notify_new_object(request)
+            await notify_new_object(request)
         except Exception as e:
             logger.error(f"Error notifying update for {request.id}: {e}")
         return "object updated"
 
     # create-new path
-    new_meta = {
-        "id": request.id,
-        "city": request.city,
-        "timestamp": request.timestamp.isoformat(),
-        "lat": request.lat,
-        "lon": request.lon,
-        "type": normalized_type,
-        "bbox": request.bbox,
-    }
-    insert_vector(request.id, vector, new_meta)
+    new_meta = _object_metadata(request, normalized_type, quality)
+    await _stage(
+        "insert",
+        settings.stage_timeout_insert,
+        asyncio.to_thread(insert_vector, request.id, vector, new_meta),
+    )
+    remember([request.id], [vector], [new_meta])
     try:
-        notify_new_object(request)
+        await notify_new_object(request)
     except Exception as e:
         logger.error(f"Error notifying new object for {request.id}: {e}")
     return "new object created"
 
 
+@app.post("/objects/batch", response_model=BatchObjectResponse)
+async def process_objects_batch(batch: BatchObjectRequest) -> BatchObjectResponse:
+    return await _process_batch(batch.objects)
+
+
+@app.post("/objects/batch/binary", response_model=BatchObjectResponse)
+async def process_objects_batch_binary(http_request: Request) -> BatchObjectResponse:
+    """
+    /objects/batch as application/msgpack with binary point clouds.
+    """
+    try:
+        objects = parse_batch(await http_request.body(), http_request.headers.get("content-type"))
+    except PointCloudFormatError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return await _process_batch(objects)
+
+
+async def _process_batch(objects: List[ObjectRequest]) -> BatchObjectResponse:
+    """
+    Batched variant of /objects/new. Every stage runs over the whole batch,
+    with the calls of one stage running concurrently:
+    1. Normalize each distinct raw type once.
+    2. Preprocess point clouds and generate embeddings.
+    3. One multi-vector search for existing objects; objects without a
+       match are also matched against earlier new objects of the batch.
+    4. Update decision (rules or LLM) for every hit.
+    5. Queue all new/updated rows in the write buffer at once, then notify downstream.
+    Failures are reported per object instead of failing the whole batch.
+    """
+    if len(objects) > settings.batch_max_objects:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(objects)} > {settings.batch_max_objects}"
+        )
+    results: List[Optional[BatchObjectResult]] = [None] * len(objects)
+
+    def fail(i: int, detail: str) -> None:
+        results[i] = BatchObjectResult(id=objects[i].id, status="error", detail=detail)
+
+    # 1. Normalize types
+    raw_types = list({r.type for r in objects})
+    outcomes = await asyncio.gather(
+        *(_stage("normalize", settings.stage_timeout_normalize, type_normalizer.normalize(raw)) for raw in raw_types),
+        return_exceptions=True,
+    )
+    normalized: Dict[str, Union[str, BaseException]] = dict(zip(raw_types, outcomes))
+    for raw, outcome in normalized.items():
+        if isinstance(outcome, BaseException):
+            logger.error(f"Error normalizing type '{raw}': {outcome}")
+    for i, request in enumerate(objects):
+        if isinstance(normalized[request.type], BaseException):
+            fail(i, f"Normalization error: {normalized[request.type]}")
+
+    # 2. Preprocess and generate embeddings
+    pending = [i for i in range(len(objects)) if results[i] is None]
+    outcomes = await asyncio.gather(
+        *(_embed(objects[i]) for i in pending),
+        return_exceptions=True,
+    )
+    vectors: Dict[int, List[float]] = {}
+    qualities: Dict[int, PointCloudStats] = {}
+    for i, outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Error encoding pointcloud for {objects[i].id}: {outcome}")
+            fail(i, f"Encoding error: {outcome}")
+        else:
+            vectors[i], qualities[i] = outcome
+
+    # 3. Search for existing objects
+    order = list(vectors)
+    try:
+        hits = await _stage(
+            "search",
+            settings.stage_timeout_search,
+            asyncio.to_thread(
+                find_existing_batch,
+                [vectors[i] for i in order],
+                [_dedup_filters(objects[i]) for i in order],
+                [(objects[i].lat, objects[i].lon) for i in order],
+            ),
+        )
+    except (StageTimeout, RetrievalIncomplete):
+        raise
+    except Exception as e:
+        logger.error(f"Error searching batch of {len(order)} objects: {e}")
+        raise HTTPException(status_code=500, detail=f"Search error: {e}")
+
+    # 4. Decide
+    to_insert: List[int] = []
+    # id of the stored row each new/updated object is written under
+    row_ids: Dict[int, str] = {}
+    metadatas: Dict[int, Dict[str, Any]] = {}
+    statuses: Dict[int, str] = {}
+    matched = [(i, hit) for i, hit in zip(order, hits) if hit]
+    new = [i for i, hit in zip(order, hits) if not hit]
+    for i in new:
+        metadatas[i] = _object_metadata(objects[i], normalized[objects[i].type], qualities[i])
+    # several scans of one object in the batch: later ones match the first
+    # like they would have matched it in the store
+    in_batch = await asyncio.to_thread(_match_within_batch, new, objects, vectors, metadatas)
+    matched += list(in_batch.items())
+    for i in new:
+        if i in in_batch:
+            del metadatas[i]
+            continue
+        row_ids[i] = objects[i].id
+        statuses[i] = "created"
+        to_insert.append(i)
+
+    decisions = await asyncio.gather(
+        *(
+            _stage(
+                "decide",
+                settings.stage_timeout_decide,
+                update_rules.decide(hit["metadata"], objects[i], hit.get("score"), qualities[i]),
+            )
+            for i, hit in matched
+        ),
+        return_exceptions=True,
+    )
+    for (i, hit), outcome in zip(matched, decisions):
+        request = objects[i]
+        meta = hit["metadata"]
+        if isinstance(outcome, BaseException):
+            logger.error(f"Error deciding update for {request.id}: {outcome}")
+            fail(i, f"Decision error: {outcome}")
+            continue
+        decision, reason, path = outcome
+        logger.info(f"Decision for {request.id} by {path}: {decision} ({reason})")
+
+        if decision == "keep":
+            try:
+                results[i] = BatchObjectResult(
+                    id=request.id, status="kept", existing=ExistingObject(**meta)
+                )
+            except ValidationError as e:
+                logger.error(f"Validation error returning existing object: {e}")
+                fail(i, "Invalid existing object data")
+            continue
+
+        row_ids[i] = hit["id"]
+        metadatas[i] = _object_metadata(
+            request, normalized[request.type], qualities[i], base={**meta, "id": hit["id"]}
+        )
+        statuses[i] = "updated"
+        to_insert.append(i)
+
+    # 5. Insert all new/updated rows at once, then notify
+    try:
+        await _stage(
+            "insert",
+            settings.stage_timeout_insert,
+            asyncio.to_thread(
+                insert_vectors,
+                [row_ids[i] for i in to_insert],
+                [vectors[i] for i in to_insert],
+                [metadatas[i] for i in to_insert],
+                upsert=[statuses[i] == "updated" for i in to_insert],
+            ),
+        )
+    except WriteBufferFull:
+        raise
+    except Exception as e:
+        logger.error(f"Error inserting batch of {len(to_insert)} objects: {e}")
+        for i in to_insert:
+            fail(i, f"Insert error: {e}")
+        to_insert = []
+    remember(
+        [row_ids[i] for i in to_insert],
+        [vectors[i] for i in to_insert],
+        [metadatas[i] for i in to_insert],
+    )
+
+    for i in to_insert:
+        results[i] = BatchObjectResult(id=objects[i].id, status=statuses[i])
+    notified = await asyncio.gather(
+        *(notify_new_object(objects[i]) for i in to_insert),
+        return_exceptions=True,
+    )
+    for i, outcome in zip(to_insert, notified):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Error notifying {statuses[i]} object {objects[i].id}: {outcome}")
+
+    counts = Counter(r.status for r in results)
+    for status, count in counts.items():
+        metrics.objects_total.inc(count, endpoint="batch", outcome=status)
+    logger.info(f"Processed batch of {len(objects)} objects: {dict(counts)}")
+    return BatchObjectResponse(results=results)
+
+
+def _match_within_batch(
+    new: List[int],
+    objects: List[ObjectRequest],
+    vectors: Dict[int, List[float]],
+    metadatas: Dict[int, Dict[str, Any]]
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Hits of the objects in `new` (no match in the stores) on earlier objects
+    of `new`, with the distance threshold, filters and search area of the
+    hot set. An object with a hit is not a candidate for later ones.
+    """
+    if len(new) < 2:
+        return {}
+    seen = HotSetRetriever(
+        capacity=len(new), dim=settings.vector_dim, threshold=settings.dedup_distance_threshold
+    )
+    hits: Dict[int, Dict[str, Any]] = {}
+    for i in new:
+        hit = seen.retrieve(vectors[i], _dedup_filters(objects[i]), (objects[i].lat, objects[i].lon))
+        if hit:
+            hits[i] = hit
+        else:
+            seen.add_many([objects[i].id], [vectors[i]], [metadatas[i]])
+    return hits
+
+
+async def _compile_condition(condition: str) -> str:
+    try:
+        return await compile_filter(condition)
+    except FilterExpressionError as e:
+        raise HTTPException(status_code=422, detail=f"Could not turn the condition into a valid filter: {e}")
+
+
+def _id_stream(expr: str, fmt: str, accept_encoding: Optional[str]) -> StreamingResponse:
+    gzip = accepts_gzip(accept_encoding)
+    chunks = metrics.timed_chunks(id_chunks(stream_ids_by_expression(expr), fmt), "ids")
+    if gzip:
+        chunks = gzip_chunks(chunks, settings.stream_gzip_level)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[fmt], headers=stream_headers(gzip))
+
+
 @app.post("/objects/filter_by_rule/included/stream", response_model=None)
-def filter_by_rule_included_stream(req: ConditionRequest):
+async def filter_by_rule_included_stream(
+    req: ConditionRequest,
+    fmt: str = Query("text", alias="format", regex=f"^({'|'.join(FORMATS)})$"),
+    accept_encoding: Optional[str] = Header(None),
+):
     """
     Stream IDs using an LLM-generated filter expression for inclusion.
     """
-    expr = generate_filter_expression(req.condition)
-    return StreamingResponse(
-        stream_ids_by_expression(expr),
-        media_type="text/plain"
-    )
+    return _id_stream(await _compile_condition(req.condition), fmt, accept_encoding)
 
 
 @app.post("/objects/filter_by_rule/excluded/stream", response_model=None)
-def filter_by_rule_excluded_stream(req: ConditionRequest):
+async def filter_by_rule_excluded_stream(
+    req: ConditionRequest,
+    fmt: str = Query("text", alias="format", regex=f"^({'|'.join(FORMATS)})$"),
+    accept_encoding: Optional[str] = Header(None),
+):
     """
     Stream IDs using an LLM-generated filter expression for exclusion.
     """
-    expr = generate_filter_expression(req.condition)
-    return StreamingResponse(
-        stream_ids_by_expression(expr),
-        media_type="text/plain"
+    return _id_stream(negate(await _compile_condition(req.condition)), fmt, accept_encoding)
+
+
+def _object_stream(
+    stream: str,
+    pages: Iterator[List[Dict[str, Any]]],
+    limit: Optional[int],
+    accept_encoding: Optional[str]
+) -> StreamingResponse:
+    gzip = accepts_gzip(accept_encoding)
+    chunks = metrics.timed_chunks(object_chunks(pages, list(ExistingObject.__fields__), limit), stream)
+    if gzip:
+        chunks = gzip_chunks(chunks, settings.stream_gzip_level)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES["ndjson"], headers=stream_headers(gzip))
+
+
+async def _canonical_types(types: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Stored spelling of the requested types (without asking the LLM).
+    """
+    if not types:
+        return None
+    found = await asyncio.to_thread(lambda: [type_normalizer.lookup(t) for t in types])
+    return [hit[0] if hit else t for hit, t in zip(found, types)]
+
+
+@app.get("/objects/near", response_model=None)
+async def objects_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(..., gt=0, description="Radius in meters"),
+    city: Optional[str] = None,
+    types: Optional[List[str]] = Query(None, alias="type"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = Query(None, description="Last id of the previous page"),
+    limit: Optional[int] = Query(None, ge=1),
+    accept_encoding: Optional[str] = Header(None),
+):
+    """
+    Stream the objects within `radius` meters of (lat, lon) as NDJSON
+    ExistingObject records, in ascending id order.
+    """
+    pages = stream_objects_in_area(
+        *radius_box(lat, lon, radius), city, await _canonical_types(types), since, until, after
+    )
+    inside = ([row for row in page if distance_m(lat, lon, row["lat"], row["lon"]) <= radius] for page in pages)
+    return _object_stream("near", inside, limit, accept_encoding)
+
+
+@app.get("/objects/within", response_model=None)
+async def objects_within(
+    south: float = Query(..., ge=-90, le=90),
+    west: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    city: Optional[str] = None,
+    types: Optional[List[str]] = Query(None, alias="type"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = Query(None, description="Last id of the previous page"),
+    limit: Optional[int] = Query(None, ge=1),
+    accept_encoding: Optional[str] = Header(None),
+):
+    """
+    Stream the objects inside a bounding box as NDJSON ExistingObject
+    records, in ascending id order. west > east selects a box across the
+    antimeridian.
+    """
+    if south > north:
+        raise HTTPException(status_code=422, detail="south must not be greater than north")
+    pages = stream_objects_in_area(
+        south, west, north, east, city, await _canonical_types(types), since, until, after
     )
+    return _object_stream("within", pages, limit, accept_encoding)
@@ -0,0 +1,273 @@
+"""
+Counters and latency histograms in the Prometheus text format (served at
+/metrics), and optional tracing spans.
+
+The registry is a small in-process one: every replica exposes its own
+series and Prometheus aggregates them. Components that keep their own
+counters (caches, outbox, write buffer, ...) are read through collectors
+at scrape time instead of being instrumented twice.
+"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from .config import settings
+
+try:
+    from opentelemetry import trace
+except ImportError:  # optional dependency, spans are not recorded without it
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+# (labels, value) pairs of one metric family, as returned by collectors
+Samples = Iterable[Tuple[Dict[str, Any], float]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _merged(self, labels: Dict[str, Any]) -> Tuple[List[int], float, int]:
+        wanted = {self.labelnames.index(n): str(v) for n, v in labels.items()}
+        counts, total, count = [0] * len(self.buckets), 0.0, 0
+        with self._lock:
+            for key, entry in self._values.items():
+                if all(key[i] == v for i, v in wanted.items()):
+                    counts = [a + b for a, b in zip(counts, entry[0])]
+                    total += entry[1]
+                    count += entry[2]
+        return counts, total, count
+
+    def totals(self, **labels: Any) -> Tuple[float, int]:
+        """
+        (sum, count) of the series matching `labels`, summed over the
+        other labels.
+        """
+        _, total, count = self._merged(labels)
+        return total, count
+
+    def quantile(self, q: float, **labels: Any) -> float:
+        """
+        Estimated `q` quantile of the series matching `labels`, interpolated
+        within a bucket like Prometheus' histogram_quantile(); NaN without
+        observations.
+        """
+        counts, _, count = self._merged(labels)
+        if not count:
+            return math.nan
+        rank = q * count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(self.buckets, counts):
+            if cumulative >= rank:
+                inside = cumulative - below
+                return lower + (bound - lower) * ((rank - below) / inside if inside else 1.0)
+            lower, below = bound, cumulative
+        # in the +Inf bucket: the highest finite bound is all that is known
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = (*self.labelnames, "le")
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(names, (*key, _number(bound)))} {bucket}")
+                lines.append(f"{self.name}_bucket{_labels(names, (*key, '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+        # (name, type, help, function returning the samples)
+        self._collectors: List[Tuple[str, str, str, Callable[[], Samples]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name: str, kind: str, documentation: str, collect: Callable[[], Samples]) -> None:
+        """
+        A metric family read from `collect()` at scrape time; `kind` is
+        "counter" or "gauge".
+        """
+        self._collectors.append((name, kind, documentation, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, kind, documentation, collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                # one broken component must not take the whole scrape down
+                logger.error(f"Metrics collector {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "urbanrag_stage_seconds", "Duration of an ingest pipeline stage", ["stage", "outcome"]
+)
+http_request_seconds = registry.histogram(
+    "urbanrag_http_request_seconds", "Duration of an HTTP request until its response starts", ["method", "route", "status"]
+)
+stream_seconds = registry.histogram(
+    "urbanrag_stream_seconds", "Duration of a streamed response body", ["stream"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+stream_bytes = registry.counter("urbanrag_stream_bytes_total", "Bytes written by streamed responses", ["stream"])
+objects_total = registry.counter(
+    "urbanrag_objects_total", "Ingested objects by outcome", ["endpoint", "outcome"]
+)
+retries_total = registry.counter("urbanrag_retries_total", "Retried downstream calls", ["target"])
+llm_requests_total = registry.counter("urbanrag_llm_requests_total", "LLM API requests", ["priority", "status"])
+llm_tokens_total = registry.counter("urbanrag_llm_tokens_total", "LLM tokens used", ["priority", "kind"])
+milvus_rpc_seconds = registry.histogram("urbanrag_milvus_rpc_seconds", "Duration of a Milvus RPC", ["op", "outcome"])
+
+
+def span(name: str, **attributes: Any) -> ContextManager:
+    """
+    Tracing span when TRACING_ENABLED and OpenTelemetry is installed (the
+    exporter is set up by the OpenTelemetry SDK / opentelemetry-instrument),
+    otherwise a no-op.
+    """
+    if trace is None or not settings.tracing_enabled:
+        return nullcontext()
+    return trace.get_tracer("urbanrag3d").start_as_current_span(name, attributes=attributes)
+
+
+@contextmanager
+def _timed(histogram: Histogram, span_name: str, **labels: Any) -> Iterator[None]:
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(span_name):
+            yield
+        outcome = "ok"
+    finally:
+        histogram.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+
+def timed_stage(stage: str) -> ContextManager:
+    """
+    Time a pipeline stage into stage_seconds{stage, outcome}, in a span.
+    """
+    return _timed(stage_seconds, f"stage.{stage}", stage=stage)
+
+
+def timed_rpc(op: str) -> ContextManager:
+    """
+    Time a Milvus call into milvus_rpc_seconds{op, outcome}, in a span.
+    """
+    return _timed(milvus_rpc_seconds, f"milvus.{op}", op=op)
+
+
+def timed_chunks(chunks: Iterable[bytes], stream: str) -> Iterator[bytes]:
+    """
+    Pass a response body through, recording its duration and size.
+    """
+    start = time.perf_counter()
+    try:
+        for chunk in chunks:
+            stream_bytes.inc(len(chunk), stream=stream)
+            yield chunk
+    finally:
+        stream_seconds.observe(time.perf_counter() - start, stream=stream)
+
+
+def counter_samples(stats: Dict[str, Any], keys: Sequence[str], label: str, **labels: Any) -> Samples:
+    """
+    Samples for the numeric `keys` of a component's stats() dict.
+    """
+    return [({**labels, label: key}, float(stats.get(key) or 0)) for key in keys]
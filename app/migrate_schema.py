@@ -0,0 +1,129 @@
+"""
+Move a legacy object collection (all attributes in the `metadata` JSON
+string) to the schema with typed scalar fields.
+
+    python -m app.migrate_schema [--batch-size 1000] [--drop-legacy] [--yes]
+
+Rows are copied into a new collection, which is indexed and verified,
+then the legacy collection is renamed to `<name>_legacy` (or dropped with
+--drop-legacy) and the new one takes its name. Stop the service while
+the migration runs; it refuses to start on a legacy collection anyway.
+Running it again after an interrupted attempt starts the copy over.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+from pymilvus import Collection, utility
+
+from .milvus_client import (
+    COLLECTION_NAME,
+    connect,
+    ensure_collection,
+    ensure_scalar_indexes,
+    entity_columns,
+    index_params,
+    is_legacy_schema,
+    query_pages,
+    row_partition,
+)
+
+logger = logging.getLogger(__name__)
+
+TARGET_NAME = f"{COLLECTION_NAME}_migrating"
+LEGACY_NAME = f"{COLLECTION_NAME}_legacy"
+
+
+def _legacy_metadata(row: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        metadata = json.loads(row["metadata"])
+    except (TypeError, json.JSONDecodeError):
+        logger.warning(f"Row {row['id']} has unreadable metadata; copying it without attributes")
+        metadata = {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def copy_rows(source: Collection, target: Collection, batch_size: int) -> int:
+    """
+    Copy every row, paging by primary key, into the partition of its
+    city and location.
+    """
+    copied = 0
+    for page in query_pages(["embedding", "metadata"], batch_size=batch_size, collection=source):
+        rows: List = [(row["id"], row["embedding"], _legacy_metadata(row)) for row in page]
+        groups: Dict[str, List] = {}
+        for row in rows:
+            groups.setdefault(row_partition(row[2]), []).append(row)
+        for partition, group in groups.items():
+            if not target.has_partition(partition):
+                target.create_partition(partition)
+            target.insert(entity_columns(group), partition_name=partition)
+        copied += len(rows)
+        logger.info(f"Copied {copied} rows (last id {page[-1]['id']})")
+    return copied
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop-legacy", action="store_true", help="drop the old collection instead of keeping it")
+    parser.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    connect()
+    if not utility.has_collection(COLLECTION_NAME):
+        print(f"{COLLECTION_NAME} does not exist; the service creates it with the new schema")
+        return 0
+    source = Collection(COLLECTION_NAME)
+    if not is_legacy_schema(source):
+        print(f"{COLLECTION_NAME} already has the scalar fields; nothing to do")
+        return 0
+    if utility.has_collection(LEGACY_NAME):
+        print(f"{LEGACY_NAME} exists from an earlier migration; drop or rename it first")
+        return 1
+
+    source.flush()
+    total = source.num_entities
+    print(f"collection: {COLLECTION_NAME} ({total} entities, legacy schema)")
+    if not args.yes:
+        answer = input(f"Migrate {COLLECTION_NAME} to typed scalar fields? Stop the service first. [y/N] ")
+        if answer.strip().lower() != "y":
+            print("aborted")
+            return 1
+
+    start = time.monotonic()
+    if utility.has_collection(TARGET_NAME):
+        logger.info(f"Dropping {TARGET_NAME} left over from an interrupted migration")
+        utility.drop_collection(TARGET_NAME)
+    ensure_collection(TARGET_NAME)
+    target = Collection(TARGET_NAME)
+    source.load()
+
+    copied = copy_rows(source, target, args.batch_size)
+    target.flush()
+    if copied != total or target.num_entities != total:
+        print(f"copied {copied} rows, target has {target.num_entities}, expected {total}; "
+              f"leaving {COLLECTION_NAME} untouched")
+        return 1
+
+    target.create_index(field_name="embedding", index_params=index_params())
+    ensure_scalar_indexes(target)
+    utility.wait_for_index_building_complete(TARGET_NAME)
+
+    source.release()
+    if args.drop_legacy:
+        utility.drop_collection(COLLECTION_NAME)
+    else:
+        utility.rename_collection(COLLECTION_NAME, LEGACY_NAME)
+    utility.rename_collection(TARGET_NAME, COLLECTION_NAME)
+    kept = "dropped" if args.drop_legacy else f"kept as {LEGACY_NAME}"
+    print(f"migrated {copied} rows in {time.monotonic() - start:.1f}s; legacy collection {kept}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
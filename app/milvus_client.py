@@ -1,5 +1,9 @@
 import json
-from typing import List, Dict, Any
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Tuple, Union
 
 from pymilvus import (
     connections,
@@ -7,23 +11,233 @@ from pymilvus import (
     DataType, Collection, utility
 )
 
-from .config import settings
+from . import geo, metrics
+from .config import Settings, settings
+from .type_catalog import type_catalog
+from .write_buffer import Row, WriteBuffer
 
-connections.connect(host=settings.MILVUS_HOST, port=settings.MILVUS_PORT)
+logger = logging.getLogger(__name__)
 
 COLLECTION_NAME = "object_vectors"
 
-def ensure_collection() -> None:
+METRIC_TYPE = "L2"
+INDEX_TYPES = ("FLAT", "IVF_FLAT", "IVF_SQ8", "IVF_PQ", "HNSW")
+
+# Object attributes kept as typed scalar fields, each with a scalar index,
+# so filter expressions run inside Milvus. Everything else (bbox, quality)
+# stays in the `metadata` JSON string.
+# name -> (type, max length for VARCHAR, scalar index type)
+SCALAR_FIELDS: Dict[str, Tuple[DataType, int, str]] = {
+    "type": (DataType.VARCHAR, 128, "Trie"),
+    "city": (DataType.VARCHAR, 128, "Trie"),
+    "timestamp": (DataType.INT64, 0, "STL_SORT"),  # unix seconds, UTC
+    "lat": (DataType.DOUBLE, 0, "STL_SORT"),
+    "lon": (DataType.DOUBLE, 0, "STL_SORT"),
+}
+OUTPUT_FIELDS = ["id", "metadata", *SCALAR_FIELDS]
+# Milvus rejects query limits (and offset + limit) above this
+MAX_QUERY_LIMIT = 16384
+
+
+class LegacySchemaError(RuntimeError):
+    pass
+
+
+_collection: Optional[Collection] = None
+_collection_lock = threading.Lock()
+# names of the existing partitions, refreshed at most every
+# PARTITION_REFRESH_INTERVAL seconds when a name is not known
+_partitions: set = set()
+_partitions_refreshed = 0.0
+_partitions_lock = threading.Lock()
+PARTITION_REFRESH_INTERVAL = 1.0
+
+
+def connect() -> None:
+    """
+    Open the Milvus connection, retrying with exponential backoff.
+    """
+    delay = settings.milvus_connect_backoff
+    for attempt in range(1, settings.milvus_connect_retries + 1):
+        try:
+            connections.connect(
+                alias="default",
+                host=settings.milvus_host,
+                port=settings.milvus_port,
+            )
+            logger.info(f"Connected to Milvus at {settings.milvus_host}:{settings.milvus_port}")
+            return
+        except Exception as e:
+            if attempt == settings.milvus_connect_retries:
+                raise
+            logger.warning(
+                f"Milvus connection attempt {attempt}/{settings.milvus_connect_retries} "
+                f"failed: {e}; retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+
+def init_collection() -> Collection:
+    """
+    Connect, create the collection and its vector index if missing,
+    load it into memory and cache the handle. Called once at startup;
+    later calls return the cached handle.
+    """
+    global _collection
+    with _collection_lock:
+        if _collection is not None:
+            return _collection
+        connect()
+        ensure_collection()
+        collection = Collection(COLLECTION_NAME)
+        if is_legacy_schema(collection):
+            raise LegacySchemaError(
+                f"Collection {COLLECTION_NAME} keeps all attributes in the metadata JSON; "
+                "run `python -m app.migrate_schema` to move it to typed scalar fields"
+            )
+        ensure_scalar_indexes(collection)
+        wanted = index_params()
+        current = describe_index(collection)
+        if current is None:
+            logger.info(f"Creating index on {COLLECTION_NAME}.embedding: {wanted}")
+            collection.create_index(field_name="embedding", index_params=wanted)
+        elif _index_differs(current, wanted):
+            logger.warning(
+                f"Index on {COLLECTION_NAME}.embedding is {current}, settings ask for {wanted}; "
+                "run `python -m app.index_admin rebuild` to migrate"
+            )
+        collection.load()
+        _refresh_partitions(collection)
+        _collection = collection
+        logger.info(f"Collection {COLLECTION_NAME} loaded ({collection.num_entities} entities)")
+        return collection
+
+
+def use_collection(collection: Any) -> None:
+    """
+    Use `collection` instead of connecting to Milvus, e.g. the in-memory
+    app.fakes.milvus.FakeCollection for offline runs. Call before startup.
+    """
+    global _collection
+    with _collection_lock:
+        _refresh_partitions(collection)
+        _collection = collection
+
+
+def index_params(cfg: Settings = settings) -> Dict[str, Any]:
+    """
+    Build-time parameters of the embedding index, from Settings.
+    """
+    index_type = cfg.milvus_index_type.upper()
+    if index_type == "FLAT":
+        params: Dict[str, Any] = {}
+    elif index_type in ("IVF_FLAT", "IVF_SQ8"):
+        params = {"nlist": cfg.milvus_ivf_nlist}
+    elif index_type == "IVF_PQ":
+        if cfg.vector_dim % cfg.milvus_pq_m:
+            raise ValueError(
+                f"MILVUS_PQ_M={cfg.milvus_pq_m} must divide VECTOR_DIM={cfg.vector_dim}"
+            )
+        params = {"nlist": cfg.milvus_ivf_nlist, "m": cfg.milvus_pq_m, "nbits": cfg.milvus_pq_nbits}
+    elif index_type == "HNSW":
+        params = {"M": cfg.milvus_hnsw_m, "efConstruction": cfg.milvus_hnsw_ef_construction}
+    else:
+        raise ValueError(f"Unsupported MILVUS_INDEX_TYPE {cfg.milvus_index_type!r}, expected one of {INDEX_TYPES}")
+    return {"index_type": index_type, "metric_type": METRIC_TYPE, "params": params}
+
+
+def search_params(cfg: Settings = settings) -> Dict[str, Any]:
+    """
+    Query-time parameters matching index_params().
+    """
+    index_type = cfg.milvus_index_type.upper()
+    if index_type == "HNSW":
+        params: Dict[str, Any] = {"ef": cfg.milvus_hnsw_ef}
+    elif index_type.startswith("IVF"):
+        params = {"nprobe": cfg.milvus_ivf_nprobe}
+    else:
+        params = {}
+    return {"metric_type": METRIC_TYPE, "params": params}
+
+
+def describe_index(collection: Collection) -> Optional[Dict[str, Any]]:
+    """
+    Parameters of the index currently built on the embedding field, if any.
+    """
+    for index in collection.indexes:
+        if index.field_name == "embedding":
+            return dict(index.params)
+    return None
+
+
+def rebuild_index(collection: Collection, params: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Replace the embedding index with `params` (default: from Settings).
+    The collection is released while the new index builds, so searches
+    fail until it is loaded again.
+    """
+    params = params or index_params()
+    collection.release()
+    for index in collection.indexes:
+        if index.field_name == "embedding":
+            collection.drop_index(index_name=index.index_name)
+    logger.info(f"Building index on {collection.name}.embedding: {params}")
+    collection.create_index(field_name="embedding", index_params=params)
+    utility.wait_for_index_building_complete(collection.name)
+    collection.load()
+
+
+def get_collection() -> Collection:
+    """
+    Cached, loaded collection handle (initialized on first use).
+    """
+    if _collection is not None:
+        return _collection
+    return init_collection()
+
+
+def _index_differs(current: Dict[str, Any], wanted: Dict[str, Any]) -> bool:
+    current_params = current.get("params", {})
+    if isinstance(current_params, str):
+        current_params = json.loads(current_params)
+    return (
+        current.get("index_type") != wanted["index_type"]
+        or {k: int(v) for k, v in current_params.items()} != wanted["params"]
+    )
+
+
+def is_ready() -> bool:
+    """
+    True once the collection is connected, indexed and loaded.
+    """
+    return _collection is not None
+
+
+def close() -> None:
+    global _collection
+    with _collection_lock:
+        _collection = None
+        connections.disconnect("default")
+
+
+def ensure_collection(name: str = COLLECTION_NAME) -> None:
     """
     Create the collection
     fields :
       - id: primary key (VARCHAR)
       - embedding: FLOAT_VECTOR
-      - metadata: VARCHAR (JSON-str)
+      - metadata: VARCHAR (JSON-str, attributes without a scalar field)
+      - type, city: VARCHAR
+      - timestamp: INT64 (unix seconds)
+      - lat, lon: DOUBLE
     """
-    if utility.has_collection(COLLECTION_NAME):
+    if utility.has_collection(name):
         return
+    Collection(name=name, schema=object_schema(), consistency_level="Strong")
 
+
+def object_schema() -> CollectionSchema:
     fields = [
         FieldSchema(
             name="id",
@@ -34,7 +248,7 @@ def ensure_collection() -> None:
         FieldSchema(
             name="embedding",
             dtype=DataType.FLOAT_VECTOR,
-            dim=settings.VECTOR_DIM
+            dim=settings.vector_dim
         ),
         FieldSchema(
             name="metadata",
@@ -42,84 +256,448 @@ def ensure_collection() -> None:
             max_length=8192
         )
     ]
-    schema = CollectionSchema(fields, description="Collection of 3D object embeddings")
-    Collection(name=COLLECTION_NAME, schema=schema, consistency_level="Strong")
+    for field, (dtype, max_length, _) in SCALAR_FIELDS.items():
+        if dtype == DataType.VARCHAR:
+            fields.append(FieldSchema(name=field, dtype=dtype, max_length=max_length))
+        else:
+            fields.append(FieldSchema(name=field, dtype=dtype))
+    return CollectionSchema(fields, description="Collection of 3D object embeddings")
+
+
+def is_legacy_schema(collection: Collection) -> bool:
+    """
+    True for collections created before the scalar fields existed.
+    """
+    names = {field.name for field in collection.schema.fields}
+    return not set(SCALAR_FIELDS) <= names
+
+
+def ensure_scalar_indexes(collection: Collection) -> None:
+    """
+    Create missing scalar indexes. Milvus versions without scalar index
+    support still filter on the fields, just without an index.
+    """
+    indexed = {index.field_name for index in collection.indexes}
+    for field, (_, _, index_type) in SCALAR_FIELDS.items():
+        if field in indexed:
+            continue
+        try:
+            collection.create_index(
+                field_name=field,
+                index_params={"index_type": index_type},
+                index_name=f"{field}_idx",
+            )
+            logger.info(f"Created {index_type} index on {collection.name}.{field}")
+        except Exception as e:
+            logger.warning(f"Could not create a scalar index on {collection.name}.{field}: {e}")
+
+
+def _epoch_seconds(value: Any) -> int:
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not value:
+        return 0
+    parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def split_metadata(metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Metadata dict as used by the service -> (scalar field values, rest).
+    """
+    rest = dict(metadata)
+    scalars: Dict[str, Any] = {}
+    for field, (dtype, max_length, _) in SCALAR_FIELDS.items():
+        value = rest.pop(field, None)
+        if dtype == DataType.VARCHAR:
+            # an over-long value would fail the whole insert batch
+            scalars[field] = str(value or "")[:max_length]
+        elif dtype == DataType.INT64:
+            scalars[field] = _epoch_seconds(value)
+        else:
+            scalars[field] = float(value or 0.0)
+    return scalars, rest
+
+
+def join_metadata(entity: Any) -> Dict[str, Any]:
+    """
+    Inverse of split_metadata() for a query row or search hit entity.
+    """
+    try:
+        metadata = json.loads(entity.get("metadata"))
+    except (TypeError, json.JSONDecodeError):
+        metadata = {}
+    for field in SCALAR_FIELDS:
+        metadata[field] = entity.get(field)
+    metadata["timestamp"] = datetime.fromtimestamp(metadata["timestamp"] or 0, tz=timezone.utc).isoformat()
+    return metadata
+
+
+def scalar_filter(filters: Optional[Dict[str, Any]]) -> str:
+    """
+    Milvus expression for equality filters on scalar fields.
+    """
+    if not filters:
+        return ""
+    unknown = set(filters) - set(SCALAR_FIELDS)
+    if unknown:
+        raise ValueError(f"Not scalar fields: {sorted(unknown)}")
+    return " and ".join(f"{field} == {json.dumps(value)}" for field, value in filters.items())
+
+
+def entity_columns(rows: Sequence[Tuple[str, List[float], Dict[str, Any]]]) -> List[List[Any]]:
+    """
+    (id, vector, metadata) rows -> insert columns in schema order.
+    """
+    split = [split_metadata(metadata) for _, _, metadata in rows]
+    return [
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [json.dumps(rest) for _, rest in split],
+        *([scalars[field] for scalars, _ in split] for field in SCALAR_FIELDS),
+    ]
 
 
 def insert_vector(
     id: str,
     vector: List[float],
-    metadata: Dict[str, Any]
+    metadata: Dict[str, Any],
+    upsert: bool = False
+) -> None:
+    insert_vectors([id], [vector], [metadata], upsert=upsert)
+
+
+def insert_vectors(
+    ids: Sequence[str],
+    vectors: Sequence[List[float]],
+    metadatas: Sequence[Dict[str, Any]],
+    upsert: Union[bool, Sequence[bool]] = False
 ) -> None:
-    ensure_collection()
-    collection = Collection(COLLECTION_NAME)
-    metadata_str = json.dumps(metadata)
-    ids = [id]
-    vecs = [vector]
-    metas = [metadata_str]
-    collection.insert([ids, vecs, metas])
-    collection.flush()
+    """
+    Queue rows in the write-behind buffer. `upsert` rows replace the stored
+    row with the same id instead of adding a second one.
+    """
+    if isinstance(upsert, bool):
+        upsert = [upsert] * len(ids)
+    write_buffer.add_many(list(zip(ids, vectors, metadatas, upsert)))
+
+
+def _write_rows(rows: List[Row]) -> None:
+    """
+    Buffer writer: one delete for replaced ids and one insert per partition.
+    Segments are not sealed here; Milvus seals them on its own schedule.
+    """
+    with metrics.timed_stage("flush"):
+        _write_partitions(rows)
+    try:
+        type_catalog.record(
+            (row_id, metadata.get("type") or "", metadata.get("city") or "")
+            for row_id, _, metadata, _ in rows
+        )
+    except Exception as e:
+        # the rows are stored; `python -m app.type_catalog rebuild` repairs the counts
+        logger.error(f"Failed to update the type catalog for {len(rows)} rows: {e}")
+
+
+def _write_partitions(rows: List[Row]) -> None:
+    collection = get_collection()
+    groups: Dict[str, List[Row]] = {}
+    for row in rows:
+        groups.setdefault(row_partition(row[2]), []).append(row)
+    for partition in groups:
+        ensure_partition(collection, partition)
+    replaced = [row_id for row_id, _, _, upsert in rows if upsert]
+    if replaced:
+        # over all partitions: an updated object may have moved to another tile
+        with metrics.timed_rpc("delete"):
+            collection.delete(expr=f"id in {json.dumps(replaced)}")
+    written: List[str] = []
+    for partition, group in groups.items():
+        try:
+            with metrics.timed_rpc("insert"):
+                collection.insert(entity_columns([row[:3] for row in group]), partition_name=partition)
+        except Exception:
+            # the buffer retries the whole batch; drop the groups already
+            # written so the retry does not store them twice
+            if written:
+                with metrics.timed_rpc("delete"):
+                    collection.delete(expr=f"id in {json.dumps(written)}")
+            raise
+        written.extend(row[0] for row in group)
+
+
+def _refresh_partitions(collection: Collection) -> None:
+    global _partitions_refreshed
+    with _partitions_lock:
+        _partitions.clear()
+        _partitions.update(partition.name for partition in collection.partitions)
+        _partitions_refreshed = time.monotonic()
+
+
+def existing_partitions(collection: Collection, names: Sequence[str]) -> List[str]:
+    """
+    The partitions of `names` that exist (created by any replica).
+    """
+    if any(name not in _partitions for name in names) and (
+        time.monotonic() - _partitions_refreshed >= PARTITION_REFRESH_INTERVAL
+    ):
+        _refresh_partitions(collection)
+    return [name for name in names if name in _partitions]
+
+
+def ensure_partition(collection: Collection, name: str) -> None:
+    """
+    Create and load partition `name` unless it exists.
+    """
+    if name in _partitions:
+        return
+    with _partitions_lock:
+        if name in _partitions:
+            return
+        if not collection.has_partition(name):
+            try:
+                collection.create_partition(name)
+                logger.info(f"Created partition {COLLECTION_NAME}.{name}")
+            except Exception:
+                # another replica may have created it in between
+                if not collection.has_partition(name):
+                    raise
+        try:
+            collection.load(partition_names=[name])
+        except Exception as e:
+            # Milvus versions that load new partitions of a loaded collection
+            # by themselves refuse this
+            logger.warning(f"Could not load partition {name}: {e}")
+        _partitions.add(name)
+
+
+def row_partition(metadata: Dict[str, Any]) -> str:
+    return geo.object_partition(metadata.get("city"), metadata.get("lat"), metadata.get("lon"))
+
+
+def _seal() -> None:
+    get_collection().flush()
+
+
+write_buffer = WriteBuffer(
+    writer=_write_rows,
+    sealer=_seal,
+    max_rows=settings.write_buffer_max_rows,
+    flush_interval=settings.write_buffer_flush_interval,
+    max_pending=settings.write_buffer_max_pending,
+    put_timeout=settings.write_buffer_put_timeout,
+)
 
 
 def search_vector(
     vector: List[float],
-    top_k: int = 5
+    top_k: int = 5,
+    filters: Optional[Dict[str, Any]] = None,
+    partitions: Optional[Sequence[str]] = None
 ) -> List[Dict[str, Any]]:
-    ensure_collection()
-    collection = Collection(COLLECTION_NAME)
-    search_params = {
-        "metric_type": "L2",
-        "params": {"nprobe": 10}
-    }
-    results = collection.search(
-        data=[vector],
-        anns_field="embedding",
-        param=search_params,
-        limit=top_k,
-        output_fields=["id", "metadata"]
-    )
+    return search_vectors([vector], top_k=top_k, filters=filters, partitions=partitions)[0]
+
 
-    processed: List[Dict[str, Any]] = []
-    for hits in results:
+def search_vectors(
+    vectors: Sequence[List[float]],
+    top_k: int = 5,
+    filters: Optional[Dict[str, Any]] = None,
+    partitions: Optional[Sequence[str]] = None
+) -> List[List[Dict[str, Any]]]:
+    """
+    Multi-vector search: one RPC for the whole batch.
+    Returns a list of hits per query vector, in input order. `filters`
+    (equality on scalar fields) is evaluated by Milvus before the search;
+    `partitions` limits it to those partitions (None: all).
+    """
+    if not vectors:
+        return []
+    # read-your-writes: rows still in the write buffer win over stored ones.
+    # The buffer is searched first so a row flushed in between is still
+    # seen by the (strongly consistent) Milvus search.
+    buffered_hits, buffered_ids = write_buffer.search(vectors, top_k=top_k, filters=filters)
+
+    collection = get_collection()
+    with metrics.timed_rpc("search"):
+        results = collection.search(
+            data=list(vectors),
+            anns_field="embedding",
+            param=search_params(),
+            limit=top_k,
+            expr=scalar_filter(filters) or None,
+            partition_names=existing_partitions(collection, partitions) if partitions is not None else None,
+            output_fields=OUTPUT_FIELDS
+        )
+
+    processed: List[List[Dict[str, Any]]] = []
+    for hits, pending in zip(results, buffered_hits):
+        per_query: List[Dict[str, Any]] = list(pending)
         for hit in hits:
             entity = hit.entity
             obj_id = entity.id
-            raw_meta = entity.metadata
-            try:
-                meta = json.loads(raw_meta)
-            except (TypeError, json.JSONDecodeError):
-                meta = {}
-            processed.append({
+            if obj_id in buffered_ids:
+                continue
+            per_query.append({
                 "id": obj_id,
                 "distance": hit.distance,
-                "metadata": meta
+                "metadata": join_metadata(entity)
             })
+        per_query.sort(key=lambda h: h["distance"])
+        processed.append(per_query[:top_k])
     return processed
 
 
-def get_all_distinct_types() -> List[str]:
+def query_pages(
+    output_fields: List[str],
+    expr: str = "",
+    batch_size: int = 1000,
+    collection: Optional[Collection] = None,
+    partitions: Optional[List[str]] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    All rows matching `expr` (in `partitions`, if given), in pages of up to
+    `batch_size` rows. Uses the server-side query iterator where pymilvus
+    has one (2.3+), otherwise a primary-key cursor; either way the cost per
+    page does not grow with the position like offset paging does, and there
+    is no offset cap.
+    """
+    collection = collection or get_collection()
+    fields = output_fields if "id" in output_fields else ["id", *output_fields]
+    batch_size = max(1, min(batch_size, MAX_QUERY_LIMIT))
+    if hasattr(collection, "query_iterator"):
+        iterator = collection.query_iterator(
+            batch_size=batch_size, expr=expr or 'id != ""', output_fields=fields, partition_names=partitions
+        )
+        try:
+            while True:
+                with metrics.timed_rpc("query"):
+                    page = iterator.next()
+                if not page:
+                    return
+                yield page
+        finally:
+            iterator.close()
+
+    last_id: Optional[str] = None
+    while True:
+        # limited query results are merged by primary key, so a page holds
+        # the smallest ids after the cursor
+        cursor = f"id > {json.dumps(last_id)}" if last_id is not None else 'id != ""'
+        with metrics.timed_rpc("query"):
+            page = collection.query(
+                expr=f"({cursor}) and ({expr})" if expr else cursor,
+                output_fields=fields,
+                partition_names=partitions,
+                limit=batch_size,
+            )
+        if not page:
+            return
+        page.sort(key=lambda row: row["id"])
+        yield page
+        last_id = page[-1]["id"]
+
+
+def area_expression(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    types: Optional[List[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None
+) -> str:
     """
-    Returns all distinct 'type' values currently stored in Milvus metadata.
-    Warning: this does a full scan of metadata.
+    Milvus expression for objects inside a lat/lon box (west > east: the box
+    crosses the antimeridian), optionally of `types`, captured in
+    [since, until] and with ids after the `after` cursor. Evaluated with the
+    lat/lon/timestamp scalar indexes.
     """
-    ensure_collection()
-    collection = Collection(COLLECTION_NAME)
-    results = collection.query(expr="", output_fields=["metadata"])
-    types = set()
-    for row in results:
-        meta = json.loads(row["metadata"])
-        types.add(meta.get("type"))
-    return list(types)
+    clauses = [f"lat >= {south!r}", f"lat <= {north!r}"]
+    if west <= east:
+        if west > -180.0 or east < 180.0:
+            clauses += [f"lon >= {west!r}", f"lon <= {east!r}"]
+    else:
+        clauses.append(f"(lon >= {west!r} or lon <= {east!r})")
+    if types:
+        clauses.append(f"type in {json.dumps(list(types))}")
+    if since is not None:
+        clauses.append(f"timestamp >= {_epoch_seconds(since)}")
+    if until is not None:
+        clauses.append(f"timestamp <= {_epoch_seconds(until)}")
+    if after is not None:
+        clauses.append(f"id > {json.dumps(after)}")
+    return " and ".join(clauses)
+
+
+def area_partitions(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    city: Optional[str] = None
+) -> Optional[List[str]]:
+    """
+    Partitions an area query has to read (None: all).
+    """
+    collection = get_collection()
+    if time.monotonic() - _partitions_refreshed >= PARTITION_REFRESH_INTERVAL:
+        _refresh_partitions(collection)
+    return geo.area_partitions(
+        south, west, north, east, sorted(_partitions), city=city, max_tiles=settings.spatial_max_tiles
+    )
+
+
+def stream_objects_in_area(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    city: Optional[str] = None,
+    types: Optional[List[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    batch_size: Optional[int] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Pages of stored objects (metadata dicts with "id") inside the box,
+    in ascending id order. Rows still in the write buffer are not included.
+    """
+    expr = area_expression(south, west, north, east, types, since, until, after)
+    if city:
+        expr += f" and city == {json.dumps(city)}"
+    partitions = area_partitions(south, west, north, east, city)
+    for page in query_pages(
+        ["metadata", *SCALAR_FIELDS],
+        expr=expr,
+        batch_size=batch_size or settings.stream_page_size,
+        partitions=partitions,
+    ):
+        page.sort(key=lambda row: row["id"])
+        yield [{"id": row["id"], **join_metadata(row)} for row in page]
+
+
+def rebuild_type_catalog(batch_size: int = 5000) -> int:
+    """
+    Re-read the type catalog from the `type` and `city` fields of all rows.
+    """
+    entries = (
+        (row["id"], row["type"], row["city"])
+        for page in query_pages(["type", "city"], batch_size=batch_size)
+        for row in page
+    )
+    return type_catalog.rebuild(entries)
 
 
 def query_ids_by_types(types: List[str]) -> List[str]:
     """
     Returns all object IDs whose metadata.type is in the provided list.
     """
-    ensure_collection()
-    collection = Collection(COLLECTION_NAME)
-    # build Milvus expression: e.g. 'metadata["type"] in ["Car","Tree"]'
-    expr = " or ".join(f'type == "{t}"' for t in types)
+    collection = get_collection()
+    expr = f"type in {json.dumps(list(types))}"
     results = collection.query(expr=expr, output_fields=["id"])
     return [row["id"] for row in results]
 
@@ -128,29 +706,14 @@ def query_ids_excluding_types(types: List[str]) -> List[str]:
     """
     Returns all object IDs whose metadata.type is NOT in the provided list.
     """
-    ensure_collection()
-    collection = Collection(COLLECTION_NAME)
-    expr = " and ".join(f'type != "{t}"' for t in types)
+    collection = get_collection()
+    expr = f"type not in {json.dumps(list(types))}"
     results = collection.query(expr=expr, output_fields=["id"])
     return [row["id"] for row in results]
 
-def stream_ids_by_expression(expr: str, batch_size: int = 1000) -> Iterator[str]:
+def stream_ids_by_expression(expr: str, batch_size: Optional[int] = None) -> Iterator[List[str]]:
     """
-    Yield object IDs matching the Milvus expression in batches.
+    Yield the IDs of objects matching the Milvus expression, one list per page.
     """
-    ensure_collection()
-    collection = Collection(COLLECTION_NAME)
-    # query in pages by using offset+limit
-    offset = 0
-    while True:
-        results = collection.query(
-            expr=expr,
-            output_fields=["id"],
-            limit=batch_size,
-            offset=offset
-        )
-        if not results:
-            break
-        for row in results:
-            yield row["id"]
-        offset += batch_size
\ No newline at end of file
+    for page in query_pages(["id"], expr=expr, batch_size=batch_size or settings.stream_page_size):
+        yield [row["id"] for row in page]
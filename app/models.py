@@ -1,4 +1,4 @@
-from typing import List, Literal, Union
+from typing import List, Literal, Optional, Union
 from datetime import datetime
 from pydantic import BaseModel, Field
 
@@ -10,12 +10,24 @@ class ObjectRequest(BaseModel):
     lon: float
     type: str = Field(..., description="source name of the obj")
     pointcloud: List[List[float]] = Field(
-        ..., description="cloud [x, y, z]..."
+        ..., description="cloud [x, y, z]... (an N x 3 float32 array when sent in binary form)"
     )
     bbox: List[float] = Field(
         ..., description="Bounding box [x, y, z, width, height, depth]"
     )
 
+class ObjectFields(BaseModel):
+    # ObjectRequest without the pointcloud, for binary uploads
+    id: str
+    city: str
+    timestamp: datetime
+    lat: float
+    lon: float
+    type: str = Field(..., description="source name of the obj")
+    bbox: List[float] = Field(
+        ..., description="Bounding box [x, y, z, width, height, depth]"
+    )
+
 class ExistingObject(BaseModel):
     id: str
     city: str
@@ -38,6 +50,31 @@ class LLMFilterResponse(BaseModel):
 
 ObjectResponse = Union[str, ExistingObject]
 
+class BatchObjectRequest(BaseModel):
+    # objects of one ingest batch (e.g. a city tile)
+    objects: List[ObjectRequest] = Field(..., min_items=1)
+
+class BatchObjectResult(BaseModel):
+    id: str
+    status: Literal["created", "updated", "kept", "error"]
+    existing: Optional[ExistingObject] = Field(
+        None, description="Stored object when status is 'kept'"
+    )
+    detail: Optional[str] = None
+
+class BatchObjectResponse(BaseModel):
+    # one result per object, in request order
+    results: List[BatchObjectResult]
+
+class PointCloudStats(BaseModel):
+    # quality of a preprocessed cloud, stored with the object as "quality"
+    raw_points: int
+    points: int
+    extent: List[float] = Field(..., description="Size of the cleaned cloud along x, y, z")
+    centroid: List[float]
+    density: float = Field(..., description="Points per unit of bbox volume")
+    coverage: float = Field(..., description="Share of occupied cells of a grid over the bbox")
+
 class LLMNormalizeResponse(BaseModel):
     normalized_type: str
 
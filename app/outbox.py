@@ -0,0 +1,154 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# (row id, payload, attached binary blob, attempts so far)
+Message = Tuple[int, Dict[str, Any], Optional[bytes], int]
+
+
+class Outbox:
+    """
+    Durable FIFO queue in a local SQLite file.
+
+    Several processes (replicas on one host) may share the file: `claim()`
+    leases messages for `lease_seconds`, so a message is only handed to one
+    worker at a time and is picked up again if that worker dies before
+    calling `ack()` or `retry()`. Messages that cannot be delivered are
+    moved to the `dead_letter` table by `bury()`, where they stay for
+    inspection and are not sent again.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 60.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                blob BLOB,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                lease_until REAL NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at, lease_until)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                blob BLOB,
+                attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+
+    def put(self, payload: Dict[str, Any], blob: Optional[bytes] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO outbox (payload, blob, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (json.dumps(payload), blob, now, now),
+            )
+
+    def claim(self, limit: int) -> List[Message]:
+        """
+        Lease up to `limit` due messages, oldest first.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, payload, blob, attempts FROM outbox "
+                    "WHERE next_attempt_at <= ? AND lease_until <= ? ORDER BY id LIMIT ?",
+                    (now, now, limit),
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE outbox SET lease_until = ? WHERE id = ?",
+                        [(now + self.lease_seconds, row[0]) for row in rows],
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(row[0], json.loads(row[1]), row[2], row[3]) for row in rows]
+
+    def ack(self, ids: Sequence[int]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def retry(self, ids: Sequence[int], delay: float, error: str) -> None:
+        """
+        Release the lease and schedule another attempt in `delay` seconds.
+        """
+        next_attempt = time.time() + delay
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, "
+                "lease_until = 0, last_error = ? WHERE id = ?",
+                [(next_attempt, error[:500], i) for i in ids],
+            )
+
+    def bury(self, ids: Sequence[int], error: str) -> None:
+        """
+        Move messages to the dead-letter table; they are not retried.
+        """
+        now = time.time()
+        params = [(now, error[:500], i) for i in ids]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO dead_letter "
+                    "(id, payload, blob, attempts, created_at, failed_at, last_error) "
+                    "SELECT id, payload, blob, attempts + 1, created_at, ?, ? FROM outbox WHERE id = ?",
+                    params,
+                )
+                self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def depth(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            total, retrying, oldest = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(attempts > 0), 0), MIN(created_at) FROM outbox"
+            ).fetchone()
+            leased = self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE lease_until > ?", (now,)
+            ).fetchone()[0]
+            dead = self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        return {
+            "depth": total,
+            "retrying": retrying,
+            "in_flight": leased,
+            "dead_letters": dead,
+            "oldest_age_seconds": now - oldest if oldest is not None else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
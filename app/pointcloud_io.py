@@ -0,0 +1,137 @@
+"""
+Binary point-cloud upload formats.
+
+Point clouds can be sent without JSON number lists, as one of
+
+* ``application/octet-stream`` — raw little-endian float32, N x 3,
+* ``application/x-npy`` — a NumPy ``.npy`` file (N x 3, any float dtype),
+
+with the other object fields as JSON in the ``X-Object-Fields`` header, or as
+
+* ``application/msgpack`` — a map with the object fields and ``pointcloud``
+  as a bytes value holding raw little-endian float32 N x 3. A map with an
+  ``objects`` list is accepted for batches.
+
+Either way the points become one float32 array without per-point Python
+objects.
+"""
+import io
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pydantic import ValidationError
+
+from .config import settings
+from .models import ObjectFields, ObjectRequest
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+RAW_TYPES = ("application/octet-stream",)
+NPY_TYPES = ("application/x-npy", "application/npy")
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+FIELDS_HEADER = "X-Object-Fields"
+
+
+class PointCloudFormatError(ValueError):
+    """
+    Malformed binary upload; `status_code` is the HTTP status to answer with.
+    """
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def media_type(content_type: Optional[str]) -> str:
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def points_from_raw(body: bytes) -> np.ndarray:
+    if len(body) % 12:
+        raise PointCloudFormatError(
+            f"Raw point cloud must be float32 N x 3 (a multiple of 12 bytes), got {len(body)} bytes"
+        )
+    return _check(np.frombuffer(body, dtype="<f4").reshape(-1, 3))
+
+
+def points_from_npy(body: bytes) -> np.ndarray:
+    try:
+        points = np.load(io.BytesIO(body), allow_pickle=False)
+    except ValueError as e:
+        raise PointCloudFormatError(f"Invalid .npy payload: {e}")
+    if points.ndim != 2 or points.shape[1] != 3 or points.dtype.kind != "f":
+        raise PointCloudFormatError(f"Point cloud must be a float N x 3 array, got {points.dtype} {points.shape}")
+    return _check(points.astype("<f4", copy=False))
+
+
+def _check(points: np.ndarray) -> np.ndarray:
+    if len(points) == 0:
+        raise PointCloudFormatError("Point cloud is empty")
+    if len(points) > settings.max_points:
+        raise PointCloudFormatError(
+            f"Point cloud has {len(points)} points, limit is {settings.max_points}", status_code=413
+        )
+    if not np.isfinite(points).all():
+        raise PointCloudFormatError("Point cloud contains NaN or infinite values")
+    return points
+
+
+def build_request(fields: Dict[str, Any], points: np.ndarray) -> ObjectRequest:
+    """
+    Validate the scalar fields and attach the array without converting it.
+    """
+    try:
+        validated = ObjectFields.parse_obj(fields)
+    except ValidationError as e:
+        raise PointCloudFormatError(f"Invalid object fields: {e}", status_code=422)
+    return ObjectRequest.construct(**validated.dict(), pointcloud=points)
+
+
+def _unpack(body: bytes) -> Any:
+    if msgpack is None:
+        raise PointCloudFormatError("msgpack uploads need the 'msgpack' package", status_code=415)
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise PointCloudFormatError(f"Invalid msgpack payload: {e}")
+
+
+def _request_from_map(item: Any) -> ObjectRequest:
+    if not isinstance(item, dict) or not isinstance(item.get("pointcloud"), (bytes, bytearray)):
+        raise PointCloudFormatError("msgpack object must be a map with a binary 'pointcloud'")
+    fields = dict(item)
+    points = points_from_raw(bytes(fields.pop("pointcloud")))
+    return build_request(fields, points)
+
+
+def parse_object(body: bytes, content_type: Optional[str], fields_header: Optional[str]) -> ObjectRequest:
+    kind = media_type(content_type)
+    if kind in MSGPACK_TYPES:
+        return _request_from_map(_unpack(body))
+    if kind in RAW_TYPES or kind in NPY_TYPES:
+        if not fields_header:
+            raise PointCloudFormatError(f"Missing {FIELDS_HEADER} header with the object fields as JSON")
+        try:
+            fields = json.loads(fields_header)
+        except json.JSONDecodeError as e:
+            raise PointCloudFormatError(f"Invalid {FIELDS_HEADER} header: {e}")
+        points = points_from_raw(body) if kind in RAW_TYPES else points_from_npy(body)
+        return build_request(fields, points)
+    raise PointCloudFormatError(
+        f"Unsupported content type {kind!r}, expected one of "
+        f"{RAW_TYPES + NPY_TYPES + MSGPACK_TYPES}",
+        status_code=415,
+    )
+
+
+def parse_batch(body: bytes, content_type: Optional[str]) -> List[ObjectRequest]:
+    if media_type(content_type) not in MSGPACK_TYPES:
+        raise PointCloudFormatError("Binary batches must be sent as application/msgpack", status_code=415)
+    payload = _unpack(body)
+    if not isinstance(payload, dict) or not isinstance(payload.get("objects"), list) or not payload["objects"]:
+        raise PointCloudFormatError("msgpack batch must be a map with a non-empty 'objects' list")
+    return [_request_from_map(item) for item in payload["objects"]]
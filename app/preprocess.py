@@ -0,0 +1,156 @@
+import logging
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .config import Settings, settings
+from .models import PointCloudStats
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # optional dependency, brute-force kNN is used instead
+    cKDTree = None
+
+logger = logging.getLogger(__name__)
+
+Points = Union[List[List[float]], np.ndarray]
+
+
+def as_array(points: Points) -> np.ndarray:
+    return np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 3)
+
+
+def crop_to_bbox(points: np.ndarray, bbox: Sequence[float], margin: float) -> np.ndarray:
+    """
+    Keep points inside bbox [x, y, z, width, height, depth] (center and size),
+    grown by `margin` (a fraction of the size) on every side.
+    """
+    center = np.asarray(bbox[:3], dtype=np.float32)
+    half = np.abs(np.asarray(bbox[3:6], dtype=np.float32)) * (0.5 + margin)
+    inside = (np.abs(points - center) <= half).all(axis=1)
+    return points[inside]
+
+
+def voxel_downsample(points: np.ndarray, voxel_size: float) -> np.ndarray:
+    """
+    Replace all points of each voxel by their centroid.
+    """
+    if voxel_size <= 0 or len(points) == 0:
+        return points
+    cells = np.floor((points - points.min(axis=0)) / voxel_size).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    sums = np.zeros((len(counts), 3), dtype=np.float64)
+    np.add.at(sums, inverse, points)
+    return (sums / counts[:, None]).astype(np.float32)
+
+
+def _mean_knn_distance(points: np.ndarray, k: int, chunk: int = 512) -> np.ndarray:
+    if cKDTree is not None:
+        distances, _ = cKDTree(points).query(points, k=k + 1)
+        return distances[:, 1:].mean(axis=1)
+    # brute force, chunked to bound memory
+    norms = (points ** 2).sum(axis=1)
+    result = np.empty(len(points), dtype=np.float32)
+    for start in range(0, len(points), chunk):
+        block = points[start:start + chunk]
+        d2 = norms[start:start + chunk, None] - 2.0 * block @ points.T + norms[None, :]
+        nearest = np.partition(np.maximum(d2, 0.0), k, axis=1)[:, 1:k + 1]
+        result[start:start + chunk] = np.sqrt(nearest).mean(axis=1)
+    return result
+
+
+def remove_statistical_outliers(points: np.ndarray, k: int, std_ratio: float, max_points: int) -> np.ndarray:
+    """
+    Drop points whose mean distance to their k nearest neighbours is more
+    than `std_ratio` standard deviations above the average.
+    """
+    if k <= 0 or len(points) <= k:
+        return points
+    if cKDTree is None and len(points) > max_points:
+        logger.debug(f"Skipping outlier removal for {len(points)} points without scipy")
+        return points
+    mean_distance = _mean_knn_distance(points, k)
+    limit = mean_distance.mean() + std_ratio * mean_distance.std()
+    return points[mean_distance <= limit]
+
+
+def quality_stats(
+    points: np.ndarray,
+    bbox: Sequence[float],
+    raw_points: int,
+    grid: int
+) -> PointCloudStats:
+    """
+    Cheap quality measures of a cleaned cloud: points per bbox volume and
+    the share of a grid x grid x grid lattice over the bbox that has points.
+    """
+    size = np.abs(np.asarray(bbox[3:6], dtype=np.float64))
+    volume = float(np.prod(size))
+    if len(points):
+        extent = (points.max(axis=0) - points.min(axis=0)).tolist()
+        centroid = points.mean(axis=0).tolist()
+    else:
+        extent, centroid = [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]
+    coverage = 0.0
+    if len(points) and volume > 0:
+        origin = np.asarray(bbox[:3], dtype=np.float64) - size / 2
+        cells = np.floor((points - origin) / size * grid).astype(np.int64)
+        cells = cells[((cells >= 0) & (cells < grid)).all(axis=1)]
+        occupied = len(np.unique((cells[:, 0] * grid + cells[:, 1]) * grid + cells[:, 2]))
+        coverage = occupied / grid ** 3
+    return PointCloudStats(
+        raw_points=raw_points,
+        points=len(points),
+        extent=extent,
+        centroid=centroid,
+        density=len(points) / volume if volume > 0 else 0.0,
+        coverage=coverage,
+    )
+
+
+def preprocess_pointcloud(
+    points: Points,
+    bbox: Sequence[float],
+    cfg: Settings = settings
+) -> Tuple[np.ndarray, PointCloudStats]:
+    """
+    bbox crop -> voxel downsampling -> statistical outlier removal ->
+    quality stats -> centroid normalization. Returns the cloud to encode
+    and its stats (computed before centering, in bbox coordinates).
+    """
+    cloud = as_array(points)
+    raw_points = len(cloud)
+    if not cfg.preprocess_enabled:
+        return cloud, quality_stats(cloud, bbox, raw_points, cfg.preprocess_coverage_grid)
+
+    if cfg.preprocess_crop_to_bbox and len(bbox) >= 6:
+        cropped = crop_to_bbox(cloud, bbox, cfg.preprocess_bbox_margin)
+        # a bbox in another frame than the points would drop everything
+        if len(cropped) >= cfg.preprocess_min_crop_fraction * raw_points:
+            cloud = cropped
+        else:
+            logger.warning(
+                f"BBox crop would keep {len(cropped)}/{raw_points} points; skipping crop"
+            )
+    cloud = voxel_downsample(cloud, cfg.preprocess_voxel_size)
+    cloud = remove_statistical_outliers(
+        cloud,
+        cfg.preprocess_outlier_neighbors,
+        cfg.preprocess_outlier_std_ratio,
+        cfg.preprocess_outlier_max_points,
+    )
+    stats = quality_stats(cloud, bbox, raw_points, cfg.preprocess_coverage_grid)
+    if cfg.preprocess_center and len(cloud):
+        cloud = cloud - cloud.mean(axis=0)
+    return cloud, stats
+
+
+def density_ratio(incoming: PointCloudStats, existing: Optional[dict]) -> Optional[float]:
+    """
+    Density of the incoming cloud relative to the stored one, if known.
+    """
+    if not existing or not existing.get("density"):
+        return None
+    return incoming.density / existing["density"]
@@ -0,0 +1,92 @@
+"""
+Sampling profiler that can be switched on in a running replica. A thread
+takes the stack of every other thread at a fixed interval and counts them
+as collapsed stacks ("frame;frame;frame count" per line), the input of
+flamegraph.pl and speedscope. Coroutines show up while they run on the
+event loop thread.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+
+def _collapsed(frame: Any) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._started_at = 0.0
+        self._interval = 0.0
+        self._deadline = 0.0
+        self._stopped_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float, max_seconds: float) -> bool:
+        """
+        Start sampling (dropping the previous profile); stops by itself
+        after `max_seconds`. False if it is already running.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self._samples = 0
+            self._interval = interval
+            self._started_at = time.monotonic()
+            self._deadline = self._started_at + max_seconds
+            self._stopped_at = 0.0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5.0)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self._interval) and time.monotonic() < self._deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident != own:
+                        self._stacks[f"{names.get(ident, ident)};{_collapsed(frame)}"] += 1
+                self._samples += 1
+        self._stopped_at = time.monotonic()
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "interval": self._interval,
+                "samples": self._samples,
+                "stacks": len(self._stacks),
+                "seconds": ((self._stopped_at or time.monotonic()) - self._started_at) if self._started_at else 0.0,
+            }
+
+
+profiler = SamplingProfiler()
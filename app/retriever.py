@@ -1,20 +1,269 @@
 # app/retriever.py
 
-from typing import List, Optional, Dict, Any
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from .retrievers.base_retriever import BaseRetriever
+from .config import settings
+from .retrievers.base_retriever import BaseRetriever, Near
+from .retrievers.hot_set_retriever import HotSetRetriever
 from .retrievers.milvus_retriever import MilvusRetriever
 
+logger = logging.getLogger(__name__)
+
+POLICIES = ("first_confident", "best")
+
+# recently inserted objects; fed by the ingest endpoints
+hot_set = HotSetRetriever(
+    capacity=settings.hot_set_size,
+    dim=settings.vector_dim,
+    threshold=settings.dedup_distance_threshold,
+    max_age=settings.hot_set_max_age,
+)
+
+# name -> factory of the stores RETRIEVERS can list
+RETRIEVER_FACTORIES: Dict[str, Callable[[], BaseRetriever]] = {
+    "hot_set": lambda: hot_set,
+    "milvus": lambda: MilvusRetriever(threshold=settings.dedup_distance_threshold),
+}
+
+
+class RetrievalIncomplete(RuntimeError):
+    """
+    No match was found, but a store failed or missed its deadline, so the
+    object may still exist.
+    """
+
+
+def _parse_deadlines(text: str) -> Dict[str, float]:
+    deadlines: Dict[str, float] = {}
+    for part in text.split(","):
+        if part.strip():
+            name, _, seconds = part.partition("=")
+            deadlines[name.strip()] = float(seconds)
+    return deadlines
+
+
+class RetrieverRegistry:
+    """
+    The configured retrievers, queried in parallel. Each has a deadline,
+    counted from when its search starts running; with the "first_confident"
+    policy a hit at or below `confident_distance` is returned without
+    waiting for slower stores, otherwise the closest hit of all stores wins.
+    """
+
+    def __init__(
+        self,
+        retrievers: List[Tuple[str, BaseRetriever]],
+        deadlines: Dict[str, float],
+        default_deadline: float,
+        policy: str = "first_confident",
+        confident_distance: float = 0.0,
+        threads: int = 8,
+        max_wait: Optional[float] = None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Retriever policy must be one of {POLICIES}, got {policy!r}")
+        self.retrievers = retrievers
+        self.deadlines = {name: deadlines.get(name, default_deadline) for name, _ in retrievers}
+        # longest a search may wait for a free pool thread
+        self.max_wait = default_deadline if max_wait is None else max_wait
+        self.policy = policy
+        self.confident_distance = confident_distance
+        self._pool = ThreadPoolExecutor(max_workers=max(threads, len(retrievers)), thread_name_prefix="retriever")
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {name: deque(maxlen=1000) for name, _ in retrievers}
+        self._counters: Dict[str, Dict[str, int]] = {
+            name: {"calls": 0, "hits": 0, "errors": 0, "timeouts": 0, "chosen": 0} for name, _ in retrievers
+        }
+
+    @classmethod
+    def from_settings(cls) -> "RetrieverRegistry":
+        names = [name.strip() for name in settings.retrievers.split(",") if name.strip()]
+        unknown = [name for name in names if name not in RETRIEVER_FACTORIES]
+        if unknown:
+            raise ValueError(f"Unknown retrievers {unknown}; known: {sorted(RETRIEVER_FACTORIES)}")
+        if not settings.hot_set_enabled and "hot_set" in names:
+            names.remove("hot_set")
+        return cls(
+            [(name, RETRIEVER_FACTORIES[name]()) for name in names],
+            _parse_deadlines(settings.retriever_deadlines),
+            default_deadline=settings.stage_timeout_search,
+            policy=settings.retriever_policy,
+            confident_distance=settings.retriever_confident_distance,
+            threads=settings.retriever_threads,
+        )
+
+    def _timed(
+        self,
+        name: str,
+        call: Callable[[], List[Optional[Dict[str, Any]]]],
+        started: Dict[str, float]
+    ) -> List[Optional[Dict[str, Any]]]:
+        start = time.perf_counter()
+        # the deadline counts from here, not from the submit: time spent
+        # queued behind other searches in the pool is not the store's
+        started[name] = time.monotonic()
+        try:
+            return call()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._latencies[name].append(elapsed)
+
+    def search(
+        self,
+        vectors: List[List[float]],
+        filters: List[Optional[Dict[str, Any]]],
+        near: Optional[List[Near]] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Best hit per vector over all retrievers, following the policy.
+        `near` gives the (lat, lon) of each vector to search around.
+        A retriever's deadline starts when its search starts running; one
+        still queued after `max_wait` seconds is given up on as well.
+        Raises RetrievalIncomplete for vectors without a hit when a required
+        store failed or missed its deadline.
+        """
+        submitted = time.monotonic()
+        started: Dict[str, float] = {}
+        futures: Dict[Future, str] = {}
+        required = {name: retriever.required for name, retriever in self.retrievers}
+        for name, retriever in self.retrievers:
+            with self._lock:
+                self._counters[name]["calls"] += 1
+            future = self._pool.submit(
+                self._timed, name, lambda r=retriever: r.retrieve_batch(vectors, filters, near), started
+            )
+            futures[future] = name
+
+        def expires(future: Future) -> float:
+            name = futures[future]
+            begin = started.get(name)
+            if begin is None:
+                # still queued: check again once it could have started and run out
+                return min(time.monotonic() + self.deadlines[name], submitted + self.max_wait)
+            return begin + self.deadlines[name]
+
+        best: List[Optional[Dict[str, Any]]] = [None] * len(vectors)
+        sources: List[Optional[str]] = [None] * len(vectors)
+        incomplete: List[str] = []
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            overdue = [f for f in pending if now >= expires(f)]
+            for future in overdue:
+                name = futures[future]
+                pending.discard(future)
+                future.cancel()
+                if required[name]:
+                    incomplete.append(name)
+                with self._lock:
+                    self._counters[name]["timeouts"] += 1
+                if name in started:
+                    logger.warning(f"Retriever {name} missed its {self.deadlines[name]:.2f}s deadline")
+                else:
+                    logger.warning(f"Retriever {name} did not start within {self.max_wait:.2f}s")
+            if not pending:
+                break
+            timeout = min(expires(f) for f in pending) - now
+            done, pending = wait(pending, timeout=max(timeout, 0.0), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    if required[name]:
+                        incomplete.append(name)
+                    with self._lock:
+                        self._counters[name]["errors"] += 1
+                    logger.error(f"Retriever {name} failed: {e}")
+                    continue
+                hits = 0
+                for i, result in enumerate(results):
+                    if result is None:
+                        continue
+                    hits += 1
+                    if best[i] is None or result["score"] < best[i]["score"]:
+                        best[i], sources[i] = result, name
+                with self._lock:
+                    self._counters[name]["hits"] += hits
+            if self.policy == "first_confident" and all(
+                hit is not None and hit["score"] <= self.confident_distance for hit in best
+            ):
+                break
+
+        with self._lock:
+            for name in sources:
+                if name is not None:
+                    self._counters[name]["chosen"] += 1
+        if incomplete and any(hit is None for hit in best):
+            raise RetrievalIncomplete(f"No match found and retrievers {incomplete} did not answer")
+        return best
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"policy": self.policy, "retrievers": {}}
+        with self._lock:
+            for name, _ in self.retrievers:
+                latencies = sorted(self._latencies[name])
+                stats["retrievers"][name] = {
+                    **self._counters[name],
+                    "deadline": self.deadlines[name],
+                    "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+                    "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+                    "latency_max": latencies[-1] if latencies else 0.0,
+                }
+        return stats
+
+
+_registry: Optional[RetrieverRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> RetrieverRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = RetrieverRegistry.from_settings()
+    return _registry
+
 
 def get_retrievers() -> List[BaseRetriever]:
-    return [
-        MilvusRetriever()
-    ]
+    return [retriever for _, retriever in get_registry().retrievers]
+
+
+def remember(
+    ids: List[str],
+    vectors: List[List[float]],
+    metadatas: List[Dict[str, Any]]
+) -> None:
+    """
+    Make just-inserted objects findable by the hot set.
+    """
+    if settings.hot_set_enabled:
+        hot_set.add_many(ids, vectors, metadatas)
+
+
+def find_existing(
+    vector: List[float],
+    filters: Optional[Dict[str, Any]] = None,
+    near: Near = None
+) -> Optional[Dict[str, Any]]:
+    return get_registry().search([vector], [filters], [near])[0]
 
 
-def find_existing(vector: List[float]) -> Optional[Dict[str, Any]]:
-    for retriever in get_retrievers():
-        result = retriever.retrieve(vector)
-        if result:
-            return result
-    return None
+def find_existing_batch(
+    vectors: List[List[float]],
+    filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+    near: Optional[List[Near]] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Batched find_existing: every retriever gets the whole batch at once.
+    """
+    if not vectors:
+        return []
+    return get_registry().search(vectors, filters or [None] * len(vectors), near)
@@ -1,19 +1,46 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+
+# (lat, lon) of the incoming object, to search only around it
+Near = Optional[Tuple[Optional[float], Optional[float]]]
 
 
 class BaseRetriever(ABC):
+    # False for stores whose misses are covered elsewhere: when such a store
+    # fails or is late, the search is not reported as incomplete
+    required = True
 
     @abstractmethod
-    def retrieve(self, vector: List[float]) -> Optional[Dict[str, Any]]:
+    def retrieve(
+        self,
+        vector: List[float],
+        filters: Optional[Dict[str, Any]] = None,
+        near: Near = None
+    ) -> Optional[Dict[str, Any]]:
         """
-        Take the embedding vector and try to find an existing object.
+        Take the embedding vector and try to find an existing object
+        whose metadata matches `filters` (field -> value), if given, and
+        that lies in the area around `near` (see app.geo), if given.
         Returns a dictionary with keys:
+        - id: primary key of the matched object (str)
         - vector: original embedding (List[float])
         - metadata: metadata objects from Milvus (Dict[str, Any])
         - score: homogeneity/distance measure (float)
         or None if there is no match.
-        ""
+        """
         ...
 
-
+    def retrieve_batch(
+        self,
+        vectors: List[List[float]],
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+        near: Optional[List[Near]] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Same as retrieve() for several vectors (with one filter and location
+        per vector), results in input order. Stores with a native
+        multi-vector search should override this.
+        """
+        filters = filters or [None] * len(vectors)
+        near = near or [None] * len(vectors)
+        return [self.retrieve(vector, f, n) for vector, f, n in zip(vectors, filters, near)]
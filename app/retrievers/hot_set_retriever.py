@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ..geo import object_partition, search_partitions
+from .base_retriever import BaseRetriever, Near
+
+
+class HotSetRetriever(BaseRetriever):
+    # the most recently inserted objects, in memory
+    # (the write buffer already gives Milvus searches read-your-writes)
+    required = False
+
+    def __init__(self, capacity: int, dim: int, threshold: float = 0.8, max_age: float = 0.0):
+        """
+        Ring buffer of the last `capacity` embeddings in one float32 matrix.
+        Rows older than `max_age` seconds (0: no limit) are not matched.
+        """
+        self.capacity = max(1, capacity)
+        self.dim = dim
+        self.threshold = threshold
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((self.capacity, dim), dtype=np.float32)
+        self._norms = np.zeros(self.capacity, dtype=np.float32)
+        self._added = np.zeros(self.capacity, dtype=np.float64)
+        self._valid = np.zeros(self.capacity, dtype=bool)
+        self._ids = np.empty(self.capacity, dtype=object)
+        self._metadata: List[Optional[Dict[str, Any]]] = [None] * self.capacity
+        # field -> values per slot, for vectorized equality filters
+        self._columns: Dict[str, np.ndarray] = {}
+        # Milvus partition of each slot, so `near` scans the same area
+        self._partitions = np.empty(self.capacity, dtype=object)
+        self._slots: Dict[str, int] = {}
+        self._next = 0
+        self._used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add_many(
+        self,
+        ids: Sequence[str],
+        vectors: Sequence[List[float]],
+        metadatas: Sequence[Dict[str, Any]]
+    ) -> None:
+        """
+        Remember inserted or updated objects; a later row for an id replaces
+        the earlier one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for obj_id, vector, metadata in zip(ids, vectors, metadatas):
+                previous = self._slots.pop(obj_id, None)
+                if previous is not None:
+                    self._valid[previous] = False
+                slot = self._next
+                if self._valid[slot]:
+                    self.evictions += 1
+                    self._slots.pop(self._ids[slot], None)
+                row = np.asarray(vector, dtype=np.float32)
+                self._matrix[slot] = row
+                self._norms[slot] = float(row @ row)
+                self._added[slot] = now
+                self._valid[slot] = True
+                self._ids[slot] = obj_id
+                self._metadata[slot] = metadata
+                self._partitions[slot] = object_partition(
+                    metadata.get("city"), metadata.get("lat"), metadata.get("lon")
+                )
+                for field, column in self._columns.items():
+                    column[slot] = metadata.get(field)
+                self._slots[obj_id] = slot
+                self._next = (slot + 1) % self.capacity
+                self._used = max(self._used, slot + 1)
+
+    def _column(self, field: str) -> np.ndarray:
+        column = self._columns.get(field)
+        if column is None:
+            column = np.empty(self.capacity, dtype=object)
+            for slot in range(self._used):
+                if self._metadata[slot] is not None:
+                    column[slot] = self._metadata[slot].get(field)
+            self._columns[field] = column
+        return column
+
+    def retrieve(
+        self,
+        vector: List[float],
+        filters: Optional[Dict[str, Any]] = None,
+        near: Near = None
+    ) -> Optional[Dict[str, Any]]:
+        return self.retrieve_batch([vector], [filters], [near])[0]
+
+    def retrieve_batch(
+        self,
+        vectors: List[List[float]],
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+        near: Optional[List[Near]] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        filters = filters or [None] * len(vectors)
+        near = near or [None] * len(vectors)
+        partitions: List[Optional[List[str]]] = []
+        for f, n in zip(filters, near):
+            lat, lon = n or (None, None)
+            partitions.append(search_partitions((f or {}).get("city"), lat, lon))
+        found: List[Optional[Dict[str, Any]]] = [None] * len(vectors)
+        if not vectors:
+            return found
+        queries = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            used = self._used
+            if used:
+                live = self._valid[:used].copy()
+                if self.max_age:
+                    live &= self._added[:used] >= time.monotonic() - self.max_age
+                # squared L2, like Milvus
+                distances = (
+                    self._norms[:used][None, :]
+                    - 2.0 * queries @ self._matrix[:used].T
+                    + (queries ** 2).sum(axis=1)[:, None]
+                )
+                # one mask per distinct filter and area (usually one per batch)
+                groups: Dict[str, List[int]] = {}
+                for i, (f, names) in enumerate(zip(filters, partitions)):
+                    groups.setdefault(json.dumps([f, names], sort_keys=True), []).append(i)
+                for indices in groups.values():
+                    mask = live
+                    for field, value in (filters[indices[0]] or {}).items():
+                        mask = mask & (self._column(field)[:used] == value)
+                    if partitions[indices[0]] is not None:
+                        mask = mask & np.isin(self._partitions[:used], partitions[indices[0]])
+                    if not mask.any():
+                        continue
+                    masked = np.where(mask[None, :], distances[indices], np.inf)
+                    best = masked.argmin(axis=1)
+                    for n, (i, slot) in enumerate(zip(indices, best)):
+                        distance = max(float(masked[n, slot]), 0.0)
+                        if distance < self.threshold:
+                            found[i] = {
+                                "id": self._ids[slot],
+                                "vector": vectors[i],
+                                "metadata": self._metadata[slot],
+                                "score": distance,
+                            }
+            hits = sum(1 for result in found if result)
+            self.hits += hits
+            self.misses += len(found) - hits
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = int(self._valid.sum())
+            if self.max_age and size:
+                fresh = int((self._valid & (self._added >= time.monotonic() - self.max_age)).sum())
+            else:
+                fresh = size
+            hits, misses, evictions = self.hits, self.misses, self.evictions
+        lookups = hits + misses
+        return {
+            "capacity": self.capacity,
+            "size": size,
+            "fresh": fresh,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
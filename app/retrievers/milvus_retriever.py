@@ -1,7 +1,14 @@
+import json
 from typing import List, Dict, Any, Optional
 
-from ..milvus_client import search_vector
-from .base_retriever import BaseRetriever
+from ..geo import search_partitions
+from ..milvus_client import search_vectors
+from .base_retriever import BaseRetriever, Near
+
+
+def _partitions(filters: Optional[Dict[str, Any]], near: Near) -> Optional[List[str]]:
+    lat, lon = near or (None, None)
+    return search_partitions((filters or {}).get("city"), lat, lon)
 
 
 class MilvusRetriever(BaseRetriever):
@@ -10,9 +17,42 @@ class MilvusRetriever(BaseRetriever):
     def __init__(self, threshold: float = 0.8):
         self.threshold = threshold
 
-    def retrieve(self, vector: List[float]) -> Optional[Dict[str, Any]]:
-        # find only the nearest
-        results = search_vector(vector, top_k=1)
+    def retrieve(
+        self,
+        vector: List[float],
+        filters: Optional[Dict[str, Any]] = None,
+        near: Near = None
+    ) -> Optional[Dict[str, Any]]:
+        return self.retrieve_batch([vector], [filters], [near])[0]
+
+    def retrieve_batch(
+        self,
+        vectors: List[List[float]],
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+        near: Optional[List[Near]] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        # one multi-vector search per distinct filter and partition set
+        # (objects of one batch usually share a city and area)
+        filters = filters or [None] * len(vectors)
+        near = near or [None] * len(vectors)
+        groups: Dict[str, List[int]] = {}
+        partitions: Dict[str, Optional[List[str]]] = {}
+        for i, (f, n) in enumerate(zip(filters, near)):
+            names = _partitions(f, n)
+            key = json.dumps([f, names], sort_keys=True)
+            groups.setdefault(key, []).append(i)
+            partitions[key] = names
+        found: List[Optional[Dict[str, Any]]] = [None] * len(vectors)
+        for key, indices in groups.items():
+            # find only the nearest
+            results = search_vectors(
+                [vectors[i] for i in indices], top_k=1, filters=filters[indices[0]], partitions=partitions[key]
+            )
+            for i, hits in zip(indices, results):
+                found[i] = self._match(vectors[i], hits)
+        return found
+
+    def _match(self, vector: List[float], results: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
         if not results:
             return None
 
@@ -22,6 +62,7 @@ class MilvusRetriever(BaseRetriever):
 
         if distance < self.threshold:
             return {
+                "id": top_hit["id"],
                 "vector": vector,
                 "metadata": metadata,
                 "score": distance
@@ -0,0 +1,65 @@
+"""
+Encoding of long result streams: one chunk per page of results instead of
+one write per item, optionally gzip-compressed on the fly.
+"""
+import json
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+FORMATS = ("text", "ndjson")
+MEDIA_TYPES = {"text": "text/plain", "ndjson": "application/x-ndjson"}
+
+
+def id_chunks(pages: Iterable[List[str]], fmt: str = "text") -> Iterator[bytes]:
+    """
+    "text": one id per line; "ndjson": one {"id": ...} object per line.
+    """
+    for ids in pages:
+        if not ids:
+            continue
+        if fmt == "ndjson":
+            yield "".join(f'{{"id": {json.dumps(i)}}}\n' for i in ids).encode()
+        else:
+            yield ("\n".join(ids) + "\n").encode()
+
+
+def object_chunks(pages: Iterable[List[Dict[str, Any]]], fields: Sequence[str], limit: Optional[int] = None) -> Iterator[bytes]:
+    """
+    One JSON object with `fields` per line, at most `limit` lines.
+    """
+    left = limit
+    for rows in pages:
+        if left is not None:
+            rows = rows[:left]
+            left -= len(rows)
+        if rows:
+            yield "".join(json.dumps({f: row.get(f) for f in fields}) + "\n" for row in rows).encode()
+        if left == 0:
+            return
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Compress a chunk stream into one gzip member without buffering it.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def stream_headers(gzip: bool) -> Dict[str, str]:
+    headers = {"Vary": "Accept-Encoding"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return headers
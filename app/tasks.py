@@ -1,39 +1,217 @@
+import asyncio
+import base64
 import logging
-from typing import Any, Dict
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
+import httpx
+import numpy as np
 
+from . import metrics
 from .config import settings
+from .http_clients import notifier
 from .models import ObjectRequest
+from .outbox import Message, Outbox
 
 logger = logging.getLogger(__name__)
 
+_outbox: Optional[Outbox] = None
 
-def notify_new_object(obj: ObjectRequest) -> None:
+
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox(settings.outbox_path, lease_seconds=settings.outbox_lease_seconds)
+    return _outbox
+
+
+def _notification(obj: ObjectRequest) -> Tuple[Dict[str, Any], Optional[bytes]]:
     """
-    POST(notification) to settings.NEW_OBJ_URL
-      {
-        "id": ...,
-        "type": ...,
-        "timestamp": ...,
-        "points3d": [...]
-      }
+    Notification payload without the points, plus the points as a
+    little-endian float32 N x 3 buffer (stored as a blob in the outbox).
     """
     payload: Dict[str, Any] = {
         "id": obj.id,
         "type": obj.type,
         "timestamp": obj.timestamp.isoformat(),
-        "points3d": obj.pointcloud,
     }
-    try:
-        resp = requests.post(
-            settings.NEW_OBJ_URL,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=5
+    blob = None
+    if settings.notify_include_points:
+        blob = np.asarray(obj.pointcloud, dtype="<f4").reshape(-1, 3).tobytes()
+    return payload, blob
+
+
+async def notify_new_object(obj: ObjectRequest) -> None:
+    """
+    Queue a notification for settings.new_object_url in the durable outbox.
+    The POST itself is made later by NotificationWorker:
+      {
+        "id": ...,
+        "type": ...,
+        "timestamp": ...,
+        "points3d": [...]          (or "points3d_b64", see NOTIFY_POINTS_FORMAT)
+      }
+    """
+    payload, blob = _notification(obj)
+    await asyncio.to_thread(get_outbox().put, payload, blob)
+    notification_worker.wake()
+
+
+class NotificationWorker:
+    """
+    Drains the outbox in the background: claims up to notify_batch_size
+    notifications, sends them in one POST and retries failed batches with
+    exponential backoff. Messages are only deleted after a 2xx response.
+    A batch rejected with a permanent 4xx is split until the rejected
+    messages are found; those, and messages that failed
+    notify_max_attempts times, go to the dead-letter table.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.sent = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self.last_error: Optional[str] = None
+        self.last_success_at: Optional[float] = None
+
+    def start(self) -> None:
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._run(), name=f"outbox-worker-{n}")
+            for n in range(settings.outbox_workers)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Let in-flight batches finish; unsent messages stay in the outbox.
+        """
+        self._stopping = True
+        self.wake()
+        if not self._tasks:
+            return
+        _, still_running = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        self._tasks = []
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        outbox = get_outbox()
+        while not self._stopping:
+            try:
+                messages = await asyncio.to_thread(outbox.claim, settings.notify_batch_size)
+            except Exception as e:
+                logger.error(f"Failed to read notification outbox: {e}")
+                messages = []
+            if not messages:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.outbox_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._deliver(outbox, messages)
+
+    async def _deliver(self, outbox: Outbox, messages: List[Message]) -> None:
+        ids = [m[0] for m in messages]
+        start = time.perf_counter()
+        try:
+            with metrics.span("notify", objects=len(ids)):
+                resp = await notifier.post(settings.new_object_url, json=_request_body(messages))
+                resp.raise_for_status()
+        except httpx.HTTPError as e:
+            metrics.stage_seconds.observe(time.perf_counter() - start, stage="notify", outcome="error")
+            self.failed_batches += 1
+            self.last_error = str(e)
+            if _is_permanent(e):
+                if len(messages) > 1:
+                    # find the rejected messages, deliver the rest
+                    logger.warning(f"Notifier rejected a batch of {len(ids)} objects ({e}); splitting it")
+                    half = len(messages) // 2
+                    await self._deliver(outbox, messages[:half])
+                    await self._deliver(outbox, messages[half:])
+                    return
+                await self._bury(outbox, messages, str(e))
+                return
+            metrics.retries_total.inc(target="notifier")
+            attempts = min(m[3] for m in messages)
+            exhausted = [m for m in messages if m[3] + 1 >= settings.notify_max_attempts]
+            if exhausted:
+                await self._bury(outbox, exhausted, str(e))
+                messages = [m for m in messages if m[3] + 1 < settings.notify_max_attempts]
+                ids = [m[0] for m in messages]
+                if not messages:
+                    return
+            delay = min(settings.notify_retry_base * 2 ** attempts, settings.notify_retry_max)
+            delay *= 0.5 + random.random() / 2
+            logger.error(
+                f"Failed to notify {len(ids)} objects (attempt {attempts + 1}): {e}; "
+                f"retrying in {delay:.1f}s"
+            )
+            await asyncio.to_thread(outbox.retry, ids, delay, str(e))
+            return
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage="notify", outcome="ok")
+        await asyncio.to_thread(outbox.ack, ids)
+        self.sent += len(ids)
+        self.batches += 1
+        self.last_success_at = time.time()
+        logger.info(f"Successfully notified {len(ids)} objects: {[m[1]['id'] for m in messages]}")
+
+    async def _bury(self, outbox: Outbox, messages: List[Message], error: str) -> None:
+        self.dead_lettered += len(messages)
+        logger.error(
+            f"Giving up on notifications for {[m[1]['id'] for m in messages]} "
+            f"after {max(m[3] for m in messages) + 1} attempts: {error}"
         )
-        resp.raise_for_status()
-        logger.info(f"Successfully notified new object {obj.id}")
-    except requests.RequestException as e:
-        logger.error(f"Failed to notify new object {obj.id}: {e}")
-        raise
+        await asyncio.to_thread(outbox.bury, [m[0] for m in messages], error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **get_outbox().depth(),
+            "sent": self.sent,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dead_lettered": self.dead_lettered,
+            "last_error": self.last_error,
+            "last_success_at": self.last_success_at,
+        }
+
+
+def _is_permanent(error: httpx.HTTPError) -> bool:
+    """
+    True for answers that a retry of the same body will not change: 4xx
+    except 408 (timeout) and 429 (rate limited).
+    """
+    if not isinstance(error, httpx.HTTPStatusError):
+        return False
+    status = error.response.status_code
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+def _request_body(messages: List[Message]) -> Any:
+    """
+    Single-object payload when batching is off, otherwise {"objects": [...]}.
+    """
+    objects = []
+    for _, payload, blob, _ in messages:
+        if blob is not None:
+            if settings.notify_points_format == "float32_base64":
+                payload["points3d_b64"] = base64.b64encode(blob).decode("ascii")
+            else:
+                payload["points3d"] = np.frombuffer(blob, dtype="<f4").reshape(-1, 3).tolist()
+        objects.append(payload)
+    if settings.notify_batch_size == 1:
+        return objects[0]
+    return {"objects": objects}
+
+
+notification_worker = NotificationWorker()
@@ -0,0 +1,229 @@
+"""
+Catalog of the normalized object types stored in Milvus, with counts per
+type and city.
+
+    python -m app.type_catalog show
+    python -m app.type_catalog rebuild
+
+The catalog is kept in a local SQLite file (replicas on one host may share
+it) and updated whenever the write buffer writes rows to Milvus, so the
+filter endpoints get the type vocabulary without scanning the collection.
+`rebuild` re-reads all rows from Milvus, e.g. after the file was lost; it
+is safe to run while the service is writing.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# (object id, type, city)
+Entry = Tuple[str, str, str]
+
+
+class TypeCatalog:
+    """
+    One row per object id in `objects`; triggers keep `type_counts`
+    (type, city, count) in step. Reads are served from an in-memory
+    snapshot that is refreshed when the file changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS objects (
+                id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                city TEXT NOT NULL,
+                generation INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS type_counts (
+                type TEXT NOT NULL,
+                city TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (type, city)
+            );
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS objects_insert AFTER INSERT ON objects BEGIN
+                INSERT INTO type_counts (type, city, count) VALUES (NEW.type, NEW.city, 1)
+                    ON CONFLICT (type, city) DO UPDATE SET count = count + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS objects_update AFTER UPDATE OF type, city ON objects
+            WHEN OLD.type != NEW.type OR OLD.city != NEW.city BEGIN
+                UPDATE type_counts SET count = count - 1 WHERE type = OLD.type AND city = OLD.city;
+                DELETE FROM type_counts WHERE type = OLD.type AND city = OLD.city AND count <= 0;
+                INSERT INTO type_counts (type, city, count) VALUES (NEW.type, NEW.city, 1)
+                    ON CONFLICT (type, city) DO UPDATE SET count = count + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS objects_delete AFTER DELETE ON objects BEGIN
+                UPDATE type_counts SET count = count - 1 WHERE type = OLD.type AND city = OLD.city;
+                DELETE FROM type_counts WHERE type = OLD.type AND city = OLD.city AND count <= 0;
+            END;
+            """
+        )
+        self._snapshot: Optional[Dict[str, Dict[str, Any]]] = None
+        self._types: List[str] = []
+        self._version = ""
+        self._data_version = -1
+
+    def _generation(self) -> int:
+        row = self._conn.execute("SELECT value FROM catalog_meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def record(self, entries: Iterable[Entry]) -> None:
+        """
+        Objects written to the store; an id seen before moves to its new
+        type/city.
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                generation = self._generation()
+                self._conn.executemany(
+                    "INSERT INTO objects (id, type, city, generation) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET type = excluded.type, city = excluded.city, "
+                    "generation = excluded.generation",
+                    [(obj_id, obj_type, city, generation) for obj_id, obj_type, city in entries],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._snapshot = None
+
+    def rebuild(self, entries: Iterable[Entry], batch_size: int = 5000) -> int:
+        """
+        Re-read the catalog from `entries` (all rows of the store). Rows
+        recorded by live writes during the rebuild win over scanned ones;
+        ids that were not seen are removed at the end.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            generation = self._generation() + 1
+            self._conn.execute(
+                "INSERT INTO catalog_meta (key, value) VALUES ('generation', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (generation,),
+            )
+            self._conn.execute("COMMIT")
+
+        seen = 0
+        batch: List[Entry] = []
+
+        def write(rows: List[Entry]) -> None:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT INTO objects (id, type, city, generation) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET type = excluded.type, city = excluded.city, "
+                    "generation = excluded.generation WHERE objects.generation < excluded.generation",
+                    [(obj_id, obj_type, city, generation) for obj_id, obj_type, city in rows],
+                )
+                self._conn.execute("COMMIT")
+                self._snapshot = None
+
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                write(batch)
+                seen += len(batch)
+                batch = []
+        if batch:
+            write(batch)
+            seen += len(batch)
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM objects WHERE generation < ?", (generation,)).rowcount
+            self._snapshot = None
+        logger.info(f"Type catalog rebuilt from {seen} objects ({removed} stale entries removed)")
+        return seen
+
+    def _refresh(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            # data_version only changes for commits of other connections
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._snapshot is not None and data_version == self._data_version:
+                return self._snapshot
+            snapshot: Dict[str, Dict[str, Any]] = {}
+            for obj_type, city, count in self._conn.execute(
+                "SELECT type, city, count FROM type_counts ORDER BY type, city"
+            ):
+                entry = snapshot.setdefault(obj_type, {"count": 0, "cities": {}})
+                entry["count"] += count
+                entry["cities"][city] = count
+            self._snapshot = snapshot
+            self._types = sorted(snapshot, key=lambda t: (-snapshot[t]["count"], t))
+            self._data_version = data_version
+            self._version = hashlib.sha1("\n".join(sorted(snapshot)).encode()).hexdigest()[:12]
+            return snapshot
+
+    def types(self) -> List[str]:
+        """
+        Known types, most frequent first.
+        """
+        self._refresh()
+        return self._types
+
+    def counts(self) -> Dict[str, Dict[str, Any]]:
+        """
+        {type: {"count": n, "cities": {city: n}}}
+        """
+        return self._refresh()
+
+    def version(self) -> str:
+        """
+        Changes whenever a type appears or disappears.
+        """
+        self._refresh()
+        return self._version
+
+    def is_empty(self) -> bool:
+        return not self._refresh()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+type_catalog = TypeCatalog(settings.type_catalog_path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["show", "rebuild"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "rebuild":
+        from .milvus_client import rebuild_type_catalog
+
+        rebuild_type_catalog()
+    print(f"vocabulary version: {type_catalog.version()}")
+    for obj_type, entry in sorted(type_catalog.counts().items(), key=lambda item: -item[1]["count"]):
+        cities = ", ".join(f"{city}: {count}" for city, count in entry["cities"].items())
+        print(f"{obj_type:30} {entry['count']:8}  ({cities})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+Layered normalization of raw object type labels:
+
+1. admin overrides (persisted, never expire),
+2. a built-in dictionary of canonical types and their English and Russian
+   aliases, extended by TYPE_DICTIONARY_PATH,
+3. earlier LLM answers (persisted, expire after TYPE_NORMALIZER_TTL),
+4. the LLM.
+
+Labels are compared case-folded with whitespace and punctuation removed.
+
+    python -m app.type_normalizer show
+    python -m app.type_normalizer lookup <raw>
+    python -m app.type_normalizer set <raw> <canonical>
+    python -m app.type_normalizer unset <raw>
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .config import settings
+from .llm_governor import LLMSaturated
+from .llm_utils import normalize_type
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_TYPES: Dict[str, List[str]] = {
+    "Car": ["car", "auto", "automobile", "sedan", "hatchback", "suv", "coupe", "passenger car",
+            "машина", "автомобиль", "легковой автомобиль", "легковушка", "авто", "седан"],
+    "Truck": ["truck", "lorry", "грузовик", "грузовой автомобиль", "фура"],
+    "Van": ["van", "minivan", "minibus", "фургон", "микроавтобус", "минивэн"],
+    "Bus": ["bus", "coach", "автобус"],
+    "Tram": ["tram", "streetcar", "трамвай"],
+    "Trolleybus": ["trolleybus", "trolley bus", "троллейбус"],
+    "Motorcycle": ["motorcycle", "motorbike", "мотоцикл"],
+    "Bicycle": ["bicycle", "bike", "cycle", "велосипед"],
+    "Scooter": ["scooter", "kick scooter", "e-scooter", "самокат", "электросамокат"],
+    "Person": ["person", "pedestrian", "human", "people", "пешеход", "человек", "люди"],
+    "Tree": ["tree", "дерево"],
+    "Bush": ["bush", "shrub", "куст", "кустарник"],
+    "Bench": ["bench", "скамейка", "скамья", "лавка", "лавочка"],
+    "Streetlight": ["streetlight", "street light", "street lamp", "lamp post", "lamppost",
+                    "фонарь", "фонарный столб", "уличный фонарь"],
+    "TrafficLight": ["traffic light", "traffic signal", "светофор"],
+    "TrafficSign": ["traffic sign", "road sign", "sign", "дорожный знак", "знак"],
+    "Pole": ["pole", "post", "столб", "опора"],
+    "Building": ["building", "house", "здание", "дом", "строение"],
+    "Fence": ["fence", "railing", "barrier", "забор", "ограждение", "ограда"],
+    "Hydrant": ["hydrant", "fire hydrant", "гидрант", "пожарный гидрант"],
+    "Bin": ["bin", "trash can", "garbage can", "litter bin", "урна", "мусорный бак", "мусорка"],
+    "BusStop": ["bus stop", "bus shelter", "остановка", "автобусная остановка"],
+    "Bollard": ["bollard", "столбик", "болларды"],
+}
+
+
+def label_key(raw: str) -> str:
+    """
+    Lookup key of a label: case-folded, 'ё' as 'е', punctuation dropped and
+    whitespace collapsed ("Car ", "CAR", "car." -> "car").
+    """
+    text = raw.casefold().replace("ё", "е")
+    text = re.sub(r"[\W_]+", " ", text)
+    return text.strip()
+
+
+def build_dictionary(extra_path: str = "") -> Dict[str, str]:
+    """
+    label key -> canonical type, from CANONICAL_TYPES and an optional JSON
+    file of {"alias": "Canonical"} pairs.
+    """
+    dictionary: Dict[str, str] = {}
+    for canonical, aliases in CANONICAL_TYPES.items():
+        dictionary[label_key(canonical)] = canonical
+        for alias in aliases:
+            dictionary[label_key(alias)] = canonical
+    if extra_path:
+        with open(extra_path, encoding="utf-8") as f:
+            for alias, canonical in json.load(f).items():
+                dictionary[label_key(alias)] = canonical
+    return dictionary
+
+
+class TypeNormalizer:
+    """
+    Overrides and LLM answers live in a local SQLite file (replicas on one
+    host may share it), with an in-memory copy of recent lookups that is
+    dropped whenever another process wrote to the file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dictionary: Dict[str, str],
+        ttl: float = 0.0,
+        memory_entries: int = 10000,
+    ):
+        self.path = path
+        self.dictionary = dictionary
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS type_normalizations (
+                key TEXT PRIMARY KEY,
+                raw TEXT NOT NULL,
+                canonical TEXT NOT NULL,
+                source TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        # key -> (canonical, source) or None for "not stored"
+        self._memory: "OrderedDict[str, Optional[Tuple[str, str]]]" = OrderedDict()
+        self._data_version = -1
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {"override_hits": 0, "dictionary_hits": 0, "cache_hits": 0, "llm_calls": 0, "coalesced": 0, "fallbacks": 0}
+
+    def _stored(self, key: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._memory.clear()
+                self._data_version = data_version
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            row = self._conn.execute(
+                "SELECT canonical, source, created_at FROM type_normalizations WHERE key = ?", (key,)
+            ).fetchone()
+            found = None
+            if row is not None and (row[1] == "override" or not self.ttl or row[2] >= time.time() - self.ttl):
+                found = (row[0], row[1])
+            self._memory[key] = found
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+            return found
+
+    def _store(self, raw: str, canonical: str, source: str) -> None:
+        key = label_key(raw)
+        with self._lock:
+            if source == "llm":
+                # never replace an override that was set meanwhile
+                self._conn.execute(
+                    "INSERT INTO type_normalizations (key, raw, canonical, source, created_at) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET raw = excluded.raw, "
+                    "canonical = excluded.canonical, created_at = excluded.created_at "
+                    "WHERE type_normalizations.source = 'llm'",
+                    (key, raw, canonical, source, time.time()),
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO type_normalizations (key, raw, canonical, source, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, raw, canonical, source, time.time()),
+                )
+            self._memory.pop(key, None)
+
+    def lookup(self, raw: str) -> Optional[Tuple[str, str]]:
+        """
+        (canonical, layer) without asking the LLM, or None.
+        """
+        key = label_key(raw)
+        stored = self._stored(key)
+        if stored is not None and stored[1] == "override":
+            return stored[0], "override"
+        if key in self.dictionary:
+            return self.dictionary[key], "dictionary"
+        if stored is not None:
+            return stored[0], "cache"
+        return None
+
+    async def normalize(self, raw: str, llm: Callable[[str], Awaitable[str]] = normalize_type) -> str:
+        key = label_key(raw)
+        found = await asyncio.to_thread(self.lookup, raw)
+        if found is not None:
+            self._stats[f"{found[1]}_hits"] += 1
+            return found[0]
+
+        while key in self._inflight:
+            leader = self._inflight[key]
+            self._stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                if not leader.cancelled():
+                    raise
+                # the leading request went away; ask ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self._stats["llm_calls"] += 1
+            canonical = self._canonical_spelling(await llm(raw))
+            await asyncio.to_thread(self._store, raw, canonical, "llm")
+            future.set_result(canonical)
+            return canonical
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except LLMSaturated as e:
+            if settings.llm_saturation_policy != "degrade":
+                future.set_exception(e)
+                future.exception()
+                raise
+            # keep the label as sent, without remembering it
+            self._stats["fallbacks"] += 1
+            canonical = self._canonical_spelling(raw)
+            future.set_result(canonical)
+            return canonical
+        except Exception as e:
+            future.set_exception(e)
+            # mark retrieved so a failure nobody waited for is not logged
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _canonical_spelling(self, answer: str) -> str:
+        # "car." or "CAR" from the LLM should land on the dictionary's "Car"
+        answer = answer.strip().strip(".\"'`")
+        return self.dictionary.get(label_key(answer), answer)
+
+    def set_override(self, raw: str, canonical: str) -> None:
+        self._store(raw, canonical, "override")
+
+    def remove(self, raw: str) -> bool:
+        key = label_key(raw)
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM type_normalizations WHERE key = ?", (key,)).rowcount
+            self._memory.pop(key, None)
+        return bool(removed)
+
+    def overrides(self) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT raw, canonical FROM type_normalizations WHERE source = 'override' ORDER BY key"
+            ).fetchall()
+        return dict(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT source, COUNT(*) FROM type_normalizations GROUP BY source"
+            ).fetchall())
+            memory_entries = len(self._memory)
+        stats: Dict[str, Any] = dict(self._stats)
+        stats.update(
+            dictionary_entries=len(self.dictionary),
+            override_entries=counts.get("override", 0),
+            cache_entries=counts.get("llm", 0),
+            memory_entries=memory_entries,
+        )
+        lookups = sum(stats[f"{layer}_hits"] for layer in ("override", "dictionary", "cache")) + stats["llm_calls"]
+        stats["hit_rate"] = (lookups - stats["llm_calls"]) / lookups if lookups else 0.0
+        return stats
+
+
+type_normalizer = TypeNormalizer(
+    settings.type_normalizer_path,
+    build_dictionary(settings.type_dictionary_path),
+    ttl=settings.type_normalizer_ttl,
+    memory_entries=settings.type_normalizer_memory_entries,
+)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["show", "lookup", "set", "unset"])
+    parser.add_argument("raw", nargs="?")
+    parser.add_argument("canonical", nargs="?")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        for raw, canonical in type_normalizer.overrides().items():
+            print(f"{raw!r} -> {canonical!r}")
+        print(json.dumps(type_normalizer.stats(), indent=2))
+        return 0
+    if not args.raw:
+        parser.error(f"{args.command} needs a raw label")
+    if args.command == "lookup":
+        found = type_normalizer.lookup(args.raw)
+        print(f"{found[0]!r} (from {found[1]})" if found else "not known; the LLM would be asked")
+    elif args.command == "set":
+        if not args.canonical:
+            parser.error("set needs a canonical type")
+        type_normalizer.set_override(args.raw, args.canonical)
+        print(f"{args.raw!r} -> {args.canonical!r}")
+    else:
+        print("removed" if type_normalizer.remove(args.raw) else "no stored entry")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
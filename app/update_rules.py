@@ -0,0 +1,225 @@
+"""
+Update decisions for dedup hits. Clear-cut cases are decided by rules on
+a few features of the existing and incoming object; the rest goes to the
+LLM, whose answers are cached per input. Every decision is counted by the
+path that made it and kept in a short log to tune the thresholds.
+"""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from .config import settings
+from .llm_governor import LLMSaturated
+from .llm_utils import decide_update
+from .models import ObjectRequest, PointCloudStats
+from .preprocess import density_ratio
+
+logger = logging.getLogger(__name__)
+
+Features = Dict[str, Any]
+
+
+def _as_utc(value: Any) -> Optional[datetime]:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    # naive timestamps are taken as UTC, like the stored epoch seconds
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def bbox_iou(a: Sequence[float], b: Sequence[float]) -> Optional[float]:
+    """
+    IoU of two axis-aligned boxes [x, y, z, width, height, depth] (center
+    and size).
+    """
+    if len(a) < 6 or len(b) < 6:
+        return None
+    intersection = 1.0
+    for axis in range(3):
+        half_a, half_b = abs(a[axis + 3]) / 2, abs(b[axis + 3]) / 2
+        overlap = min(a[axis] + half_a, b[axis] + half_b) - max(a[axis] - half_a, b[axis] - half_b)
+        if overlap <= 0:
+            return 0.0
+        intersection *= overlap
+    volume_a = abs(a[3] * a[4] * a[5])
+    volume_b = abs(b[3] * b[4] * b[5])
+    union = volume_a + volume_b - intersection
+    return intersection / union if union > 0 else None
+
+
+def center_shift(a: Sequence[float], b: Sequence[float]) -> Optional[float]:
+    """
+    Distance between the box centers relative to the diagonal of `a`.
+    """
+    if len(a) < 6 or len(b) < 6:
+        return None
+    diagonal = math.sqrt(sum(v * v for v in a[3:6]))
+    if diagonal <= 0:
+        return None
+    return math.dist(a[:3], b[:3]) / diagonal
+
+
+def decision_features(
+    existing: Dict[str, Any],
+    incoming: ObjectRequest,
+    quality: Optional[PointCloudStats],
+    score: Optional[float]
+) -> Features:
+    existing_ts = _as_utc(existing.get("timestamp"))
+    incoming_ts = _as_utc(incoming.timestamp)
+    existing_bbox = existing.get("bbox") or []
+    return {
+        "newer_by": (incoming_ts - existing_ts).total_seconds() if existing_ts and incoming_ts else None,
+        "iou": bbox_iou(existing_bbox, incoming.bbox),
+        "center_shift": center_shift(existing_bbox, incoming.bbox),
+        "density_ratio": density_ratio(quality, existing.get("quality")) if quality else None,
+        "score": score,
+    }
+
+
+def rule_decision(features: Features) -> Optional[Tuple[str, str, str]]:
+    """
+    (decision, reason, rule) when the features are clear-cut, else None.
+    Density and geometry rules only apply when both boxes agree well
+    enough (DECISION_MIN_IOU) to be compared.
+    """
+    newer_by = features["newer_by"]
+    iou = features["iou"]
+    shift = features["center_shift"]
+    ratio = features["density_ratio"]
+    score = features["score"]
+
+    if newer_by is not None and newer_by <= 0:
+        return "keep", "incoming capture is not newer than the stored one", "not_newer"
+    if newer_by is None or iou is None or iou < settings.decision_min_iou:
+        return None
+    if ratio is not None and ratio <= settings.decision_sparse_ratio:
+        return "keep", f"incoming cloud is much sparser ({ratio:.2f}x)", "sparser"
+    if ratio is not None and ratio >= settings.decision_dense_ratio:
+        return "update", f"incoming cloud is much denser ({ratio:.2f}x)", "denser"
+    if (
+        iou >= settings.decision_same_iou
+        and shift is not None and shift <= settings.decision_same_shift
+        and score is not None and score <= settings.decision_same_distance
+    ):
+        return "keep", f"same geometry (IoU {iou:.2f}) and near-identical embedding", "unchanged"
+    return None
+
+
+class DecisionCache:
+    """
+    LLM decisions in memory, keyed by a hash of the inputs of the prompt,
+    so replays and retries of an object do not ask again.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[str, str]]]" = OrderedDict()
+
+    @staticmethod
+    def key(existing: Dict[str, Any], incoming: ObjectRequest, metadata: Dict, quality: Optional[PointCloudStats]) -> str:
+        payload = {
+            "existing": {k: existing.get(k) for k in ("id", "type", "timestamp", "bbox", "quality")},
+            "incoming": [incoming.id, incoming.type, incoming.timestamp.isoformat(), incoming.bbox],
+            "quality": quality.dict() if quality else None,
+            "metadata": metadata,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and entry[0] < time.monotonic() - self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, decision: Tuple[str, str]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), decision)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+decision_cache = DecisionCache(settings.decision_cache_size, settings.decision_cache_ttl)
+_paths: Counter = Counter()
+_recent: deque = deque(maxlen=settings.decision_log_size)
+
+
+def _record(object_id: str, decision: str, path: str, features: Features) -> None:
+    _paths[path] += 1
+    _recent.append({
+        "id": object_id,
+        "decision": decision,
+        "path": path,
+        "at": time.time(),
+        **{k: round(v, 4) if isinstance(v, float) else v for k, v in features.items()},
+    })
+
+
+async def decide(
+    existing: Dict[str, Any],
+    incoming: ObjectRequest,
+    score: Optional[float],
+    quality: Optional[PointCloudStats] = None
+) -> Tuple[str, str, str]:
+    """
+    (decision, reason, path) for an incoming object matching `existing`;
+    path is "rule:<name>", "cache", "llm" or "fallback" (LLM saturated
+    under the "degrade" policy).
+    """
+    features = decision_features(existing, incoming, quality, score)
+    if settings.decision_rules_enabled:
+        ruled = rule_decision(features)
+        if ruled is not None:
+            decision, reason, rule = ruled
+            _record(incoming.id, decision, f"rule:{rule}", features)
+            return decision, reason, f"rule:{rule}"
+
+    metadata = {"score": score}
+    key = DecisionCache.key(existing, incoming, metadata, quality)
+    cached = decision_cache.get(key)
+    if cached is not None:
+        _record(incoming.id, cached[0], "cache", features)
+        return cached[0], cached[1], "cache"
+
+    try:
+        decision, reason = await decide_update(existing, incoming, metadata, quality)
+    except LLMSaturated:
+        if settings.llm_saturation_policy != "degrade":
+            raise
+        _record(incoming.id, "keep", "fallback", features)
+        return "keep", "LLM busy; kept the stored object", "fallback"
+    decision_cache.put(key, (decision, reason))
+    _record(incoming.id, decision, "llm", features)
+    return decision, reason, "llm"
+
+
+def stats() -> Dict[str, Any]:
+    total = sum(_paths.values())
+    return {
+        "decisions": total,
+        "paths": dict(_paths),
+        "llm_share": _paths["llm"] / total if total else 0.0,
+        "cache_entries": len(decision_cache),
+        "recent": list(_recent),
+    }
@@ -0,0 +1,262 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# (id, vector, metadata, upsert)
+Row = Tuple[str, List[float], Dict[str, Any], bool]
+
+
+class WriteBufferFull(RuntimeError):
+    """
+    The buffer stayed full for longer than `put_timeout` (the store is not
+    keeping up, or down).
+    """
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for vector rows.
+
+    Rows are collected in memory and handed to `writer` in one call when
+    `max_rows` are pending or `flush_interval` seconds have passed.
+    Writing the same id twice before a flush keeps only the latest row.
+    `search()` scans the rows that are not yet visible in the store, so
+    dedup lookups can read their own writes. `sealer` (e.g. a Milvus
+    flush) is only called on `stop()`.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[List[Row]], None],
+        sealer: Optional[Callable[[], None]] = None,
+        max_rows: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 5000,
+        put_timeout: float = 5.0,
+    ):
+        self._writer = writer
+        self._sealer = sealer
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, max_rows)
+        self.put_timeout = put_timeout
+
+        self._pending: "OrderedDict[str, Row]" = OrderedDict()
+        self._inflight: Dict[str, Row] = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._unsealed = 0
+
+        self._started_at = time.monotonic()
+        self._last_flush_at = time.monotonic()
+        self._stats: Dict[str, float] = {
+            "rows_added": 0,
+            "rows_coalesced": 0,
+            "rows_written": 0,
+            "write_batches": 0,
+            "write_errors": 0,
+            "rejected_puts": 0,
+            "seals": 0,
+            "last_batch_rows": 0,
+            "last_batch_seconds": 0.0,
+        }
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="write-buffer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, drain: bool = True) -> None:
+        """
+        Stop the background flusher. With drain=True all pending rows are
+        written and the store is sealed before returning.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            self.flush()
+            if self._sealer is not None and self._unsealed:
+                self._sealer()
+                self._unsealed = 0
+                self._stats["seals"] += 1
+            logger.info(f"Write buffer drained: {self.stats()}")
+
+    def add(
+        self,
+        id: str,
+        vector: List[float],
+        metadata: Dict[str, Any],
+        upsert: bool = False
+    ) -> None:
+        self.add_many([(id, vector, metadata, upsert)])
+
+    def add_many(self, rows: Sequence[Row]) -> None:
+        if not rows:
+            return
+        with self._cond:
+            # backpressure: wait while the store is not keeping up, but not
+            # forever, so callers' worker threads are not all stuck here
+            deadline = time.monotonic() + self.put_timeout
+            # rows being written count too: a failed write puts them back
+            while len(self._pending) + len(self._inflight) >= self.max_pending and self._thread is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["rejected_puts"] += 1
+                    raise WriteBufferFull(
+                        f"Write buffer still full ({len(self._pending) + len(self._inflight)} rows) "
+                        f"after {self.put_timeout:.1f}s"
+                    )
+                self._cond.notify_all()
+                self._cond.wait(timeout=min(self.flush_interval, remaining))
+            for row in rows:
+                row_id, _, _, upsert = row
+                previous = self._pending.pop(row_id, None)
+                if previous is not None:
+                    self._stats["rows_coalesced"] += 1
+                    # the earlier write may not exist in the store yet,
+                    # but an upsert must still replace a stored row
+                    upsert = upsert or previous[3]
+                elif row_id in self._inflight:
+                    upsert = True
+                self._pending[row_id] = (row[0], row[1], row[2], upsert)
+            self._stats["rows_added"] += len(rows)
+            if len(self._pending) >= self.max_rows:
+                self._cond.notify_all()
+        if self._thread is None:
+            # no background flusher (e.g. scripts): write through
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all pending rows now. Returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return 0
+                batch = list(self._pending.values())
+                self._inflight = dict(self._pending)
+                self._pending.clear()
+                self._cond.notify_all()
+
+            start = time.monotonic()
+            try:
+                self._writer(batch)
+            except Exception as e:
+                logger.error(f"Write buffer failed to write {len(batch)} rows: {e}")
+                with self._cond:
+                    self._stats["write_errors"] += 1
+                    # put rows back, without overwriting newer writes
+                    restored: "OrderedDict[str, Row]" = OrderedDict(
+                        (row[0], row) for row in batch if row[0] not in self._pending
+                    )
+                    restored.update(self._pending)
+                    self._pending = restored
+                    self._inflight = {}
+                raise
+            elapsed = time.monotonic() - start
+
+            with self._cond:
+                self._inflight = {}
+                self._cond.notify_all()
+                self._last_flush_at = time.monotonic()
+                self._unsealed += len(batch)
+                self._stats["rows_written"] += len(batch)
+                self._stats["write_batches"] += 1
+                self._stats["last_batch_rows"] = len(batch)
+                self._stats["last_batch_seconds"] = elapsed
+            return len(batch)
+
+    def search(
+        self,
+        vectors: Sequence[List[float]],
+        top_k: int = 1,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[List[Dict[str, Any]]], set]:
+        """
+        Exact L2 (squared, like Milvus) search over rows not yet written,
+        restricted to rows whose metadata equals `filters`.
+        Returns hits per query vector and the set of ids that are buffered,
+        so callers can drop stale store hits for those ids.
+        """
+        with self._lock:
+            # a pending row supersedes the in-flight one with the same id
+            rows = list({**self._inflight, **self._pending}.values())
+        buffered_ids = {row[0] for row in rows}
+        if filters:
+            rows = [row for row in rows if all(row[2].get(k) == v for k, v in filters.items())]
+        if not rows or not vectors:
+            return [[] for _ in vectors], buffered_ids
+
+        matrix = np.asarray([row[1] for row in rows], dtype=np.float32)
+        queries = np.asarray(vectors, dtype=np.float32)
+        distances = (
+            (queries ** 2).sum(axis=1)[:, None]
+            - 2.0 * queries @ matrix.T
+            + (matrix ** 2).sum(axis=1)[None, :]
+        )
+        k = min(top_k, len(rows))
+        hits: List[List[Dict[str, Any]]] = []
+        for row_distances in distances:
+            best = np.argsort(row_distances)[:k]
+            hits.append([
+                {
+                    "id": rows[j][0],
+                    "distance": float(max(row_distances[j], 0.0)),
+                    "metadata": rows[j][2],
+                }
+                for j in best
+            ])
+        return hits, buffered_ids
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            uptime = time.monotonic() - self._started_at
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["pending"] = len(self._pending)
+            stats["inflight"] = len(self._inflight)
+            stats["seconds_since_flush"] = time.monotonic() - self._last_flush_at
+        stats["rows_per_second"] = stats["rows_written"] / uptime if uptime > 0 else 0.0
+        stats["avg_batch_rows"] = (
+            stats["rows_written"] / stats["write_batches"] if stats["write_batches"] else 0.0
+        )
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                deadline = self._last_flush_at + self.flush_interval
+                while not self._stopping and len(self._pending) < self.max_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+                if self._stopping:
+                    return
+                if not self._pending:
+                    self._last_flush_at = time.monotonic()
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                # rows were put back; retry after the next interval
+                with self._cond:
+                    self._last_flush_at = time.monotonic()
@@ -0,0 +1,225 @@
+"""
+Recall / latency benchmark for ANN index settings.
+
+Loads synthetic clustered vectors into a scratch collection, computes exact
+top-1 neighbours with NumPy and compares every index configuration against
+them. Queries are a mix of near-duplicates of stored vectors (like a rescan
+of a known object) and fresh vectors, so the report also shows how often the
+ANN result changes the dedup decision at DEDUP_DISTANCE_THRESHOLD.
+
+    python -m benchmarks.ann_index --n 1000000 --queries 1000 \\
+        --config IVF_FLAT:nlist=1024,nprobe=16 \\
+        --config IVF_PQ:nlist=1024,m=32,nbits=8,nprobe=32 \\
+        --config HNSW:M=16,efConstruction=200,ef=64
+
+Config keys map to Settings: nlist, nprobe (IVF), m, nbits (PQ),
+M, efConstruction, ef (HNSW).
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+
+from app.config import Settings, settings
+from app.milvus_client import connect, index_params, search_params
+
+CONFIG_KEYS = {
+    "nlist": "milvus_ivf_nlist",
+    "nprobe": "milvus_ivf_nprobe",
+    "m": "milvus_pq_m",
+    "nbits": "milvus_pq_nbits",
+    "M": "milvus_hnsw_m",
+    "efConstruction": "milvus_hnsw_ef_construction",
+    "ef": "milvus_hnsw_ef",
+}
+
+
+def parse_config(spec: str, dim: int) -> Settings:
+    """
+    "HNSW:M=16,ef=64" -> Settings copy with those index fields.
+    """
+    index_type, _, rest = spec.partition(":")
+    update: Dict[str, Any] = {"milvus_index_type": index_type.upper(), "vector_dim": dim}
+    for item in filter(None, rest.split(",")):
+        key, _, value = item.partition("=")
+        if key not in CONFIG_KEYS:
+            raise SystemExit(f"unknown config key {key!r} in {spec!r}, expected one of {list(CONFIG_KEYS)}")
+        update[CONFIG_KEYS[key]] = int(value)
+    return settings.copy(update=update)
+
+
+class Dataset:
+    """
+    Deterministic clustered vectors generated chunk by chunk, so 1M+ rows
+    never have to be held in memory at once.
+    """
+
+    def __init__(self, n: int, dim: int, clusters: int, cluster_std: float, seed: int, chunk: int):
+        self.n, self.dim, self.seed, self.chunk = n, dim, seed, chunk
+        self.cluster_std = cluster_std
+        self.centers = np.random.default_rng(seed).standard_normal((clusters, dim), dtype=np.float32)
+
+    def chunks(self):
+        for start in range(0, self.n, self.chunk):
+            yield start, self.rows(start, min(start + self.chunk, self.n))
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+        rng = np.random.default_rng((self.seed, start))
+        labels = rng.integers(0, len(self.centers), stop - start)
+        noise = rng.standard_normal((stop - start, self.dim), dtype=np.float32) * self.cluster_std
+        return self.centers[labels] + noise
+
+
+def make_queries(data: Dataset, count: int, dup_ratio: float, dup_std: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    n_dup = int(count * dup_ratio)
+    base_ids = np.sort(rng.choice(data.n, n_dup, replace=False))
+    dups = []
+    for start, rows in data.chunks():
+        stop = start + len(rows)
+        picked = base_ids[(base_ids >= start) & (base_ids < stop)] - start
+        dups.append(rows[picked])
+    dups_arr = np.concatenate(dups) if dups else np.empty((0, data.dim), np.float32)
+    dups_arr = dups_arr + rng.standard_normal(dups_arr.shape, dtype=np.float32) * dup_std
+    # rows past data.n come from their own seeds, so they are not stored
+    fresh_rows = data.rows(data.n, data.n + count - n_dup)
+    return np.concatenate([dups_arr, fresh_rows]).astype(np.float32)
+
+
+def load(collection_name: str, data: Dataset, queries: np.ndarray) -> Tuple[Collection, np.ndarray, np.ndarray]:
+    """
+    Insert the dataset and compute exact (squared L2) top-1 for every query.
+    """
+    if utility.has_collection(collection_name):
+        utility.drop_collection(collection_name)
+    schema = CollectionSchema([
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=data.dim),
+    ])
+    collection = Collection(collection_name, schema=schema)
+
+    best_dist = np.full(len(queries), np.inf, dtype=np.float32)
+    best_id = np.full(len(queries), -1, dtype=np.int64)
+    q_norms = (queries ** 2).sum(axis=1)[:, None]
+    start_time = time.monotonic()
+    for start, rows in data.chunks():
+        dist = q_norms - 2.0 * queries @ rows.T + (rows ** 2).sum(axis=1)[None, :]
+        arg = dist.argmin(axis=1)
+        chunk_best = dist[np.arange(len(queries)), arg]
+        better = chunk_best < best_dist
+        best_dist[better] = chunk_best[better]
+        best_id[better] = arg[better] + start
+        collection.insert([list(range(start, start + len(rows))), rows])
+        done = start + len(rows)
+        if done % (data.chunk * 10) == 0 or done == data.n:
+            print(f"  loaded {done}/{data.n} ({time.monotonic() - start_time:.0f}s)", file=sys.stderr)
+    collection.flush()
+    return collection, best_id, np.maximum(best_dist, 0.0)
+
+
+def run_config(
+    collection: Collection,
+    cfg: Settings,
+    queries: np.ndarray,
+    exact_ids: np.ndarray,
+    exact_dist: np.ndarray,
+    threshold: float,
+) -> Dict[str, Any]:
+    collection.release()
+    if collection.has_index():
+        collection.drop_index()
+    build_start = time.monotonic()
+    collection.create_index(field_name="embedding", index_params=index_params(cfg))
+    utility.wait_for_index_building_complete(collection.name)
+    build_seconds = time.monotonic() - build_start
+    collection.load()
+
+    param = search_params(cfg)
+    for q in queries[:20]:
+        collection.search([q.tolist()], "embedding", param, limit=1)
+
+    latencies: List[float] = []
+    ann_ids = np.empty(len(queries), dtype=np.int64)
+    ann_dist = np.empty(len(queries), dtype=np.float32)
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        hits = collection.search([q.tolist()], "embedding", param, limit=1)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        ann_ids[i] = hits[0].id if len(hits) else -1
+        ann_dist[i] = hits[0].distance if len(hits) else np.inf
+
+    exact_dup = exact_dist < threshold
+    ann_dup = ann_dist < threshold
+    return {
+        "index": index_params(cfg),
+        "search": param,
+        "build_seconds": round(build_seconds, 1),
+        "recall@1": float((ann_ids == exact_ids).mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "dedup_agreement": float((exact_dup == ann_dup).mean()),
+        "missed_duplicates": int((exact_dup & ~ann_dup).sum()),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=1_000_000, help="stored vectors")
+    parser.add_argument("--dim", type=int, default=settings.vector_dim)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--dup-ratio", type=float, default=0.5, help="share of queries that are near-duplicates")
+    parser.add_argument("--dup-std", type=float, default=0.02, help="per-dimension noise of near-duplicates")
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--cluster-std", type=float, default=0.15)
+    parser.add_argument("--threshold", type=float, default=settings.dedup_distance_threshold)
+    parser.add_argument("--chunk", type=int, default=10_000, help="rows per insert")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--collection", default="bench_object_vectors")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch collection")
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument(
+        "--config", action="append",
+        help="index config, e.g. HNSW:M=16,efConstruction=200,ef=64 (repeatable)",
+    )
+    args = parser.parse_args()
+    configs = [parse_config(spec, args.dim) for spec in (args.config or [
+        "IVF_FLAT:nlist=1024,nprobe=16",
+        "IVF_PQ:nlist=1024,m=32,nbits=8,nprobe=32",
+        "HNSW:M=16,efConstruction=200,ef=64",
+    ])]
+
+    connect()
+    data = Dataset(args.n, args.dim, args.clusters, args.cluster_std, args.seed, args.chunk)
+    queries = make_queries(data, args.queries, args.dup_ratio, args.dup_std, args.seed)
+    print(f"loading {args.n} x {args.dim}d vectors into {args.collection}", file=sys.stderr)
+    collection, exact_ids, exact_dist = load(args.collection, data, queries)
+
+    results = []
+    try:
+        for cfg in configs:
+            print(f"benchmarking {index_params(cfg)}", file=sys.stderr)
+            results.append(run_config(collection, cfg, queries, exact_ids, exact_dist, args.threshold))
+    finally:
+        if not args.keep:
+            utility.drop_collection(args.collection)
+
+    print(f"\n{args.n} vectors, {args.queries} queries, dedup threshold {args.threshold}")
+    print(f"{'index':<48} {'build s':>8} {'recall@1':>9} {'p50 ms':>8} {'p99 ms':>8} {'dedup agr':>10} {'missed':>7}")
+    for r in results:
+        label = f"{r['index']['index_type']} {r['index']['params']} {r['search']['params']}"
+        print(
+            f"{label:<48} {r['build_seconds']:>8} {r['recall@1']:>9.4f} {r['p50_ms']:>8.2f} "
+            f"{r['p99_ms']:>8.2f} {r['dedup_agreement']:>10.4f} {r['missed_duplicates']:>7}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
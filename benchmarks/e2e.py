@@ -0,0 +1,453 @@
+"""
+End-to-end ingest benchmark that runs offline.
+
+The service runs in this process against local stand-ins for every
+dependency: app.fakes.encoder, app.fakes.llm and app.fakes.notifier are
+mounted in-process in place of the HTTP pools, and Milvus is the
+in-memory app.fakes.milvus collection. SQLite state goes to a temporary
+directory. A load generator replays synthetic city scans (a vehicle
+driving through each city, objects sampled along its route) in which
+`--dup-ratio` of the objects are rescans of earlier ones: same shape
+resampled with noise, a few metres off and captured later.
+
+    python -m benchmarks.e2e --objects 2000 --dup-ratio 0.3 --points 2000 --concurrency 16
+    python -m benchmarks.e2e --mode batch --batch-size 50 --json run.json
+    python -m benchmarks.e2e --baseline run.json --max-regression 0.1
+
+The report shows objects/sec, client-side p50/p99 request latency,
+outcomes, and per-stage and Milvus call times from the service metrics
+(quantiles estimated from the histogram buckets). With --baseline the
+run fails (exit 1) when throughput drops or p50/p99 grow by more than
+--max-regression.
+
+Everything shares one event loop and one process, so CPU spent in the
+fakes and the load generator counts against the service; compare runs
+on the same machine only.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+STAGES = ("normalize", "preprocess", "encode", "search", "decide", "insert", "flush", "notify")
+MILVUS_OPS = ("search", "query", "insert", "delete")
+
+# raw type label -> (shape, size range in metres: (width, depth, height) low / high)
+OBJECT_KINDS: Dict[str, Tuple[str, Tuple[float, float, float], Tuple[float, float, float]]] = {
+    "street lamp": ("cylinder", (0.1, 0.1, 3.5), (0.25, 0.25, 5.0)),
+    "Lamp-Post": ("cylinder", (0.1, 0.1, 3.5), (0.25, 0.25, 5.0)),
+    "oak tree": ("ellipsoid", (1.5, 1.5, 2.5), (3.0, 3.0, 4.5)),
+    "tree": ("ellipsoid", (1.5, 1.5, 2.5), (3.0, 3.0, 4.5)),
+    "park bench": ("box", (1.5, 0.5, 0.7), (2.2, 0.8, 1.0)),
+    "parked car": ("box", (3.8, 1.6, 1.3), (4.8, 2.0, 1.7)),
+    "waste bin": ("cylinder", (0.4, 0.4, 0.8), (0.7, 0.7, 1.2)),
+    "traffic sign": ("cylinder", (0.05, 0.05, 2.0), (0.1, 0.1, 3.0)),
+}
+SHAPES = ("box", "cylinder", "ellipsoid")
+CITIES = ("Berlin", "Lisbon", "Osaka", "Austin", "Nairobi", "Lyon", "Perth", "Quito")
+METRES_PER_DEGREE = 111_320.0
+
+
+# (shape, size, offset of its base centre) of each part of an object
+Parts = List[Tuple[str, np.ndarray, np.ndarray]]
+
+
+def sample_shape(shape: str, size: np.ndarray, n: int, rng: np.random.Generator, noise: float) -> np.ndarray:
+    """
+    `n` points on the surface of a box, vertical cylinder or ellipsoid of
+    `size` (width, depth, height), standing on z = 0, plus Gaussian noise.
+    """
+    half = size / 2
+    if shape == "box":
+        points = rng.uniform(-1, 1, (n, 3))
+        face = rng.integers(0, 3, n)
+        points[np.arange(n), face] = np.sign(rng.uniform(-1, 1, n))
+        points *= half
+    elif shape == "cylinder":
+        angle = rng.uniform(0, 2 * np.pi, n)
+        points = np.c_[np.cos(angle) * half[0], np.sin(angle) * half[1], rng.uniform(-half[2], half[2], n)]
+    else:
+        direction = rng.standard_normal((n, 3))
+        points = direction / np.linalg.norm(direction, axis=1, keepdims=True) * half
+    points[:, 2] += half[2]
+    return points + rng.normal(0, noise, points.shape)
+
+
+class CityScans:
+    """
+    Synthetic scan stream: per city a vehicle random-walks from the centre
+    and records objects within `spread` metres of its route. A share of the
+    objects are rescans of objects recorded earlier in the same city.
+    """
+
+    def __init__(self, cities: int, dup_ratio: float, points: int, noise: float, seed: int):
+        self.rng = np.random.default_rng(seed)
+        self.cities = CITIES[:cities]
+        self.dup_ratio = dup_ratio
+        self.points = points
+        self.noise = noise
+        self.spread = 15.0
+        self.start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.centres = {city: (self.rng.uniform(-50, 50), self.rng.uniform(-150, 150)) for city in self.cities}
+
+    def _parts(self, kind: str) -> Parts:
+        """
+        The main shape of `kind` plus up to two random attachments (arms,
+        plates, bushes), so objects of one kind differ from each other.
+        """
+        shape, low, high = OBJECT_KINDS[kind]
+        parts = [(shape, self.rng.uniform(low, high), np.zeros(3))]
+        for _ in range(self.rng.integers(0, 3)):
+            offset = np.r_[self.rng.uniform(-1.0, 1.0, 2), self.rng.uniform(0.0, 2.0)]
+            parts.append((SHAPES[self.rng.integers(len(SHAPES))], self.rng.uniform(0.1, 1.0, 3), offset))
+        return parts
+
+    def _cloud(self, parts: Parts) -> Tuple[List[List[float]], List[float]]:
+        # points per part in proportion to its rough surface
+        areas = np.array([size[0] * size[1] + (size[0] + size[1]) * size[2] for _, size, _ in parts])
+        counts = self.rng.multinomial(self.points, areas / areas.sum())
+        points = np.vstack([
+            sample_shape(shape, size, n, self.rng, self.noise) + offset
+            for (shape, size, offset), n in zip(parts, counts)
+        ])
+        centre = (points.max(axis=0) + points.min(axis=0)) / 2
+        extent = points.max(axis=0) - points.min(axis=0)
+        return np.round(points, 3).tolist(), [*np.round(centre, 3).tolist(), *np.round(extent, 3).tolist()]
+
+    def generate(self, total: int) -> List[Tuple[Dict[str, Any], Optional[int]]]:
+        """
+        (request body, index of the original for a rescan or None), in
+        scan order.
+        """
+        kinds = list(OBJECT_KINDS)
+        per_city = math.ceil(total / len(self.cities))
+        stream: List[Tuple[Dict[str, Any], Optional[int]]] = []
+        # originals: index in stream -> (kind, parts, lat, lon)
+        originals: Dict[int, Tuple[str, Parts, float, float]] = {}
+        for city in self.cities:
+            lat, lon = self.centres[city]
+            seen: List[int] = []
+            for _ in range(min(per_city, total - len(stream))):
+                index = len(stream)
+                # ~10 m per object along the route
+                heading = self.rng.uniform(0, 2 * np.pi)
+                lat += 10 * np.cos(heading) / METRES_PER_DEGREE
+                lon += 10 * np.sin(heading) / (METRES_PER_DEGREE * np.cos(np.radians(lat)))
+                timestamp = self.start + timedelta(seconds=index)
+                original = None
+                if seen and self.rng.random() < self.dup_ratio:
+                    original = seen[self.rng.integers(len(seen))]
+                    kind, parts, obj_lat, obj_lon = originals[original]
+                    # a few metres of GNSS error, weeks later
+                    obj_lat += self.rng.normal(0, 2) / METRES_PER_DEGREE
+                    obj_lon += self.rng.normal(0, 2) / METRES_PER_DEGREE
+                    timestamp += timedelta(days=int(self.rng.integers(1, 60)))
+                else:
+                    kind = kinds[self.rng.integers(len(kinds))]
+                    parts = self._parts(kind)
+                    obj_lat = lat + self.rng.uniform(-self.spread, self.spread) / METRES_PER_DEGREE
+                    obj_lon = lon + self.rng.uniform(-self.spread, self.spread) / METRES_PER_DEGREE
+                    originals[index] = (kind, parts, obj_lat, obj_lon)
+                    seen.append(index)
+                pointcloud, bbox = self._cloud(parts)
+                stream.append(({
+                    "id": f"bench-{index:07d}",
+                    "city": city,
+                    "timestamp": timestamp.isoformat(),
+                    "lat": obj_lat,
+                    "lon": obj_lon,
+                    "type": kind,
+                    "pointcloud": pointcloud,
+                    "bbox": bbox,
+                }, original))
+        return stream
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else math.nan
+
+
+def configure(args: argparse.Namespace, state_dir: str) -> None:
+    """
+    Environment for the service and the fakes; read when they are imported.
+    """
+    for name, file in (
+        ("TYPE_CATALOG_PATH", "type_catalog.sqlite3"),
+        ("FILTER_CACHE_PATH", "filter_cache.sqlite3"),
+        ("TYPE_NORMALIZER_PATH", "type_normalizer.sqlite3"),
+        ("OUTBOX_PATH", "outbox.sqlite3"),
+        ("COALESCE_PATH", "coalesce.sqlite3"),
+    ):
+        os.environ.setdefault(name, os.path.join(state_dir, file))
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("FAKE_ENCODER_DIM", os.environ.get("VECTOR_DIM", "256"))
+    os.environ["FAKE_ENCODER_LATENCY"] = str(args.encoder_latency)
+    os.environ["FAKE_ENCODER_ERROR_RATE"] = str(args.encoder_error_rate)
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_ERROR_RATE"] = str(args.llm_error_rate)
+    os.environ["FAKE_NOTIFIER_LATENCY"] = str(args.notifier_latency)
+    os.environ["FAKE_NOTIFIER_ERROR_RATE"] = str(args.notifier_error_rate)
+    os.environ["FAKE_MILVUS_LATENCY"] = str(args.milvus_latency)
+
+
+async def drive(client: Any, stream: List[Tuple[Dict[str, Any], Optional[int]]], args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Send the stream with `args.concurrency` requests in flight; latencies
+    and per-object outcomes ("created", "updated", "kept", "error" or an
+    HTTP status).
+    """
+    if args.mode == "batch":
+        requests = [
+            ("/objects/batch", [item[0] for item in stream[i:i + args.batch_size]], range(i, min(i + args.batch_size, len(stream))))
+            for i in range(0, len(stream), args.batch_size)
+        ]
+    else:
+        requests = [("/objects/new", item[0], range(i, i + 1)) for i, item in enumerate(stream)]
+    # serialized up front, so the timed loop does not pay for it
+    bodies = [
+        json.dumps({"objects": payload} if args.mode == "batch" else payload).encode()
+        for _, payload, _ in requests
+    ]
+    latencies: List[float] = []
+    outcomes: List[str] = [""] * len(stream)
+    queue: asyncio.Queue = asyncio.Queue()
+    for n in range(len(requests)):
+        queue.put_nowait(n)
+
+    async def worker() -> None:
+        while not queue.empty():
+            n = queue.get_nowait()
+            path, _, indices = requests[n]
+            start = time.perf_counter()
+            response = await client.post(path, content=bodies[n], headers={"content-type": "application/json"})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                for i in indices:
+                    outcomes[i] = str(response.status_code)
+            elif args.mode == "batch":
+                for i, result in zip(indices, response.json()["results"]):
+                    outcomes[i] = result["status"]
+            else:
+                result = response.json()
+                outcomes[indices[0]] = "kept" if isinstance(result, dict) else {
+                    "new object created": "created", "object updated": "updated"
+                }.get(result, "other")
+            done = len(latencies)
+            if done % max(1, len(requests) // 10) == 0:
+                print(f"  {done}/{len(requests)} requests", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return {"seconds": time.perf_counter() - start, "latencies": latencies, "outcomes": outcomes}
+
+
+def dedup_quality(stream: List[Tuple[Dict[str, Any], Optional[int]]], outcomes: List[str]) -> Dict[str, int]:
+    """
+    Rescans matched to a stored object, and new objects wrongly matched.
+    """
+    matched = ("updated", "kept")
+    rescans = [outcome for (_, original), outcome in zip(stream, outcomes) if original is not None]
+    fresh = [outcome for (_, original), outcome in zip(stream, outcomes) if original is None]
+    return {
+        "rescans": len(rescans),
+        "rescans_matched": sum(outcome in matched for outcome in rescans),
+        "new": len(fresh),
+        "new_matched": sum(outcome in matched for outcome in fresh),
+    }
+
+
+def stage_report(metrics: Any) -> Dict[str, Dict[str, float]]:
+    report = {}
+    for name, histogram, labels in (
+        *((stage, metrics.stage_seconds, {"stage": stage}) for stage in STAGES),
+        *((f"milvus.{op}", metrics.milvus_rpc_seconds, {"op": op}) for op in MILVUS_OPS),
+    ):
+        total, count = histogram.totals(outcome="ok", **labels)
+        _, calls = histogram.totals(**labels)
+        if not calls:
+            continue
+        report[name] = {
+            "count": count,
+            "errors": calls - count,
+            "mean_ms": total / count * 1000 if count else math.nan,
+            "p50_ms": histogram.quantile(0.5, outcome="ok", **labels) * 1000,
+            "p99_ms": histogram.quantile(0.99, outcome="ok", **labels) * 1000,
+        }
+    return report
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    # imported only now: settings and the fakes read the environment
+    # prepared by configure() at import time
+    import httpx
+
+    from app import http_clients, main, metrics, milvus_client
+    from app.fakes import encoder as fake_encoder
+    from app.fakes import llm as fake_llm
+    from app.fakes import notifier as fake_notifier
+    from app.fakes.milvus import FakeCollection
+    from app.profiler import profiler
+
+    # app.main sets up INFO logging, one line per request and call
+    logging.getLogger().setLevel(args.log_level)
+    print(f"generating {args.objects} objects ({args.points} points, {args.dup_ratio:.0%} rescans)", file=sys.stderr)
+    stream = CityScans(args.cities, args.dup_ratio, args.points, args.noise, args.seed).generate(args.objects)
+
+    collection = FakeCollection()
+    milvus_client.use_collection(collection)
+    for downstream, fake in (
+        (http_clients.encoder, fake_encoder.app),
+        (http_clients.llm, fake_llm.app),
+        (http_clients.notifier, fake_notifier.app),
+    ):
+        downstream.transport = httpx.ASGITransport(app=fake, raise_app_exceptions=False)
+
+    await main.app.router.startup()
+    if args.profile:
+        profiler.start(interval=0.005, max_seconds=3600)
+    try:
+        async with httpx.AsyncClient(
+            # unhandled errors become 500 responses, as behind a server
+            transport=httpx.ASGITransport(app=main.app, raise_app_exceptions=False),
+            base_url="http://bench",
+            timeout=None,
+        ) as client:
+            print(f"sending {args.mode} requests, concurrency {args.concurrency}", file=sys.stderr)
+            result = await drive(client, stream, args)
+    finally:
+        if args.profile:
+            profiler.stop()
+            with open(args.profile, "w") as f:
+                f.write(profiler.collapsed())
+        drain_start = time.perf_counter()
+        await main.app.router.shutdown()
+        drain_seconds = time.perf_counter() - drain_start
+
+    latencies = result["latencies"]
+    outcomes: Dict[str, int] = {}
+    for outcome in result["outcomes"]:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return {
+        "config": {
+            key: getattr(args, key) for key in (
+                "objects", "mode", "batch_size", "concurrency", "dup_ratio", "points", "cities",
+                "encoder_latency", "encoder_error_rate", "llm_latency", "llm_error_rate",
+                "notifier_latency", "notifier_error_rate", "milvus_latency", "seed",
+            )
+        },
+        "seconds": result["seconds"],
+        "drain_seconds": drain_seconds,
+        "objects_per_sec": len(stream) / result["seconds"],
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else math.nan,
+        "outcomes": outcomes,
+        "dedup": dedup_quality(stream, result["outcomes"]),
+        "stages": stage_report(metrics),
+        "fakes": {
+            "encoder": fake_encoder.stats(),
+            "llm": fake_llm.stats(),
+            "notifier": fake_notifier.stats(),
+            "milvus": collection.stats(),
+        },
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    config = report["config"]
+    print(
+        f"\n{config['objects']} objects ({config['mode']}, concurrency {config['concurrency']}, "
+        f"{config['dup_ratio']:.0%} rescans, {config['points']} points) in {report['seconds']:.1f}s "
+        f"(+{report['drain_seconds']:.1f}s drain)"
+    )
+    print(
+        f"throughput {report['objects_per_sec']:.1f} objects/s   request p50 {report['p50_ms']:.1f} ms   "
+        f"p99 {report['p99_ms']:.1f} ms   max {report['max_ms']:.1f} ms"
+    )
+    print("outcomes   " + "   ".join(f"{k} {v}" for k, v in sorted(report["outcomes"].items())))
+    dedup = report["dedup"]
+    print(
+        f"dedup      rescans matched {dedup['rescans_matched']}/{dedup['rescans']}   "
+        f"new objects matched {dedup['new_matched']}/{dedup['new']}"
+    )
+    print(f"\n{'stage':<16} {'count':>7} {'errors':>7} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, s in report["stages"].items():
+        print(
+            f"{name:<16} {s['count']:>7} {s['errors']:>7} {s['mean_ms']:>9.2f} "
+            f"{s['p50_ms']:>9.2f} {s['p99_ms']:>9.2f}"
+        )
+    print("\nfakes      " + "   ".join(f"{name} {json.dumps(s)}" for name, s in report["fakes"].items()))
+
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    Headline numbers that got worse than the baseline by more than
+    `max_regression` (a fraction).
+    """
+    found = []
+    changed = sorted(k for k in report["config"] if baseline["config"].get(k) != report["config"][k])
+    if changed:
+        print(f"note: the baseline ran with different {', '.join(changed)}")
+    for key, higher_is_better in (("objects_per_sec", True), ("p50_ms", False), ("p99_ms", False)):
+        old, new = baseline[key], report[key]
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        print(f"{key:<16} baseline {old:>9.2f}   now {new:>9.2f}   {'worse' if change > 0 else 'better'} by {abs(change):.1%}")
+        if change > max_regression:
+            found.append(key)
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--dup-ratio", type=float, default=0.3, help="share of objects that are rescans")
+    parser.add_argument("--points", type=int, default=2000, help="points per cloud")
+    parser.add_argument("--noise", type=float, default=0.01, help="point noise in metres")
+    parser.add_argument("--cities", type=int, default=len(CITIES), choices=range(1, len(CITIES) + 1), metavar=f"1..{len(CITIES)}")
+    parser.add_argument("--mode", choices=("single", "batch"), default="single")
+    parser.add_argument("--batch-size", type=int, default=50, help="objects per /objects/batch request")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--encoder-latency", type=float, default=0.02)
+    parser.add_argument("--encoder-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--notifier-latency", type=float, default=0.01)
+    parser.add_argument("--notifier-error-rate", type=float, default=0.0)
+    parser.add_argument("--milvus-latency", type=float, default=0.0, help="seconds added to every Milvus call")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--profile", help="write collapsed stacks of the run to this file")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--baseline", help="report of an earlier run (--json) to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.1, help="allowed fraction, with --baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="urbanrag-bench-") as state_dir:
+        configure(args, state_dir)
+        report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        failed = regressions(report, baseline, args.max_regression)
+        if failed:
+            print(f"regression over {args.max_regression:.0%}: {', '.join(failed)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())